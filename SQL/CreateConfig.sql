@@ -22,8 +22,24 @@ VALUES
 ,('DetectMobileWidth', '800')
 ,('DetectMobileHeight', '600')
 ,('MaxFileStoreSizeInGB', '2')
+,('MemoryCacheSizeInMB', '512')
+,('PrewarmSessionCaches', '1')
+,('TelemetryBundleSessionTypes', 'Practice,Qualifying')
+,('ApiDownloadWorkers', '8')
+,('LoadPipelineQueueSize', '1')
+,('StreamingIngestion', '0')
+,('ArchiveApiResponses', '0')
+,('ApiArchiveRetentionInDays', '30')
+,('UploadBackend', 'to_sql')
+,('UploadInitialChunkSize', '100000')
+,('UploadMaxConcurrency', '4')
+,('UploadMaxRetries', '6')
+,('PythonMergeSessionTypes', '')
 ,('CacheFileDeleteDelayInHours', '2')
 ,('DatabaseThreadSleepInHours', '0.5')
 ,('CacheThreadSleepInHours', '1')
 ,('ThreadMaxWakeupDelayInSeconds', '60')
-,('HoursToAttemptLoading', '6')
\ No newline at end of file
+,('HoursToAttemptLoading', '6')
+,('LogQueueMaxSize', '10000')
+,('LogFlushBatchSize', '100')
+,('LogFlushIntervalInSeconds', '5')
\ No newline at end of file
@@ -231,6 +231,81 @@ END
 GO
 
 
+DROP PROCEDURE IF EXISTS dbo.Read_UnloadedSchedule
+GO
+CREATE PROCEDURE dbo.Read_UnloadedSchedule
+AS
+BEGIN
+
+	-- Events and sessions that Truncate_Schedule would clear, i.e. those after the most recent event with data
+	-- Compared with the latest schedule by refresh_schedule, so that unchanged events are left in place
+
+	DECLARE @MaxCompletedSessionDate DATETIME
+		,@DeleteFromDate DATETIME
+
+	SET @MaxCompletedSessionDate = (
+		SELECT MAX(SessionDate)
+		FROM dbo.Session
+		WHERE LoadStatus IS NOT NULL
+	)
+
+	SET @DeleteFromDate = (
+		SELECT MAX(SessionDate)
+		FROM dbo.Session AS E
+		INNER JOIN (
+			SELECT EventId
+			FROM dbo.Session
+			WHERE SessionDate = @MaxCompletedSessionDate
+		) AS S
+		ON E.EventId = S.EventId
+	)
+
+	SELECT E.id
+		,E.RoundNumber
+		,E.Country
+		,E.Location
+		,E.OfficialEventName
+		,E.EventDate
+		,E.EventName
+		,E.EventFormat
+		,E.F1ApiSupport
+		,S.EventId
+		,S.SessionName
+		,S.SessionDate
+		,S.SessionOrder
+
+	FROM dbo.Event AS E
+
+	INNER JOIN dbo.Session AS S
+	ON E.id = S.EventId
+
+	WHERE S.SessionDate > @DeleteFromDate
+	OR @DeleteFromDate IS NULL
+
+END
+GO
+
+
+DROP PROCEDURE IF EXISTS dbo.Delete_ScheduleEvents
+GO
+CREATE PROCEDURE dbo.Delete_ScheduleEvents @EventIds VARCHAR(MAX)
+AS
+BEGIN
+
+	-- Removes events, and their sessions, whose schedule has changed since they were loaded
+
+	DELETE
+	FROM dbo.Session
+	WHERE EventId IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(@EventIds, ','))
+
+	DELETE
+	FROM dbo.Event
+	WHERE id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(@EventIds, ','))
+
+END
+GO
+
+
 DROP PROCEDURE IF EXISTS dbo.Get_TelemetryRowCounts
 GO
 CREATE PROCEDURE dbo.Get_TelemetryRowCounts @SessionId INT
@@ -319,6 +394,61 @@ BEGIN
 END
 GO
 
+DROP PROCEDURE IF EXISTS dbo.Delete_TelemetryDataset
+GO
+CREATE PROCEDURE dbo.Delete_TelemetryDataset @SessionId INT, @TableName VARCHAR(MAX)
+AS
+BEGIN
+	-- Clears one raw table for a session, ahead of reloading only that dataset
+	-- Sectors added by Insert_MissingSectors have no SessionId, so sectors are deleted through their laps, before the laps themselves
+	IF @TableName IN ('Lap', 'Sector')
+	BEGIN
+		DELETE S FROM dbo.Sector AS S
+		INNER JOIN dbo.Lap AS L
+		ON S.LapId = L.id
+		WHERE L.SessionId = @SessionId;
+
+		IF @TableName = 'Lap'
+			DELETE FROM dbo.Lap
+			WHERE SessionId = @SessionId
+
+		RETURN
+	END
+
+	DECLARE @sql NVARCHAR(MAX)
+	SET @sql = 'DELETE FROM dbo.' + QUOTENAME(@TableName) + ' WHERE SessionId = @SessionId;'
+	EXEC sp_executesql @sql, N'@SessionId INT', @SessionId = @SessionId
+END
+GO
+
+DROP PROCEDURE IF EXISTS dbo.Read_LoadManifest
+GO
+CREATE PROCEDURE dbo.Read_LoadManifest @SessionIds VARCHAR(MAX)
+AS
+BEGIN
+	-- Per-dataset row counts, content hashes and latest times recorded by the last completed upload of each session
+	SELECT M.SessionId
+		,M.DatasetName
+		,M.[RowCount]
+		,M.ContentHash
+		,M.MaxTime
+
+	FROM dbo.LoadManifest AS M
+
+	WHERE M.SessionId IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(@SessionIds, ','))
+END
+GO
+
+DROP PROCEDURE IF EXISTS dbo.Delete_LoadManifest
+GO
+CREATE PROCEDURE dbo.Delete_LoadManifest @SessionId INT
+AS
+BEGIN
+	DELETE FROM dbo.LoadManifest
+	WHERE SessionId = @SessionId
+END
+GO
+
 DROP PROCEDURE IF EXISTS dbo.Update_SessionLoadStatus
 GO
 CREATE PROCEDURE dbo.Update_SessionLoadStatus @SessionId INT, @Status BIT
@@ -523,6 +653,513 @@ BEGIN
 
 	DELETE FROM dbo.CarData WHERE SessionId IN (SELECT id FROM @SessionsToDelete)
 	DELETE FROM dbo.PositionData WHERE SessionId IN (SELECT id FROM @SessionsToDelete)
+	-- Without its raw telemetry a session can no longer be appended to or confirmed unchanged, so any later load is a full reload
+	DELETE FROM dbo.LoadManifest WHERE SessionId IN (SELECT id FROM @SessionsToDelete)
+
+END
+GO
+
+
+/*
+	Table types and procedures for the bulk upload backend (UploadBackend = 'tvp')
+	Each chunk is inserted in a single statement under a table lock; Azure SQL Database always uses full recovery, so this is still fully logged
+*/
+
+DROP PROCEDURE IF EXISTS dbo.Load_Lap
+GO
+DROP PROCEDURE IF EXISTS dbo.Load_Sector
+GO
+DROP PROCEDURE IF EXISTS dbo.Load_TimingData
+GO
+DROP PROCEDURE IF EXISTS dbo.Load_CarData
+GO
+DROP PROCEDURE IF EXISTS dbo.Load_PositionData
+GO
+DROP PROCEDURE IF EXISTS dbo.Load_TrackStatus
+GO
+DROP PROCEDURE IF EXISTS dbo.Load_SessionStatus
+GO
+DROP PROCEDURE IF EXISTS dbo.Load_DriverInfo
+GO
+DROP PROCEDURE IF EXISTS dbo.Load_WeatherData
+GO
+DROP PROCEDURE IF EXISTS dbo.Load_MergedCarDataStaging
+GO
+DROP TYPE IF EXISTS dbo.LapTableType
+GO
+CREATE TYPE dbo.LapTableType AS TABLE(
+	id INT
+	,SessionId INT
+	,Driver INT
+	,[Time] FLOAT
+	,LapTime FLOAT
+	,NumberOfLaps INT
+	,NumberOfPitStops INT
+	,PitOutTime FLOAT
+	,PitInTime FLOAT
+	,IsPersonalBest BIT
+)
+GO
+
+CREATE PROCEDURE dbo.Load_Lap @Rows dbo.LapTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.Lap WITH (TABLOCK) (
+		id
+		,SessionId
+		,Driver
+		,[Time]
+		,LapTime
+		,NumberOfLaps
+		,NumberOfPitStops
+		,PitOutTime
+		,PitInTime
+		,IsPersonalBest
+	)
+
+	SELECT id
+		,SessionId
+		,Driver
+		,[Time]
+		,LapTime
+		,NumberOfLaps
+		,NumberOfPitStops
+		,PitOutTime
+		,PitInTime
+		,IsPersonalBest
+
+	FROM @Rows
+
+END
+GO
+
+DROP TYPE IF EXISTS dbo.SectorTableType
+GO
+CREATE TYPE dbo.SectorTableType AS TABLE(
+	SessionId INT
+	,Driver INT
+	,LapId INT
+	,SectorNumber INT
+	,SectorTime FLOAT
+	,SectorSessionTime FLOAT
+)
+GO
+
+CREATE PROCEDURE dbo.Load_Sector @Rows dbo.SectorTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.Sector WITH (TABLOCK) (
+		SessionId
+		,Driver
+		,LapId
+		,SectorNumber
+		,SectorTime
+		,SectorSessionTime
+	)
+
+	SELECT SessionId
+		,Driver
+		,LapId
+		,SectorNumber
+		,SectorTime
+		,SectorSessionTime
+
+	FROM @Rows
+
+END
+GO
+
+DROP TYPE IF EXISTS dbo.TimingDataTableType
+GO
+CREATE TYPE dbo.TimingDataTableType AS TABLE(
+	SessionId INT
+	,LapNumber INT
+	,Driver INT
+	,LapTime FLOAT
+	,Stint INT
+	,TotalLaps INT
+	,Compound VARCHAR(MAX)
+	,New BIT
+	,TyresNotChanged BIT
+	,[Time] FLOAT
+	,LapFlags FLOAT
+	,LapCountTime FLOAT
+	,StartLaps FLOAT
+	,OutLap FLOAT
+)
+GO
+
+CREATE PROCEDURE dbo.Load_TimingData @Rows dbo.TimingDataTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.TimingData WITH (TABLOCK) (
+		SessionId
+		,LapNumber
+		,Driver
+		,LapTime
+		,Stint
+		,TotalLaps
+		,Compound
+		,New
+		,TyresNotChanged
+		,[Time]
+		,LapFlags
+		,LapCountTime
+		,StartLaps
+		,OutLap
+	)
+
+	SELECT SessionId
+		,LapNumber
+		,Driver
+		,LapTime
+		,Stint
+		,TotalLaps
+		,Compound
+		,New
+		,TyresNotChanged
+		,[Time]
+		,LapFlags
+		,LapCountTime
+		,StartLaps
+		,OutLap
+
+	FROM @Rows
+
+END
+GO
+
+DROP TYPE IF EXISTS dbo.CarDataTableType
+GO
+CREATE TYPE dbo.CarDataTableType AS TABLE(
+	SessionId INT
+	,Driver INT
+	,[Time] FLOAT
+	,[Date] DATETIME2(3)
+	,RPM INT
+	,Speed INT
+	,Gear INT
+	,Throttle INT
+	,Brake BIT
+	,DRS INT
+	,[Source] VARCHAR(MAX)
+)
+GO
+
+CREATE PROCEDURE dbo.Load_CarData @Rows dbo.CarDataTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.CarData WITH (TABLOCK) (
+		SessionId
+		,Driver
+		,[Time]
+		,[Date]
+		,RPM
+		,Speed
+		,Gear
+		,Throttle
+		,Brake
+		,DRS
+		,[Source]
+	)
+
+	SELECT SessionId
+		,Driver
+		,[Time]
+		,[Date]
+		,RPM
+		,Speed
+		,Gear
+		,Throttle
+		,Brake
+		,DRS
+		,[Source]
+
+	FROM @Rows
+
+END
+GO
+
+DROP TYPE IF EXISTS dbo.PositionDataTableType
+GO
+CREATE TYPE dbo.PositionDataTableType AS TABLE(
+	SessionId INT
+	,Driver INT
+	,[Time] FLOAT
+	,[Date] DATETIME2(3)
+	,[Status] VARCHAR(MAX)
+	,X INT
+	,Y INT
+	,Z INT
+	,[Source] VARCHAR(MAX)
+)
+GO
+
+CREATE PROCEDURE dbo.Load_PositionData @Rows dbo.PositionDataTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.PositionData WITH (TABLOCK) (
+		SessionId
+		,Driver
+		,[Time]
+		,[Date]
+		,[Status]
+		,X
+		,Y
+		,Z
+		,[Source]
+	)
+
+	SELECT SessionId
+		,Driver
+		,[Time]
+		,[Date]
+		,[Status]
+		,X
+		,Y
+		,Z
+		,[Source]
+
+	FROM @Rows
+
+END
+GO
+
+DROP TYPE IF EXISTS dbo.TrackStatusTableType
+GO
+CREATE TYPE dbo.TrackStatusTableType AS TABLE(
+	SessionId INT
+	,[Time] FLOAT
+	,[Status] INT
+	,[Message] VARCHAR(MAX)
+)
+GO
+
+CREATE PROCEDURE dbo.Load_TrackStatus @Rows dbo.TrackStatusTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.TrackStatus WITH (TABLOCK) (
+		SessionId
+		,[Time]
+		,[Status]
+		,[Message]
+	)
+
+	SELECT SessionId
+		,[Time]
+		,[Status]
+		,[Message]
+
+	FROM @Rows
+
+END
+GO
+
+DROP TYPE IF EXISTS dbo.SessionStatusTableType
+GO
+CREATE TYPE dbo.SessionStatusTableType AS TABLE(
+	SessionId INT
+	,[Time] FLOAT
+	,[Status] VARCHAR(MAX)
+)
+GO
+
+CREATE PROCEDURE dbo.Load_SessionStatus @Rows dbo.SessionStatusTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.SessionStatus WITH (TABLOCK) (
+		SessionId
+		,[Time]
+		,[Status]
+	)
+
+	SELECT SessionId
+		,[Time]
+		,[Status]
+
+	FROM @Rows
+
+END
+GO
+
+DROP TYPE IF EXISTS dbo.DriverInfoTableType
+GO
+CREATE TYPE dbo.DriverInfoTableType AS TABLE(
+	SessionId INT
+	,RacingNumber INT
+	,BroadcastName VARCHAR(MAX)
+	,FullName VARCHAR(MAX)
+	,Tla VARCHAR(3)
+	,Line INT
+	,TeamName VARCHAR(MAX)
+	,TeamColour VARCHAR(MAX)
+	,FirstName VARCHAR(MAX)
+	,LastName VARCHAR(MAX)
+	,Reference VARCHAR(MAX)
+	,HeadshotUrl NVARCHAR(MAX)
+	,CountryCode VARCHAR(3)
+	,NameFormat VARCHAR(MAX)
+	,DriverOrder INT
+	,TeamOrder INT
+)
+GO
+
+CREATE PROCEDURE dbo.Load_DriverInfo @Rows dbo.DriverInfoTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.DriverInfo WITH (TABLOCK) (
+		SessionId
+		,RacingNumber
+		,BroadcastName
+		,FullName
+		,Tla
+		,Line
+		,TeamName
+		,TeamColour
+		,FirstName
+		,LastName
+		,Reference
+		,HeadshotUrl
+		,CountryCode
+		,NameFormat
+		,DriverOrder
+		,TeamOrder
+	)
+
+	SELECT SessionId
+		,RacingNumber
+		,BroadcastName
+		,FullName
+		,Tla
+		,Line
+		,TeamName
+		,TeamColour
+		,FirstName
+		,LastName
+		,Reference
+		,HeadshotUrl
+		,CountryCode
+		,NameFormat
+		,DriverOrder
+		,TeamOrder
+
+	FROM @Rows
 
 END
-GO
\ No newline at end of file
+GO
+
+DROP TYPE IF EXISTS dbo.WeatherDataTableType
+GO
+CREATE TYPE dbo.WeatherDataTableType AS TABLE(
+	SessionId INT
+	,[Time] FLOAT
+	,AirTemp FLOAT
+	,Humidity FLOAT
+	,Pressure FLOAT
+	,Rainfall BIT
+	,TrackTemp FLOAT
+	,WindDirection INT
+	,WindSpeed FLOAT
+)
+GO
+
+CREATE PROCEDURE dbo.Load_WeatherData @Rows dbo.WeatherDataTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.WeatherData WITH (TABLOCK) (
+		SessionId
+		,[Time]
+		,AirTemp
+		,Humidity
+		,Pressure
+		,Rainfall
+		,TrackTemp
+		,WindDirection
+		,WindSpeed
+	)
+
+	SELECT SessionId
+		,[Time]
+		,AirTemp
+		,Humidity
+		,Pressure
+		,Rainfall
+		,TrackTemp
+		,WindDirection
+		,WindSpeed
+
+	FROM @Rows
+
+END
+GO
+
+DROP TYPE IF EXISTS dbo.MergedCarDataStagingTableType
+GO
+CREATE TYPE dbo.MergedCarDataStagingTableType AS TABLE(
+	SessionId INT
+	,Driver INT
+	,LapId INT
+	,SectorNumber INT
+	,[Time] FLOAT
+	,RPM INT
+	,Speed INT
+	,Gear INT
+	,Throttle INT
+	,Brake BIT
+	,DRS INT
+)
+GO
+
+CREATE PROCEDURE dbo.Load_MergedCarDataStaging @Rows dbo.MergedCarDataStagingTableType READONLY
+AS
+BEGIN
+	SET NOCOUNT ON;
+
+	INSERT INTO dbo.MergedCarDataStaging WITH (TABLOCK) (
+		SessionId
+		,Driver
+		,LapId
+		,SectorNumber
+		,[Time]
+		,RPM
+		,Speed
+		,Gear
+		,Throttle
+		,Brake
+		,DRS
+	)
+
+	SELECT SessionId
+		,Driver
+		,LapId
+		,SectorNumber
+		,[Time]
+		,RPM
+		,Speed
+		,Gear
+		,Throttle
+		,Brake
+		,DRS
+
+	FROM @Rows
+
+END
+GO
@@ -1,14 +1,71 @@
 USE F1DashStreamline
 
 
-DROP PROCEDURE IF EXISTS dbo.Read_CarData
+DROP PROCEDURE IF EXISTS dbo.Read_CarDataLaps
 GO
-CREATE PROCEDURE dbo.Read_CarData @EventId INT, @SessionName VARCHAR(MAX), @LapIdA INT, @LapIdB INT
+CREATE PROCEDURE dbo.Read_CarDataLaps @EventId INT, @SessionName VARCHAR(MAX), @LapIds VARCHAR(MAX)
 AS
 BEGIN
 
 	/*
-		Car data for inputs graph
+		Car data for inputs graph, for a comma separated list of LapIds.
+		Only laps from the session being viewed are returned; session time offsets are applied by the app.
+	*/
+
+	SELECT L.SessionId
+		,L.Driver
+		,L.LapId
+		,L.NumberOfLaps
+		,L.StintNumber
+		,L.LapsInStint
+		,L.IsPersonalBest
+		,L.Compound
+		,L.CleanLap
+		,T.SectorNumber
+		,T.[Time] AS SessionTime
+		,T.RPM
+		,T.Speed
+		,T.Gear
+		,T.Throttle
+		,T.Brake
+		,D.Tla
+		,D.TeamColour
+		,D.DriverOrder
+
+	FROM STRING_SPLIT(@LapIds, ',') AS LI
+
+	INNER JOIN dbo.MergedLapData AS L
+	ON L.LapId = CAST(LI.value AS INT)
+
+	INNER JOIN dbo.MergedCarData AS T
+	ON L.SessionId = T.SessionId
+	AND L.LapId = T.LapId
+
+	INNER JOIN dbo.DriverInfo AS D
+	ON L.SessionId = D.SessionId
+	AND L.Driver = D.RacingNumber
+
+	INNER JOIN dbo.Session AS S
+	ON L.SessionId = S.id
+
+	WHERE S.EventId = @EventId
+	AND (
+		S.SessionName = @SessionName
+		OR LEFT(S.SessionName, 8) = 'Practice' AND @SessionName = 'Practice (all)'
+	)
+
+END
+GO
+
+
+DROP PROCEDURE IF EXISTS dbo.Read_CarDataSession
+GO
+CREATE PROCEDURE dbo.Read_CarDataSession @EventId INT, @SessionName VARCHAR(MAX)
+AS
+BEGIN
+
+	/*
+		Car data for every lap in a session, for the app's telemetry bundle
 	*/
 
 	SELECT L.Driver
@@ -50,12 +107,11 @@ BEGIN
 		SessionName = @SessionName
 		OR LEFT(SessionName, 8) = 'Practice' AND @SessionName = 'Practice (all)'
 	)
-	AND (
-		T.LapId = @LapIdA
-		OR T.LapId = @LapIdB
-	)
 	AND T.LapId IS NOT NULL
 
+	ORDER BY T.LapId ASC
+		,T.[Time] ASC
+
 END
 GO
 
@@ -618,4 +674,31 @@ BEGIN
 	)
 
 END
-GO
\ No newline at end of file
+GO
+
+
+DROP PROCEDURE IF EXISTS dbo.Read_SessionOffsets
+GO
+CREATE PROCEDURE dbo.Read_SessionOffsets @EventId INT, @SessionName VARCHAR(MAX)
+AS
+BEGIN
+
+	/*
+		Session time offsets for each session in a combined session (i.e. practices).
+		Used to assemble combined datasets from cached single session datasets.
+	*/
+
+	SELECT SO.SessionId
+		,S.SessionName
+		,SO.SessionOrder
+		,SO.SessionTimeOffset
+
+	FROM dbo.Session AS S
+
+	INNER JOIN dbo.SessionOffsets(@EventId, @SessionName) AS SO
+	ON S.id = SO.SessionId
+
+	ORDER BY SO.SessionOrder ASC
+
+END
+GO
@@ -205,6 +205,18 @@ CREATE TABLE dbo.WeatherData(
 CREATE CLUSTERED INDEX IndexSessionIdId ON dbo.WeatherData (SessionId, Id)
 
 
+DROP TABLE IF EXISTS dbo.LoadManifest
+CREATE TABLE dbo.LoadManifest(
+	SessionId INT
+	,DatasetName VARCHAR(50)
+	,[RowCount] INT
+	,ContentHash VARCHAR(64)
+	,MaxTime FLOAT
+	,CreatedDateTime DATETIME DEFAULT GETDATE()
+)
+CREATE CLUSTERED INDEX IndexSessionIdDatasetName ON dbo.LoadManifest (SessionId, DatasetName)
+
+
 DROP TABLE IF EXISTS dbo.MergedLapData
 CREATE TABLE dbo.MergedLapData(
 	SessionId INT
@@ -248,6 +260,24 @@ CREATE TABLE dbo.MergedCarData(
 CREATE CLUSTERED INDEX IndexSessionIdLapIdSectorNumber ON dbo.MergedCarData (SessionId, LapId, SectorNumber)
 
 
+-- Python car data merge output, swapped into dbo.MergedCarData once the whole session is written
+DROP TABLE IF EXISTS dbo.MergedCarDataStaging
+CREATE TABLE dbo.MergedCarDataStaging(
+	SessionId INT
+	,Driver INT
+	,LapId INT
+	,SectorNumber INT
+	,[Time] FLOAT
+	,RPM INT
+	,Speed INT
+	,Gear INT
+	,Throttle INT
+	,Brake BIT
+	,DRS INT
+)
+CREATE CLUSTERED INDEX IndexSessionId ON dbo.MergedCarDataStaging (SessionId)
+
+
 DROP TABLE IF EXISTS dbo.TrackMap
 CREATE TABLE dbo.TrackMap(
 	EventId INT
@@ -466,6 +466,145 @@ END
 GO
 
 
+DROP PROCEDURE IF EXISTS dbo.Read_CarDataToMerge
+GO
+CREATE PROCEDURE dbo.Read_CarDataToMerge @SessionId INT, @Driver INT
+AS
+BEGIN
+
+	/*
+		Inputs for the Python car data merge (car_data_merge.py), an alternative to dbo.Merge_CarData
+		Car data is read one driver at a time to bound the memory used
+	*/
+
+	SELECT SessionId
+		,Driver
+		,[Time]
+		,RPM
+		,Speed
+		,Gear
+		,Throttle
+		,Brake
+		,DRS
+
+	FROM dbo.CarData
+
+	WHERE SessionId = @SessionId
+	AND Driver = @Driver
+
+END
+GO
+
+
+DROP PROCEDURE IF EXISTS dbo.Read_LapBoundaries
+GO
+CREATE PROCEDURE dbo.Read_LapBoundaries @SessionId INT
+AS
+BEGIN
+
+	SELECT Driver
+		,LapId
+		,TimeStart
+		,TimeEnd
+
+	FROM dbo.MergedLapData
+
+	WHERE SessionId = @SessionId
+
+END
+GO
+
+
+DROP PROCEDURE IF EXISTS dbo.Read_SectorBoundaries
+GO
+CREATE PROCEDURE dbo.Read_SectorBoundaries @SessionId INT
+AS
+BEGIN
+
+	-- Running sector sums as used by dbo.Merge_CarData
+	SELECT LapId
+		,SectorNumber
+		,SUM(SectorTime) OVER(PARTITION BY LapId ORDER BY SectorNumber ASC) AS SectorTimeCumulative
+
+	FROM dbo.Sector
+
+	WHERE SessionId = @SessionId
+
+END
+GO
+
+
+DROP PROCEDURE IF EXISTS dbo.Delete_MergedCarDataStaging
+GO
+CREATE PROCEDURE dbo.Delete_MergedCarDataStaging @SessionId INT
+AS
+BEGIN
+
+	DELETE
+	FROM dbo.MergedCarDataStaging
+	WHERE SessionId = @SessionId
+
+END
+GO
+
+
+DROP PROCEDURE IF EXISTS dbo.Swap_MergedCarData
+GO
+CREATE PROCEDURE dbo.Swap_MergedCarData @SessionId INT
+AS
+BEGIN
+
+	/*
+		Replaces a session's merged car data with the staged output of the Python merge in one transaction,
+		so readers never see it part written
+	*/
+
+	SET XACT_ABORT ON
+	BEGIN TRANSACTION
+
+	DELETE
+	FROM dbo.MergedCarData
+	WHERE SessionId = @SessionId
+
+	INSERT INTO dbo.MergedCarData(
+		SessionId
+		,Driver
+		,LapId
+		,SectorNumber
+		,[Time]
+		,RPM
+		,Speed
+		,Gear
+		,Throttle
+		,Brake
+		,DRS
+	)
+	SELECT SessionId
+		,Driver
+		,LapId
+		,SectorNumber
+		,[Time]
+		,RPM
+		,Speed
+		,Gear
+		,Throttle
+		,Brake
+		,DRS
+
+	FROM dbo.MergedCarDataStaging
+
+	WHERE SessionId = @SessionId
+
+	DELETE
+	FROM dbo.MergedCarDataStaging
+	WHERE SessionId = @SessionId
+
+	COMMIT TRANSACTION
+
+END
+GO
+
+
 DROP PROCEDURE IF EXISTS dbo.Merge_CarDataNorms
 GO
 CREATE PROCEDURE dbo.Merge_CarDataNorms @SessionId INT
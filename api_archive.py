@@ -0,0 +1,101 @@
+import os
+import re
+import time
+import gzip
+import shutil
+import hashlib
+import pickle
+import threading
+
+
+# Local archive of raw FastF1 API responses, one compressed pickle per session and endpoint
+# Written on download when enabled and the response has changed, and read in place of the API when loading in replay mode
+directory = "./api_archive/"
+enabled = False
+
+# Low gzip compression keeps archiving from slowing down the load; raw telemetry still compresses well
+compression_level = 3
+
+# Stored in place of a response when the API reports the session as unavailable
+unavailable = "SessionNotAvailable"
+
+# Session archives not written to for this long are removed by cleanup; 0 keeps them indefinitely
+retention_in_days = 30
+
+
+def archive_path(api_string, endpoint):
+    # e.g. ./api_archive/2023_2023-07-23_Hungarian_Grand_Prix_2023-07-21_Practice_1/car_data.pkl.gz
+    return directory + re.sub(r"[^A-Za-z0-9\-]+", "_", api_string).strip("_") + "/" + endpoint + ".pkl.gz"
+
+
+def archive_exists(api_string, endpoint):
+    return os.path.exists(archive_path(api_string, endpoint))
+
+
+def digest_path(path):
+    # Hash of the pickled response alongside its archive, so unchanged responses aren't compressed and written again
+    return path + ".sha256"
+
+
+def read_digest(path):
+    try:
+        with open(digest_path(path), "r") as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def write_response(api_string, endpoint, response):
+    # None is archived as unavailable, so replay reproduces the same aborts
+    # Returns False without writing if the archive already holds the same response, as on most ETL cycles
+    path = archive_path(api_string, endpoint)
+    data = pickle.dumps(unavailable if response is None else response, protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha256(data).hexdigest()
+    if os.path.exists(path) and read_digest(path) == digest:
+        return False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so a failed or concurrent write never leaves a partial archive
+    # The digest is written last, so an interrupted write is redone rather than skipped next time
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(temp_path, "wb", compresslevel=compression_level) as file:
+        file.write(data)
+    os.replace(temp_path, path)
+    with open(temp_path, "w") as file:
+        file.write(digest)
+    os.replace(temp_path, digest_path(path))
+
+    return True
+
+
+def read_response(api_string, endpoint):
+    # Returns None if the session was unavailable when archived
+    # Raises FileNotFoundError if the response was never archived, rather than treating it as unavailable
+    with gzip.open(archive_path(api_string, endpoint), "rb") as file:
+        response = pickle.load(file)
+
+    if isinstance(response, str) and response == unavailable:
+        return None
+
+    return response
+
+
+def cleanup():
+    # Removes session archives last written to longer ago than the retention period, returning how many were removed
+    if retention_in_days <= 0 or not os.path.exists(directory):
+        return 0
+
+    current_time = time.time()
+    retention_in_seconds = retention_in_days * 24 * 60 * 60
+    deleted_count = 0
+    for session_directory in os.listdir(directory):
+        path = directory + session_directory
+        try:
+            modified_time = os.path.getmtime(path)
+        except OSError:
+            continue
+        if current_time - modified_time > retention_in_seconds:
+            shutil.rmtree(path, ignore_errors=True)
+            deleted_count += 1
+
+    return deleted_count
@@ -1,14 +1,21 @@
 from dash import dcc, html, Input, Output, State, dash_table, callback_context, no_update
 from dash.exceptions import PreventUpdate
-from dash_extensions.enrich import DashProxy, ServersideOutput, ServersideOutputTransform
+from dash_extensions.enrich import DashProxy
 import dash_bootstrap_components as dbc
 import json
+import pandas as pd
 import threading
 import read_database
+import logging_queue
 import layouts
 import file_store
 import visuals
+import figures
 import thread_checkin
+import update_database
+import api_archive
+import upload_controller
+import car_data_merge
 
 
 def filter_dict_from_inputs(input_dict):
@@ -62,11 +69,28 @@ read_database.app_logging("app", "startup", "App starting")
 
 config = read_database.get_app_config()
 
+logging_queue.max_queue_size = int(config["LogQueueMaxSize"])
+logging_queue.flush_batch_size = int(config["LogFlushBatchSize"])
+logging_queue.flush_interval_in_seconds = float(config["LogFlushIntervalInSeconds"])
+
 file_store.size_limit_in_GB = float(config["MaxFileStoreSizeInGB"])
+file_store.memory_cache_size_limit_in_MB = float(config["MemoryCacheSizeInMB"])
 file_store.delete_files(delete_all=True)
 light_version = config['RunLightVersion'] == "1"
 layouts.light_version = light_version
 read_database.light_version = light_version
+update_database.prewarm_caches = config["PrewarmSessionCaches"] == "1"
+update_database.api_download_workers = int(config["ApiDownloadWorkers"])
+update_database.load_pipeline_queue_size = int(config["LoadPipelineQueueSize"])
+update_database.streaming_ingestion = config["StreamingIngestion"] == "1"
+api_archive.enabled = config["ArchiveApiResponses"] == "1"
+api_archive.retention_in_days = float(config["ApiArchiveRetentionInDays"])
+update_database.upload_backend = config["UploadBackend"]
+upload_controller.state["chunk_size"] = int(config["UploadInitialChunkSize"])
+upload_controller.max_concurrency = int(config["UploadMaxConcurrency"])
+upload_controller.max_retries = int(config["UploadMaxRetries"])
+read_database.telemetry_bundle_session_types = [session_type.strip() for session_type in config["TelemetryBundleSessionTypes"].split(",") if session_type.strip() != ""]
+car_data_merge.session_types = [session_type.strip() for session_type in config["PythonMergeSessionTypes"].split(",") if session_type.strip() != ""]
 
 max_thread_wakeup_delay = int(config['ThreadMaxWakeupDelayInSeconds'])
 
@@ -99,8 +123,7 @@ if config["EnableCacheCleanupThread"] == "1":
 dash_app = DashProxy(__name__,
     meta_tags=[
         {"name": "viewport", "content": "width=device-width, initial-scale=1"}
-    ],
-    transforms=[ServersideOutputTransform()]
+    ]
 )
 app = dash_app.server
 dash_app.title = "F1Dash"
@@ -324,33 +347,28 @@ def request_datasets(load_click, clear_crossfilters_click, event_id, session_nam
         return no_update, no_update, no_update, no_update
 
 
-# Load session datasets to store
+# Load session datasets to file store
 @dash_app.callback(
-    ServersideOutput("datasets", "data", session_check=False),
-    Input("selected_session", "data"),
-    memoize = True
+    Output("datasets", "data"),
+    Input("selected_session", "data")
 )
 def load_datasets(selected_session):
 
-    # Note: Adding client info state into this callback would prevent sharing of cache between sessions 
-    # because it would appear as a distinct arg to ServersideOutput
+    # Datasets are written to a per-session snapshot in the file store and shared between all clients
+    # The client only holds a handle, and each callback reads just the datasets it needs
 
     if selected_session == None:
-        return (
-            no_update,
-            no_update,
-            no_update
-        )
+        return no_update
     else:
         selected_session = json.loads(selected_session)
         event_id = selected_session["EventId"]
         session_name = selected_session["SessionName"]
         
-        data_dict = read_database.read_session_data(event_id, session_name)
-        
-        return (
-            data_dict
-        )
+        handle = read_database.prepare_session_datasets(event_id, session_name)
+        # Build filter indexes and split the track map now, rather than in the first visual callbacks
+        read_database.get_session_datasets(handle, read_database.filter_indexed_dataset_names + ["track_map"])
+
+        return handle
 
 
 # Update heading and loaded session keys on dataset reload
@@ -427,7 +445,8 @@ def team_filter_dropdown_refresh(datasets):
     if datasets is None:
         return no_update, no_update
     else:
-        return visuals.get_filter_options(datasets["session_drivers"], {}, ("TeamName", "TeamName")), []
+        session_drivers = read_database.get_session_datasets(datasets, ["session_drivers"])["session_drivers"]
+        return visuals.get_filter_options(session_drivers, {}, ("TeamName", "TeamName")), []
 
 @dash_app.callback(
     Output("driver_filter_dropdown", "options"),
@@ -439,7 +458,8 @@ def driver_filter_dropdown_refresh(team_filter_values, datasets):
         return no_update
     else:
         filter = {} if team_filter_values is None or team_filter_values == [] else {"TeamName": team_filter_values}
-        return visuals.get_filter_options(datasets["session_drivers"], filter, ("Tla", "RacingNumber"))
+        session_drivers = read_database.get_session_datasets(datasets, ["session_drivers"])["session_drivers"]
+        return visuals.get_filter_options(session_drivers, filter, ("Tla", "RacingNumber"))
 
 @dash_app.callback(
     Output("driver_filter_dropdown", "value"),
@@ -453,7 +473,7 @@ def driver_filter_values_refresh(team_filter_values, datasets, driver_filter_val
     elif callback_context.triggered[0]["prop_id"].split(".")[0] == "datasets":
         return []
     else:
-        session_drivers = datasets["session_drivers"]
+        session_drivers = read_database.get_session_datasets(datasets, ["session_drivers"])["session_drivers"]
         driver_filter_values = [] if driver_filter_values is None else driver_filter_values
         valid_drivers = list(session_drivers[(session_drivers["TeamName"].isin(driver_filter_values))]["RacingNumber"])
         return [driver for driver in driver_filter_values if driver in valid_drivers]
@@ -467,7 +487,8 @@ def compound_filter_dropdown_refresh(datasets):
     if datasets is None:
         return no_update, no_update
     else:
-        return visuals.get_filter_options(datasets["lap_times"], {}, ("Compound", "Compound")), []
+        lap_times = read_database.get_session_datasets(datasets, ["lap_times"])["lap_times"]
+        return visuals.get_filter_options(lap_times, {}, ("Compound", "Compound")), []
 
 
 
@@ -519,8 +540,9 @@ def lap_plot_refresh(
                 "SectorOrZoneNumber": track_map_selection,
                 "TimeFilter": conditions_plot_selection
             })
+        data_dict = read_database.get_session_datasets(datasets, ["lap_times", "sector_times"])
         return (
-            visuals.build_lap_plot(datasets, filters, client_info),
+            visuals.build_lap_plot(data_dict, filters, client_info),
             True
         )
 
@@ -578,7 +600,8 @@ def track_map_refresh(
                 "SectorOrZoneNumber": track_map_selection,
                 "TimeFilter": conditions_plot_selection
             })
-        track_map, track_map_readout = visuals.build_track_map(datasets, filters, client_info)
+        data_dict = read_database.get_session_datasets(datasets, ["track_map", "lap_times", "sector_times"])
+        track_map, track_map_readout = visuals.build_track_map(data_dict, filters, client_info)
         return (
             track_map,
             track_map_readout,
@@ -633,14 +656,23 @@ def stint_graph_refresh(
                 "SectorOrZoneNumber": track_map_selection,
                 "TimeFilter": conditions_plot_selection
             })
+        data_dict = read_database.get_session_datasets(datasets, ["lap_times", "sector_times"])
         return (
-            visuals.build_stint_graph(datasets, filters, client_info),
+            visuals.build_stint_graph(data_dict, filters, client_info),
             True
         )
 
 
 # Inputs graph
 
+def get_stored_telemetry(stored_telemetry):
+    # Only one or two laps are plotted; any other selection gets the graph's prompt to filter laps
+    lap_ids = stored_telemetry["LapIds"]
+    if not 2 >= len(lap_ids) > 0:
+        return pd.DataFrame()
+    return read_database.get_lap_telemetry(stored_telemetry["EventId"], stored_telemetry["SessionName"], lap_ids)
+
+
 @dash_app.callback(
     Output("inputs_graph", "figure"),
     Output("input_trace_selector_div", "hidden"),
@@ -703,16 +735,26 @@ def inputs_graph_refresh(
                 "input_trace": input_trace_selector_values
             })
         
+        # Telemetry stays server side in the per-lap cache; the client only holds the session and lap ids
         if callback_context.triggered[0]["prop_id"].split(".")[0] in ["input_trace_selector", "track_map"]:
-            data = stored_telemetry
+            if stored_telemetry is None:
+                data = None
+            else:
+                data = get_stored_telemetry(stored_telemetry)
             stored_telemetry_output = no_update
         else:
             selected_session = json.loads(selected_session)
-            lap_ids = filters["LapId"] if "LapId" in filters else [-1]
-            data = read_database.read_car_data(selected_session["EventId"], selected_session["SessionName"], lap_ids)
-            stored_telemetry_output = data.to_dict("records")
-
-        figure, data_displayed = visuals.build_inputs_graph(datasets, filters, client_info, data)
+            stored_telemetry_output = {
+                "EventId": selected_session["EventId"],
+                "SessionName": selected_session["SessionName"],
+                "LapIds": filters["LapId"] if "LapId" in filters else []
+            }
+            data = get_stored_telemetry(stored_telemetry_output)
+            if len(data) > 0:
+                read_database.app_logging(str(client_info), "telemetry_payload", f"{len(data)} rows: {len(json.dumps(stored_telemetry_output))} bytes stored client side, {int(data.memory_usage().sum())} bytes server side")
+
+        data_dict = read_database.get_session_datasets(datasets, ["car_data_norms"])
+        figure, data_displayed = visuals.build_inputs_graph(data_dict, filters, client_info, data)
 
         return (
             figure,
@@ -736,7 +778,8 @@ def conditions_plot_refresh(datasets, conditions_plot_selection, conditions_plot
     else:
         calling_props = [x["prop_id"].split(".")[0] for x in callback_context.triggered]
         if "datasets" in calling_props:
-            return visuals.build_conditions_plot(datasets, client_info)
+            data_dict = read_database.get_session_datasets(datasets, ["conditions_data"])
+            return visuals.build_conditions_plot(data_dict, client_info)
         else:
             filter = filter_dict_from_inputs({
                 "TimeFilter": conditions_plot_selection
@@ -749,4 +792,5 @@ def conditions_plot_refresh(datasets, conditions_plot_selection, conditions_plot
         
 if __name__ == "__main__":
     # Azure host will not run this
+    figures.validate_figures = True
     dash_app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,566 @@
+import os
+import sys
+import types
+import socket
+import subprocess
+import time
+import shutil
+import tempfile
+import json
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.graph_objects as go
+import visuals
+import figures
+import filter_index
+import file_store
+import api_archive
+import car_data_merge
+
+
+# Benchmarks for dashboard hot paths, run against a synthetic race-sized session
+# Usage: python benchmarks.py [benchmark_name ...]
+
+
+# Revision whose modules are the reference for output and timings; defaults to the repository's first commit
+baseline_revision = os.environ.get("BENCHMARK_BASELINE")
+baseline_modules = {}
+
+
+def git(*args):
+    return subprocess.run(["git", *args], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout
+
+
+def baseline_module(module_name):
+    # A module as it was at the baseline revision, loaded from git rather than kept as a copy here
+    if module_name not in baseline_modules:
+        revision = baseline_revision or git("rev-list", "--max-parents=0", "HEAD").split()[0]
+        source = git("show", f"{revision}:{module_name}.py")
+        module = types.ModuleType("baseline_" + module_name)
+        exec(compile(source, f"{revision}:{module_name}.py", "exec"), module.__dict__)
+        baseline_modules[module_name] = module
+
+    return baseline_modules[module_name]
+
+
+def database_configured():
+    # Mirrors sql_connection's host check, which raises at import where no connection string is set
+    return "DESKTOP" in socket.gethostname() or "CUSTOMCONNSTR_F1DashSqlAlchemy" in os.environ
+
+
+def build_race_session(drivers=20, laps=70, seed=0):
+    # Lap and sector times shaped like the Read_LapTimes and Read_SectorTimes outputs
+    rng = np.random.default_rng(seed)
+    teams = ["Team " + chr(ord("A") + i) for i in range(drivers // 2)]
+    compounds = ["Soft", "Medium", "Hard"]
+    lap_ns = 90 * 1000000000
+
+    lap_rows = []
+    lap_id = 0
+    stint_id = 0
+    for i in range(drivers):
+        driver = i + 1
+        pit_laps = sorted(rng.choice(np.arange(10, laps - 5), size=2, replace=False))
+        stint_number = 1
+        laps_in_stint = 0
+        session_time = 0
+        stint_id += 1
+        for lap_number in range(1, laps + 1):
+            if lap_number - 1 in pit_laps:
+                stint_number += 1
+                laps_in_stint = 0
+                stint_id += 1
+            laps_in_stint += 1
+            lap_id += 1
+            lap_time = lap_ns + int(rng.normal(0, 1) * 1000000000)
+            session_time += lap_time
+            lap_rows.append({
+                "Driver": driver,
+                "LapId": lap_id,
+                "NumberOfLaps": lap_number,
+                "StintId": stint_id,
+                "StintNumber": stint_number,
+                "LapsInStint": laps_in_stint,
+                "IsPersonalBest": False,
+                "Compound": compounds[(stint_number - 1) % len(compounds)],
+                "TyreAge": laps_in_stint,
+                "CleanLap": bool(rng.random() > 0.1),
+                "SessionTime": float(session_time),
+                "LapTime": float(lap_time),
+                "Tla": f"D{driver:02d}",
+                "TeamName": teams[i // 2],
+                "TeamColour": format(i * 12345 % 0xFFFFFF, "06x"),
+                "TeamOrder": i // 2 + 1,
+                "DriverOrder": i + 1
+            })
+
+    lap_times = pd.DataFrame(lap_rows)
+    personal_bests = lap_times.groupby("Driver")["LapTime"].transform("min")
+    lap_times["IsPersonalBest"] = lap_times["LapTime"] == personal_bests
+
+    sector_times = lap_times.loc[lap_times.index.repeat(3)].drop(columns="LapTime").reset_index(drop=True)
+    sector_times["SectorNumber"] = np.tile([1, 2, 3], len(lap_times))
+    sector_times["SectorTime"] = np.repeat(lap_times["LapTime"].to_numpy() / 3, 3) + rng.normal(0, 1, len(sector_times)) * 100000000
+    sector_columns = [column for column in lap_times.columns if column != "LapTime"]
+    sector_times = sector_times[sector_columns[:11] + ["SectorNumber", "SectorTime"] + sector_columns[11:]]
+
+    # Circular track split into three sectors
+    samples = np.arange(600)
+    track_map = pd.DataFrame({
+        "SampleId": samples,
+        "X": np.cos(samples / 600 * 2 * np.pi) * 5000,
+        "Y": np.sin(samples / 600 * 2 * np.pi) * 3000,
+        "SectorNumber": samples // 200 + 1
+    }).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    # Weather samples once a minute, with a safety car period in the middle
+    weather_times = np.arange(0, lap_times["SessionTime"].max(), 60 * 1000000000, dtype="float64")
+    track_status_ids = np.where(weather_times < weather_times[-1] * 0.4, 1, np.where(weather_times < weather_times[-1] * 0.5, 2, 3))
+    conditions_data = pd.DataFrame({
+        "SessionId": 1,
+        "SessionTime": weather_times,
+        "AirTemp": np.round(25 + rng.normal(0, 0.5, len(weather_times)), 1),
+        "Humidity": np.round(0.4 + rng.normal(0, 0.01, len(weather_times)), 2),
+        "Pressure": 1010.0,
+        "Rainfall": 0.0,
+        "TrackTemp": np.round(40 + rng.normal(0, 1, len(weather_times)), 1),
+        "WindDirection": rng.integers(0, 360, len(weather_times)),
+        "WindSpeed": np.round(rng.random(len(weather_times)) * 3, 1),
+        "TrackStatusId": track_status_ids,
+        "TrackStatus": np.where(track_status_ids == 2, "SCDeployed", "AllClear"),
+        "Laps": rng.integers(5, 20, len(weather_times))
+    })
+
+    return {
+        "track_map": track_map,
+        "lap_times": lap_times,
+        "sector_times": sector_times,
+        "conditions_data": conditions_data
+    }
+
+
+def figure_json(fig):
+    # Parsed figure JSON for comparing builders; plain dict figures are validated through go.Figure first
+    if isinstance(fig, dict):
+        fig = go.Figure(fig)
+    return json.loads(fig.to_json())
+
+
+def time_call(function, repeats):
+    # Best of several runs, in ms
+    timings = []
+    for i in range(repeats):
+        time_start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - time_start)
+
+    return min(timings) * 1000
+
+
+def benchmark_filter_data(repeats=50):
+    data_dict = build_race_session()
+    session_time = data_dict["lap_times"]["SessionTime"]
+    lap_ids = list(data_dict["lap_times"]["LapId"].sample(40, random_state=0))
+    stint_ids = list(data_dict["lap_times"]["StintId"].unique()[:10])
+
+    filter_sets = {
+        "clean laps": {"CleanLap": [True]},
+        "team + compound": {"TeamName": ["Team A", "Team C"], "Compound": ["Soft"], "CleanLap": [True]},
+        "drivers + laps": {"Driver": [1, 2, 5, 9], "LapId": lap_ids},
+        "stints + time": {"StintId": stint_ids, "TimeFilter": (session_time.quantile(0.2), session_time.quantile(0.6))},
+        "sector selection": {"Driver": [3, 4], "SectorNumber": [2], "CleanLap": [True]}
+    }
+
+    print(f"filter_data: {len(data_dict['lap_times'])} laps, {len(data_dict['sector_times'])} sector rows")
+
+    time_start = time.perf_counter()
+    data_dict.pop("track_map")
+    data_dict.pop("conditions_data")
+    indexes = {dataset_name: filter_index.build_filter_index(data_dict[dataset_name]) for dataset_name in data_dict}
+    print(f"  index build: {(time.perf_counter() - time_start) * 1000:.2f} ms")
+
+    for dataset_name in data_dict:
+        data = data_dict[dataset_name]
+        for filter_name, filters in filter_sets.items():
+            scan = visuals.filter_data(data, filters)
+            indexed = visuals.filter_data(data, filters, [], indexes[dataset_name])
+            pd.testing.assert_frame_equal(scan, indexed)
+
+            scan_ms = time_call(lambda: visuals.filter_data(data, filters), repeats)
+            indexed_ms = time_call(lambda: visuals.filter_data(data, filters, [], indexes[dataset_name]), repeats)
+            print(f"  {dataset_name:<13}{filter_name:<18}scan {scan_ms:7.3f} ms   indexed {indexed_ms:7.3f} ms   ({len(scan)} rows)")
+
+
+def benchmark_lap_plot(repeats=5):
+    # Practice (all) sized session: three practices' worth of laps per driver
+    data_dict = build_race_session(laps=300)
+    client_info = {"isMobile": False, "height": 1080}
+    lap_ids = list(data_dict["lap_times"]["LapId"].sample(10, random_state=0))
+
+    filter_sets = {
+        "no filters": {},
+        "clean laps": {"CleanLap": [True]},
+        "lap selection": {"CleanLap": [True], "LapId": lap_ids},
+        "sector": {"SectorNumber": [2]}
+    }
+
+    baseline_visuals = baseline_module("visuals")
+
+    print(f"build_lap_plot: {len(data_dict['lap_times'])} laps")
+    for filter_name, filters in filter_sets.items():
+        baseline_figure = baseline_visuals.build_lap_plot(data_dict, filters, client_info)
+        figure = visuals.build_lap_plot(data_dict, filters, client_info)
+        assert figure_json(baseline_figure) == figure_json(figure), f"build_lap_plot output differs for {filter_name}"
+
+        baseline_ms = time_call(lambda: baseline_visuals.build_lap_plot(data_dict, filters, client_info), repeats)
+        vectorised_ms = time_call(lambda: visuals.build_lap_plot(data_dict, filters, client_info), repeats)
+        print(f"  {filter_name:<18}baseline {baseline_ms:8.1f} ms   vectorised {vectorised_ms:8.1f} ms")
+
+
+def benchmark_track_map(repeats=10):
+    data_dict = build_race_session()
+    data_dict["track_sections"] = filter_index.split_track_map(data_dict["track_map"])
+    client_info = {"isMobile": False, "height": 1080}
+    lap_ids = list(data_dict["lap_times"]["LapId"].sample(10, random_state=0))
+
+    filter_sets = {
+        "fastest per sector": {"CleanLap": [True], "track_split": ["sectors"]},
+        "selected laps": {"CleanLap": [True], "track_split": ["sectors"], "LapId": lap_ids},
+        "single lap": {"track_split": ["sectors"], "LapId": lap_ids[:1]},
+        "sector selection": {"track_split": ["sectors"], "SectorNumber": [2], "Driver": [1, 2, 3]}
+    }
+
+    baseline_visuals = baseline_module("visuals")
+
+    print(f"build_track_map: {len(data_dict['sector_times'])} sector rows, {len(data_dict['track_map'])} track samples")
+    for filter_name, filters in filter_sets.items():
+        baseline_figure, baseline_readout = baseline_visuals.build_track_map(data_dict, filters, client_info)
+        figure, readout = visuals.build_track_map(data_dict, filters, client_info)
+        assert figure_json(baseline_figure) == figure_json(figure), f"build_track_map figure differs for {filter_name}"
+        assert json.dumps(baseline_readout, cls=plotly.utils.PlotlyJSONEncoder) == json.dumps(readout, cls=plotly.utils.PlotlyJSONEncoder), f"build_track_map readout differs for {filter_name}"
+
+        baseline_ms = time_call(lambda: baseline_visuals.build_track_map(data_dict, filters, client_info), repeats)
+        split_ms = time_call(lambda: visuals.build_track_map(data_dict, filters, client_info), repeats)
+        print(f"  {filter_name:<20}baseline {baseline_ms:7.1f} ms   pre-split {split_ms:7.1f} ms")
+
+
+def build_lap_telemetry(data_dict, lap_ids, samples_per_lap=750, seed=0):
+    # Car data shaped like the Read_CarDataLaps output for the given laps
+    rng = np.random.default_rng(seed)
+    lap_times = data_dict["lap_times"].set_index("LapId")
+    frames = []
+    for lap_id in lap_ids:
+        lap = lap_times.loc[lap_id]
+        session_time = lap["SessionTime"] - lap["LapTime"] + np.linspace(0, lap["LapTime"], samples_per_lap)
+        frames.append(pd.DataFrame({
+            "Driver": lap["Driver"],
+            "LapId": lap_id,
+            "NumberOfLaps": lap["NumberOfLaps"],
+            "StintNumber": lap["StintNumber"],
+            "LapsInStint": lap["LapsInStint"],
+            "IsPersonalBest": lap["IsPersonalBest"],
+            "Compound": lap["Compound"],
+            "CleanLap": lap["CleanLap"],
+            "SectorNumber": np.repeat([1, 2, 3], [250, 250, samples_per_lap - 500]),
+            "SessionTime": session_time,
+            "RPM": rng.integers(8000, 12500, samples_per_lap),
+            "Speed": rng.integers(80, 330, samples_per_lap),
+            "Gear": rng.integers(1, 9, samples_per_lap),
+            "Throttle": rng.integers(0, 101, samples_per_lap),
+            "Brake": rng.random(samples_per_lap) > 0.8,
+            "Tla": lap["Tla"],
+            "TeamColour": lap["TeamColour"],
+            "DriverOrder": lap["DriverOrder"]
+        }).sample(frac=1, random_state=seed))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def benchmark_inputs_graph(repeats=20):
+    data_dict = build_race_session()
+    data_dict["car_data_norms"] = pd.DataFrame([{
+        "RPMMin": 0, "RPMMax": 13000, "SpeedMin": 0, "SpeedMax": 340,
+        "GearMin": 0, "GearMax": 8, "ThrottleMin": 0, "ThrottleMax": 104
+    }])
+    client_info = {"isMobile": False, "height": 1080}
+    lap_ids = list(data_dict["lap_times"]["LapId"].sample(2, random_state=0))
+    telemetry = build_lap_telemetry(data_dict, lap_ids)
+    stored_telemetry = telemetry.to_dict("records")
+
+    filter_sets = {
+        "all traces": {"LapId": lap_ids, "input_trace": ["RPM", "Speed", "Gear", "Throttle", "Brake"]},
+        "speed + brake": {"LapId": lap_ids, "input_trace": ["Speed", "Brake"]},
+        "one lap, sector 2": {"LapId": lap_ids[:1], "SectorNumber": [2], "input_trace": ["Throttle", "Brake"]}
+    }
+
+    baseline_visuals = baseline_module("visuals")
+
+    print(f"build_inputs_graph: {len(telemetry)} telemetry rows")
+    for filter_name, filters in filter_sets.items():
+        baseline_figure, baseline_displayed = baseline_visuals.build_inputs_graph(data_dict, filters, client_info, stored_telemetry)
+        figure, displayed = visuals.build_inputs_graph(data_dict, filters, client_info, stored_telemetry)
+        assert figure_json(baseline_figure) == figure_json(figure) and baseline_displayed == displayed, f"build_inputs_graph output differs for {filter_name}"
+
+        baseline_ms = time_call(lambda: baseline_visuals.build_inputs_graph(data_dict, filters, client_info, stored_telemetry), repeats)
+        vectorised_ms = time_call(lambda: visuals.build_inputs_graph(data_dict, filters, client_info, stored_telemetry), repeats)
+        print(f"  {filter_name:<20}baseline {baseline_ms:7.1f} ms   vectorised {vectorised_ms:7.1f} ms")
+
+
+def benchmark_figures(repeats=10):
+    # Build time per visual, assembling plain dicts versus validating through go.Figure
+    data_dict = build_race_session()
+    data_dict["track_sections"] = filter_index.split_track_map(data_dict["track_map"])
+    data_dict["car_data_norms"] = pd.DataFrame([{
+        "RPMMin": 0, "RPMMax": 13000, "SpeedMin": 0, "SpeedMax": 340,
+        "GearMin": 0, "GearMax": 8, "ThrottleMin": 0, "ThrottleMax": 104
+    }])
+    lap_ids = list(data_dict["lap_times"]["LapId"].sample(2, random_state=0))
+    stored_telemetry = build_lap_telemetry(data_dict, lap_ids).to_dict("records")
+
+    builds = {
+        "lap_plot": lambda client_info: visuals.build_lap_plot(data_dict, {"CleanLap": [True]}, client_info),
+        "track_map": lambda client_info: visuals.build_track_map(data_dict, {"CleanLap": [True], "track_split": ["sectors"]}, client_info),
+        "stint_graph": lambda client_info: visuals.build_stint_graph(data_dict, {"CleanLap": [True]}, client_info),
+        "inputs_graph": lambda client_info: visuals.build_inputs_graph(data_dict, {"LapId": lap_ids, "input_trace": ["RPM", "Speed", "Gear", "Throttle", "Brake"]}, client_info, stored_telemetry),
+        "conditions_plot": lambda client_info: visuals.build_conditions_plot(data_dict, client_info),
+        "empty lap_plot": lambda client_info: visuals.build_lap_plot(None, {}, client_info)
+    }
+
+    print("figures: build time per visual")
+    for is_mobile in [False, True]:
+        client_info = {"isMobile": is_mobile, "height": 1080}
+        for visual, build in builds.items():
+            figures.validate_figures = True
+            validated_ms = time_call(lambda: build(client_info), repeats)
+            figures.validate_figures = False
+            plain_ms = time_call(lambda: build(client_info), repeats)
+            print(f"  {visual:<16}{'mobile' if is_mobile else 'desktop':<9}validated {validated_ms:7.1f} ms   plain {plain_ms:7.1f} ms")
+
+
+def benchmark_filtered_views(repeats=20):
+    # Filtering for one crossfilter interaction: the views requested by the lap plot, track map and stint graph
+    # Shared views are computed by the first callback and taken from the memory tier by the rest
+    data_dict = build_race_session()
+    data_dict.pop("track_map")
+    data_dict.pop("conditions_data")
+    indexes = {dataset_name: filter_index.build_filter_index(data_dict[dataset_name]) for dataset_name in data_dict}
+    file_store.memory_cache_size_limit_in_MB = 512
+
+    filters = {"TeamName": ["Team A", "Team B", "Team C"], "CleanLap": [True], "track_split": ["sectors"]}
+    view_requests = [
+        ("lap_times", ["LapId", "StintId"]),
+        ("sector_times", ["SectorNumber", "ZoneNumber"]),
+        ("lap_times", ["SectorNumber", "ZoneNumber"]),
+        ("lap_times", []),
+        ("lap_times", ["LapId"])
+    ]
+
+    variants = {
+        "scanned": dict(data_dict),
+        "indexed": dict(data_dict, filter_indexes=indexes),
+        "indexed + shared": dict(data_dict, filter_indexes=indexes, snapshot_key="benchmark")
+    }
+
+    def interaction(views_data_dict):
+        file_store.memory_cache_invalidate("benchmark")
+        for dataset_name, ignore in view_requests:
+            visuals.get_filtered_data(views_data_dict, dataset_name, filters, ignore)
+
+    print(f"filtered views: {len(view_requests)} view requests per interaction")
+    for name, views_data_dict in variants.items():
+        interaction_ms = time_call(lambda: interaction(views_data_dict), repeats)
+        print(f"  {name:<18}{interaction_ms:7.2f} ms")
+
+
+def benchmark_api_archive(repeats=3):
+    # Archiving and replaying a race's car data, shaped like the per-driver frames returned by ff.api.car_data
+    data_dict = build_race_session()
+    telemetry = build_lap_telemetry(data_dict, data_dict["lap_times"]["LapId"].unique())
+    car_data = {
+        str(driver): frame[["SessionTime", "RPM", "Speed", "Gear", "Throttle", "Brake"]].reset_index(drop=True)
+        for driver, frame in telemetry.groupby("Driver")
+    }
+    api_archive.directory = tempfile.mkdtemp() + "/"
+    api_string = "2023/2023-07-23_Benchmark_Grand_Prix/2023-07-23_Race/"
+
+    write_ms = time_call(lambda: (shutil.rmtree(api_archive.directory, ignore_errors=True), api_archive.write_response(api_string, "car_data", car_data)), repeats)
+    unchanged_ms = time_call(lambda: api_archive.write_response(api_string, "car_data", car_data), repeats)
+    read_ms = time_call(lambda: api_archive.read_response(api_string, "car_data"), repeats)
+    archive_size = os.path.getsize(api_archive.archive_path(api_string, "car_data"))
+    shutil.rmtree(api_archive.directory)
+
+    print(f"api archive: car data for {len(telemetry)} samples, {archive_size / 1000000:.1f} MB archived")
+    print(f"  write{write_ms:10.2f} ms")
+    print(f"  write unchanged{unchanged_ms:10.2f} ms")
+    print(f"  read {read_ms:10.2f} ms")
+
+
+def build_car_data(drivers=20, samples_per_driver=25000, seed=0):
+    # Raw car data shaped like the CarData frames uploaded by update_database, for an unused SessionId
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(drivers):
+        frame = pd.DataFrame({
+            "Date": pd.Timestamp("2023-07-23 13:00:00") + pd.to_timedelta(np.arange(samples_per_driver) * 270, unit="ms"),
+            "RPM": rng.integers(4000, 12000, samples_per_driver),
+            "Speed": rng.integers(60, 330, samples_per_driver),
+            "Gear": rng.integers(1, 9, samples_per_driver),
+            "Throttle": rng.integers(0, 101, samples_per_driver),
+            "Brake": rng.random(samples_per_driver) < 0.2,
+            "DRS": rng.choice([0, 8, 12], samples_per_driver),
+            "Source": "car",
+            "Time": pd.to_timedelta(np.arange(samples_per_driver) * 270, unit="ms")
+        })
+        frame["Driver"] = str(i + 1)
+        frames.append(frame)
+
+    car_data = pd.concat(frames, ignore_index=True)
+    car_data["SessionId"] = -1
+
+    return car_data
+
+
+def benchmark_upload():
+    # Rows/second for each upload backend, loading synthetic CarData to SessionId -1 and deleting it afterwards
+    # The database part only runs where a connection is configured; row preparation for the tvp backend always runs
+    # Imported here, as loading update_database needs fastf1, pyodbc and a configured connection
+    if not database_configured():
+        print("upload: no database connection configured, skipping")
+        return
+    import sql_connection
+    import update_database
+    import upload_controller
+    car_data = build_car_data()
+
+    preparation_ms = time_call(lambda: update_database.bulk_upload_rows(car_data, update_database.bulk_upload_columns["CarData"]), 3)
+    print(f"upload: {len(car_data)} CarData rows")
+    print(f"  tvp row preparation{len(car_data) / preparation_ms * 1000:12.0f} rows/s")
+
+    pyodbc_connection = sql_connection.get_pyodbc_connection()
+    sqlalchemy_engine = sql_connection.get_sqlalchemy_engine()
+    cursor = pyodbc_connection["cursor"]
+    initial_state = dict(upload_controller.state)
+    for upload_backend in ["to_sql", "tvp"]:
+        # Each backend starts from the same controller state
+        upload_controller.state.update(initial_state)
+        update_database.upload_backend = upload_backend
+        time_start = time.perf_counter()
+        success = update_database.upload_dataset(cursor, sqlalchemy_engine, car_data, "CarData")
+        duration = time.perf_counter() - time_start
+        cursor.execute("EXEC dbo.Delete_Telemetry @SessionId=?", -1)
+        cursor.commit()
+        print(f"  {upload_backend:<19}{len(car_data) / duration:12.0f} rows/s{'' if success else ' (failed)'}")
+    pyodbc_connection["connection"].close()
+
+
+def build_merge_inputs(drivers=20, samples_per_driver=25000, seed=0):
+    # Car data, lap boundaries and sector boundaries shaped like the Read_CarDataToMerge, Read_LapBoundaries and Read_SectorBoundaries outputs
+    # Times are in nanoseconds, as stored in SQL, with gaps between laps and a few missing sectors
+    rng = np.random.default_rng(seed)
+    car_data = build_car_data(drivers, samples_per_driver, seed).drop(columns=["Date", "Source"])
+    car_data["Time"] = car_data["Time"].to_numpy().view("int64").astype("float64")
+    car_data["Driver"] = car_data["Driver"].astype(int)
+
+    lap_ns = 90 * 1000000000
+    session_ns = samples_per_driver * 270 * 1000000
+    lap_rows = []
+    lap_id = 0
+    for i in range(drivers):
+        time_start = float(rng.integers(0, lap_ns))
+        while time_start < session_ns:
+            lap_id += 1
+            time_end = time_start + lap_ns + rng.normal(0, 1) * 1000000000
+            lap_rows.append({"Driver": i + 1, "LapId": lap_id, "TimeStart": time_start, "TimeEnd": time_end})
+            time_start = time_end + (rng.random() < 0.1) * 5000000000
+    lap_boundaries = pd.DataFrame(lap_rows)
+
+    sector_times = np.repeat(lap_boundaries["TimeEnd"].to_numpy() - lap_boundaries["TimeStart"].to_numpy(), 3) / 3 + rng.normal(0, 1, len(lap_boundaries) * 3) * 100000000
+    sector_times[rng.random(len(sector_times)) < 0.01] = np.nan
+    sectors = pd.DataFrame({
+        "LapId": np.repeat(lap_boundaries["LapId"].to_numpy(), 3),
+        "SectorNumber": np.tile([1, 2, 3], len(lap_boundaries)),
+        "SectorTime": sector_times
+    })
+    # Running sums skipping missing sectors, as SUM() OVER() does
+    sectors["SectorTimeCumulative"] = sectors.groupby("LapId")["SectorTime"].cumsum()
+    sectors.loc[sectors.groupby("LapId")["SectorTime"].transform(lambda times: times.notna().cumsum()) == 0, "SectorTimeCumulative"] = np.nan
+    sector_boundaries = sectors.drop(columns="SectorTime")
+
+    return car_data, lap_boundaries, sector_boundaries
+
+
+def check_merge_fixture():
+    # A few hand-placed samples covering the join's edge cases, checked against the rows dbo.Merge_CarData keeps
+    # Lap 2 is missing its first sector; samples before, between and after laps, past the last sector and for a driver with no laps are dropped
+    times = [-5, 10, 30, 99, 105, 115, 195, 199, 205]
+    car_data = pd.DataFrame({
+        "SessionId": -1, "Driver": [1] * len(times) + [2], "Time": [float(t) for t in times] + [10.0],
+        "RPM": 10000, "Speed": 200, "Gear": 7, "Throttle": 100, "Brake": False, "DRS": 0
+    })
+    lap_boundaries = pd.DataFrame({"Driver": [1, 1], "LapId": [1, 2], "TimeStart": [0.0, 110.0], "TimeEnd": [100.0, 210.0]})
+    sector_boundaries = pd.DataFrame({
+        "LapId": [1, 1, 1, 2, 2, 2],
+        "SectorNumber": [1, 2, 3, 1, 2, 3],
+        "SectorTimeCumulative": [30.0, 60.0, 100.0, np.nan, 50.0, 90.0]
+    })
+
+    merged = car_data_merge.merge_car_data(car_data, lap_boundaries, sector_boundaries)
+    expected = [(1, 1, 10.0), (1, 2, 30.0), (1, 3, 99.0), (2, 2, 115.0), (2, 3, 195.0), (2, 3, 199.0)]
+    assert list(merged[["LapId", "SectorNumber", "Time"]].itertuples(index=False, name=None)) == expected, "merge_car_data output differs from Merge_CarData"
+
+
+def benchmark_merge_car_data(repeats=3):
+    # Python merge engine on a race's car data, after checking it against a small fixture with the same semantics as dbo.Merge_CarData
+    # Where a connection is configured and BENCHMARK_SESSION_ID names a transformed session, both engines are also run against the database
+    check_merge_fixture()
+    car_data, lap_boundaries, sector_boundaries = build_merge_inputs()
+    merged = car_data_merge.merge_car_data(car_data, lap_boundaries, sector_boundaries)
+
+    vectorised_ms = time_call(lambda: car_data_merge.merge_car_data(car_data, lap_boundaries, sector_boundaries), repeats)
+    print(f"merge_car_data: {len(car_data)} samples, {len(lap_boundaries)} laps, {len(merged)} merged rows")
+    print(f"  searchsorted {vectorised_ms:8.1f} ms")
+
+    session_id = os.environ.get("BENCHMARK_SESSION_ID")
+    if not database_configured() or session_id is None:
+        print("  no database connection or BENCHMARK_SESSION_ID configured, skipping database engines")
+        return
+
+    # Imported here, as loading update_database needs fastf1, pyodbc and a configured connection
+    import sql_connection
+    import update_database
+
+    # Both engines replace the session's MergedCarData, so it is left as either would leave it
+    pyodbc_connection = sql_connection.get_pyodbc_connection()
+    sqlalchemy_engine = sql_connection.get_sqlalchemy_engine()
+    cursor = pyodbc_connection["cursor"]
+    time_start = time.perf_counter()
+    cursor.execute("SET NOCOUNT ON; EXEC dbo.Merge_CarData @SessionId=?", int(session_id))
+    cursor.commit()
+    sql_seconds = time.perf_counter() - time_start
+    sql_rows = cursor.execute("SELECT COUNT(*) FROM dbo.MergedCarData WHERE SessionId=?", int(session_id)).fetchval()
+    time_start = time.perf_counter()
+    success = update_database.merge_car_data_python(cursor, sqlalchemy_engine, session_id)
+    python_seconds = time.perf_counter() - time_start
+    python_rows = cursor.execute("SELECT COUNT(*) FROM dbo.MergedCarData WHERE SessionId=?", int(session_id)).fetchval()
+    pyodbc_connection["connection"].close()
+    print(f"  SessionId {session_id}: Merge_CarData {sql_seconds:7.1f} s ({sql_rows} rows)   Python {python_seconds:7.1f} s ({python_rows} rows){'' if success else ' (failed)'}")
+
+
+benchmarks = {
+    "filter_data": benchmark_filter_data,
+    "lap_plot": benchmark_lap_plot,
+    "track_map": benchmark_track_map,
+    "inputs_graph": benchmark_inputs_graph,
+    "figures": benchmark_figures,
+    "filtered_views": benchmark_filtered_views,
+    "api_archive": benchmark_api_archive,
+    "upload": benchmark_upload,
+    "merge_car_data": benchmark_merge_car_data
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(benchmarks)
+    for name in names:
+        benchmarks[name]()
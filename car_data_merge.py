@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+
+# Python engine for the car data merge, an alternative to dbo.Merge_CarData
+# Samples are assigned their lap by binary search over each driver's sorted lap start times, rather than by a range join in SQL
+
+# Session name prefixes merged here rather than by dbo.Merge_CarData, or "All"; overwritten from config on app startup
+session_types = []
+
+merged_columns = ["SessionId", "Driver", "LapId", "SectorNumber", "Time", "RPM", "Speed", "Gear", "Throttle", "Brake", "DRS"]
+
+
+def enabled(session_name):
+    if "All" in session_types:
+        return True
+    return any(session_name.startswith(session_type) for session_type in session_types)
+
+
+def assign_laps(car_data, lap_boundaries):
+    # Returns, for each sample, its row in lap_boundaries, or -1 if it falls outside every lap
+    # lap_boundaries must be sorted by Driver then TimeStart; where laps overlap, a sample goes to the one that started last
+    times = car_data["Time"].to_numpy(dtype="float64")
+    lap_rows = np.full(len(car_data), -1)
+    starts = lap_boundaries["TimeStart"].to_numpy(dtype="float64")
+    ends = lap_boundaries["TimeEnd"].to_numpy(dtype="float64")
+    driver_laps = lap_boundaries.groupby("Driver", sort=False).indices
+
+    for driver, samples in car_data.groupby("Driver", sort=False).indices.items():
+        if driver not in driver_laps:
+            continue
+        laps = driver_laps[driver]
+        positions = np.searchsorted(starts[laps], times[samples], side="right") - 1
+        rows = laps[np.maximum(positions, 0)]
+        # NaN times fail both comparisons, as they fail the join in SQL
+        in_lap = (positions >= 0) & (times[samples] < ends[rows])
+        lap_rows[samples[in_lap]] = rows[in_lap]
+
+    return lap_rows
+
+
+def assign_sectors(lap_ids, lap_time_cumulative, sector_boundaries):
+    # Returns, for each sample, the first sector of its lap whose cumulative time is after the sample's time into the lap, or -1 if none is
+    # Laps have only a few sectors, so each sample is compared with all of its lap's boundaries at once
+    sectors = sector_boundaries.dropna(subset=["SectorTimeCumulative"]).sort_values(["LapId", "SectorNumber"], kind="stable")
+    sector_lap_ids = pd.Index(sectors["LapId"].unique())
+    lap_rows = sector_lap_ids.get_indexer(sectors["LapId"])
+    columns = sectors.groupby("LapId", sort=False).cumcount().to_numpy()
+    cumulative = np.full((len(sector_lap_ids) + 1, columns.max() + 1 if len(columns) > 0 else 1), np.nan)
+    numbers = np.full(cumulative.shape, -1)
+    cumulative[lap_rows, columns] = sectors["SectorTimeCumulative"].to_numpy(dtype="float64")
+    numbers[lap_rows, columns] = sectors["SectorNumber"].to_numpy()
+
+    # Laps without sectors pick up the empty row at the end
+    rows = sector_lap_ids.get_indexer(lap_ids)
+    after = cumulative[rows] > lap_time_cumulative[:, None]
+
+    return np.where(after.any(axis=1), numbers[rows, after.argmax(axis=1)], -1)
+
+
+def merge_car_data(car_data, lap_boundaries, sector_boundaries):
+    # Same rows as dbo.Merge_CarData, from the Read_CarDataToMerge, Read_LapBoundaries and Read_SectorBoundaries results
+    # Samples outside any lap or past the lap's last sector boundary are dropped, as they are by the inner joins
+    lap_boundaries = lap_boundaries.dropna(subset=["TimeStart", "TimeEnd"]).sort_values(["Driver", "TimeStart"], kind="stable").reset_index(drop=True)
+    lap_rows = assign_laps(car_data, lap_boundaries)
+    in_lap = lap_rows >= 0
+
+    merged = car_data[in_lap].reset_index(drop=True)
+    lap_rows = lap_rows[in_lap]
+    merged["LapId"] = lap_boundaries["LapId"].to_numpy()[lap_rows]
+    lap_time_cumulative = merged["Time"].to_numpy(dtype="float64") - lap_boundaries["TimeStart"].to_numpy(dtype="float64")[lap_rows]
+    merged["SectorNumber"] = assign_sectors(merged["LapId"].to_numpy(), lap_time_cumulative, sector_boundaries)
+    merged = merged[merged["SectorNumber"] >= 0]
+
+    # The procedure keeps one row for each lap and time
+    merged = merged.drop_duplicates(["LapId", "Time"])
+
+    return merged[merged_columns].reset_index(drop=True)
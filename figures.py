@@ -0,0 +1,114 @@
+import plotly.graph_objects as go
+from plotly.basedatatypes import BaseFigure
+
+
+# Figures are assembled as plain dicts, skipping plotly's validation of every property on every callback
+# Set in debug mode to build validated go.Figure objects instead, as before
+validate_figures = False
+
+# Property names containing an underscore that isn't shorthand for nesting, taken from plotly so the shorthand expands as go.Figure would
+underscore_properties = sorted(BaseFigure._valid_underscore_properties, key=len, reverse=True)
+
+
+def split_property(name):
+    # Splits the first property off an underscore path, e.g. error_x_color -> ("error_x", "color"); None if there's nothing left
+    for underscore_property in underscore_properties:
+        if name == underscore_property:
+            return name, None
+        if name.startswith(underscore_property + "_"):
+            return underscore_property, name[len(underscore_property) + 1:]
+    if "_" in name:
+        name, child_name = name.split("_", 1)
+        return name, child_name
+
+    return name, None
+
+
+def expand_properties(properties):
+    # Expands plotly's underscore shorthand, e.g. marker_line_color -> {"marker": {"line": {"color": ...}}}
+    expanded = {}
+    for name, value in properties.items():
+        if isinstance(value, dict):
+            value = expand_properties(value)
+        name, child_name = split_property(name)
+        if child_name is not None:
+            value = expand_properties({child_name: value})
+        if name in expanded and isinstance(expanded[name], dict) and isinstance(value, dict):
+            value = merge_properties(expanded[name], value)
+        expanded[name] = value
+
+    return expanded
+
+
+def merge_properties(target, properties):
+    # Returns a merged copy, leaving target untouched so cached skeletons can be shared between figures
+    merged = dict(target)
+    for name, value in properties.items():
+        if isinstance(value, dict) and isinstance(merged.get(name), dict):
+            value = merge_properties(merged[name], value)
+        merged[name] = value
+
+    return merged
+
+
+def from_figure(fig):
+    # Plain dict copy of a go.Figure, including its template
+    return fig.to_dict()
+
+
+def new_figure(skeleton):
+    # Figures built from the same skeleton share its nested layout dicts, which are never modified in place
+    return {
+        "data": [],
+        "layout": dict(skeleton["layout"])
+    }
+
+
+def update_layout(fig, properties={}, **kwargs):
+    fig["layout"] = merge_properties(fig["layout"], expand_properties({**properties, **kwargs}))
+
+
+def update_xaxes(fig, **kwargs):
+    update_layout(fig, xaxis=kwargs)
+
+
+def update_yaxes(fig, **kwargs):
+    update_layout(fig, yaxis=kwargs)
+
+
+def scatter(**kwargs):
+    trace = {"type": "scatter"}
+    trace.update(expand_properties(kwargs))
+    return trace
+
+
+def add_trace(fig, trace):
+    fig["data"] = fig["data"] + [trace]
+
+
+def add_traces(fig, traces):
+    fig["data"] = fig["data"] + list(traces)
+
+
+def add_annotation(fig, **kwargs):
+    fig["layout"]["annotations"] = list(fig["layout"].get("annotations", [])) + [expand_properties(kwargs)]
+
+
+def add_shapes(fig, shapes):
+    fig["layout"]["shapes"] = list(fig["layout"].get("shapes", [])) + [expand_properties(shape) for shape in shapes]
+
+
+def add_vrect(fig, x0, x1, **kwargs):
+    # Rectangle spanning the full height of the plot, as go.Figure.add_vrect
+    add_shapes(fig, [{"type": "rect", "xref": "x", "yref": "y domain", "x0": x0, "x1": x1, "y0": 0, "y1": 1, **kwargs}])
+
+
+def add_vline(fig, x, **kwargs):
+    # Line spanning the full height of the plot, as go.Figure.add_vline
+    add_shapes(fig, [{"type": "line", "xref": "x", "yref": "y domain", "x0": x, "x1": x, "y0": 0, "y1": 1, **kwargs}])
+
+
+def finish(fig):
+    if validate_figures:
+        return go.Figure(fig)
+    return fig
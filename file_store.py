@@ -1,58 +1,328 @@
 import os
+import re
+import json
+import shutil
 import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.feather as feather
 
 size_limit_in_GB = 0
+directory = "./file_system_store/"
+
+# In-process LRU tier in front of the file store, bounded by the deserialised size of its entries
+memory_cache_size_limit_in_MB = 0
+memory_cache = OrderedDict()
+memory_cache_size = 0
+memory_cache_lock = threading.Lock()
+memory_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0
+}
+
+# Memory hits don't touch the snapshot files, so refresh their access time now and then to keep cleanup from removing them
+touch_interval_in_seconds = 60
+last_touched = {}
+
+
+def entry_size_and_atime(path):
+    # Size and last access time of a cache entry; a snapshot directory counts as a single entry
+    if not os.path.isdir(path):
+        return os.path.getsize(path), os.path.getatime(path)
+
+    entry_size = 0
+    entry_atime = os.path.getatime(path)
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            entry_size += os.path.getsize(os.path.join(root, file))
+            entry_atime = max(entry_atime, os.path.getatime(os.path.join(root, file)))
+
+    return entry_size, entry_atime
+
+
+def remove_entry(path):
+    # Files may be written into a snapshot while it is removed, so failures are skipped rather than stopping the cleanup thread
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return
+
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
 
 def delete_files(delete_all=False):
     # Function to delete least recently accessed cache files when size limit exceeded
     # As an example, a race dataset is ~200MB
     folder_size = 0
-    file_modified_dict = {}
-    directory = "./file_system_store/"
+    file_modified_list = []
     deleted_file_count = 0
     for file in os.listdir(directory):
-        file_size = os.path.getsize(directory + file)
+        file_size, file_atime = entry_size_and_atime(directory + file)
         folder_size += file_size
-        file_modified_dict[os.path.getatime(directory + file)] = (file, file_size)
+        file_modified_list.append((file_atime, file, file_size))
 
     folder_size_in_GB = folder_size / 1000000000
 
     if folder_size_in_GB > size_limit_in_GB and delete_all == False:
-        
-        sorted_files = sorted(file_modified_dict.items())
+
+        sorted_files = sorted(file_modified_list)
         while folder_size_in_GB > size_limit_in_GB and len(sorted_files) > 0:
             record = sorted_files[0]
-            file = record[1][0]
-            size = record[1][1]
+            file = record[1]
+            size = record[2]
             folder_size_in_GB -= size / 1000000000
-            os.remove(directory + file)
+            remove_entry(directory + file)
             sorted_files.pop(0)
             deleted_file_count += 1
 
         return deleted_file_count
 
     if delete_all == True:
-        for key in file_modified_dict:
-            file = file_modified_dict[key][0]
-            os.remove(directory + file)
+        for record in file_modified_list:
+            remove_entry(directory + record[1])
 
     return None
 
 
 def cleanup(delete_delay_in_hours):
     # Function to be called periodically to delete cache files over a given age
-    directory = "./file_system_store/"
     current_time = time.time()
     delete_delay_in_seconds = delete_delay_in_hours * 60 * 60
     to_delete = []
     for file in os.listdir(directory):
-        atime = os.path.getatime(directory + file)
+        atime = entry_size_and_atime(directory + file)[1]
         if current_time - atime > delete_delay_in_seconds: to_delete.append(file)
 
     deleted_file_count = len(to_delete)
     for file in to_delete:
-        os.remove(directory + file)
+        remove_entry(directory + file)
 
     return deleted_file_count
 
 
+def snapshot_key(event_id, session_name):
+    # Directory name identifying one session's snapshot, e.g. 12_Practice_all
+    return str(int(event_id)) + "_" + re.sub(r"[^A-Za-z0-9]+", "_", session_name).strip("_")
+
+
+def snapshot_path(key, dataset_name):
+    return directory + key + "/" + dataset_name + ".feather"
+
+
+def snapshot_exists(key, dataset_names):
+    return all(os.path.exists(snapshot_path(key, dataset_name)) for dataset_name in dataset_names)
+
+
+def snapshot_version(key):
+    # Identifies the latest write of a snapshot through its version file, so every worker sees a rewrite; None if there is none
+    try:
+        stat = os.stat(directory + key + "/version")
+    except FileNotFoundError:
+        return None
+
+    return (stat.st_mtime_ns, stat.st_ino)
+
+
+def memory_cache_get(cache_key):
+    # Returns the cached value, or None on a miss
+    # Entries are tagged with the version of their snapshot, and dropped on a hit once another worker has rewritten it
+    global memory_cache_size
+    with memory_cache_lock:
+        entry = memory_cache.get(cache_key)
+    current = entry is not None and entry[2] == snapshot_version(cache_key[0])
+
+    with memory_cache_lock:
+        if current:
+            if cache_key in memory_cache:
+                memory_cache.move_to_end(cache_key)
+            memory_cache_stats["hits"] += 1
+            return entry[0]
+        if entry is not None and memory_cache.get(cache_key) is entry:
+            memory_cache_size -= memory_cache.pop(cache_key)[1]
+        memory_cache_stats["misses"] += 1
+
+    return None
+
+
+def memory_cache_put(cache_key, value, size_in_bytes, version=None):
+    # Adds a value to the cache, evicting least recently used entries to stay within the budget
+    # version should be read before the value was read from its snapshot; by default it is read now
+    global memory_cache_size
+    size_limit_in_bytes = memory_cache_size_limit_in_MB * 1000000
+    if size_in_bytes > size_limit_in_bytes:
+        return
+    if version is None:
+        version = snapshot_version(cache_key[0])
+
+    with memory_cache_lock:
+        if cache_key in memory_cache:
+            memory_cache_size -= memory_cache[cache_key][1]
+        memory_cache[cache_key] = (value, size_in_bytes, version)
+        memory_cache.move_to_end(cache_key)
+        memory_cache_size += size_in_bytes
+
+        while memory_cache_size > size_limit_in_bytes:
+            evicted_key, (evicted_value, evicted_size, evicted_version) = memory_cache.popitem(last=False)
+            memory_cache_size -= evicted_size
+            memory_cache_stats["evictions"] += 1
+
+
+def memory_cache_invalidate(key):
+    # Drops every cached entry belonging to a snapshot
+    global memory_cache_size
+    with memory_cache_lock:
+        for cache_key in [cache_key for cache_key in memory_cache if cache_key[0] == key]:
+            memory_cache_size -= memory_cache.pop(cache_key)[1]
+
+
+def get_memory_cache_status():
+    with memory_cache_lock:
+        status = dict(memory_cache_stats)
+        status["entries"] = len(memory_cache)
+        status["size_in_MB"] = round(memory_cache_size / 1000000, 1)
+    status["size_limit_in_MB"] = memory_cache_size_limit_in_MB
+
+    return status
+
+
+def touch_snapshot(key, dataset_name):
+    current_time = time.time()
+    if current_time - last_touched.get((key, dataset_name), 0) < touch_interval_in_seconds:
+        return
+    last_touched[(key, dataset_name)] = current_time
+    path = snapshot_path(key, dataset_name)
+    try:
+        os.utime(path, (current_time, os.path.getmtime(path)))
+    except FileNotFoundError:
+        pass
+
+
+def lap_telemetry_path(key, lap_id):
+    return directory + key + "/telemetry/" + str(int(lap_id)) + ".feather"
+
+
+def write_lap_telemetry(key, lap_id, data):
+    # Car data for one lap, kept in the session's snapshot directory so it is cleaned up along with the session
+    os.makedirs(directory + key + "/telemetry", exist_ok=True)
+    path = lap_telemetry_path(key, lap_id)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    feather.write_feather(data.reset_index(drop=True), temp_path, compression="uncompressed")
+    os.replace(temp_path, path)
+
+    memory_cache_put((key, "telemetry", int(lap_id)), data, int(data.memory_usage(deep=True).sum()))
+
+
+def read_lap_telemetry(key, lap_id):
+    # Returns None if the lap isn't cached
+    # Frames may be shared with other callbacks, so must not be modified in place
+    cache_key = (key, "telemetry", int(lap_id))
+    data = memory_cache_get(cache_key)
+    if data is not None:
+        return data
+
+    version = snapshot_version(key)
+    try:
+        data = feather.read_table(lap_telemetry_path(key, lap_id), memory_map=True).to_pandas()
+    except FileNotFoundError:
+        return None
+    memory_cache_put(cache_key, data, int(data.memory_usage(deep=True).sum()), version)
+
+    return data
+
+
+def telemetry_bundle_path(key):
+    # Kept with the per-lap files, so it is removed whenever the snapshot is rebuilt
+    return directory + key + "/telemetry/bundle.arrow"
+
+
+def telemetry_bundle_exists(key):
+    return os.path.exists(telemetry_bundle_path(key))
+
+
+def write_telemetry_bundle(key, data):
+    # Car data for a whole session, as an Arrow IPC file sorted by LapId with one zstd compressed record batch per lap
+    # The LapId -> batch index is kept in the file's metadata, so a lap is read without decompressing the rest of the session
+    data = data.sort_values(["LapId", "SessionTime"], kind="stable").reset_index(drop=True)
+    table = pa.Table.from_pandas(data, preserve_index=False).combine_chunks()
+
+    lap_ids = data["LapId"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, lap_ids[1:] != lap_ids[:-1]]) if len(lap_ids) > 0 else np.array([], dtype=int)
+    ends = np.r_[starts[1:], len(lap_ids)]
+    lap_index = {str(int(lap_ids[start])): batch for batch, start in enumerate(starts)}
+    schema = table.schema.with_metadata({**table.schema.metadata, b"lap_index": json.dumps(lap_index).encode()})
+
+    os.makedirs(directory + key + "/telemetry", exist_ok=True)
+    path = telemetry_bundle_path(key)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    batches = table.to_batches()
+    with ipc.new_file(temp_path, schema, options=ipc.IpcWriteOptions(compression="zstd")) as writer:
+        for start, end in zip(starts, ends):
+            writer.write_batch(batches[0].slice(start, end - start))
+    os.replace(temp_path, path)
+
+
+def read_telemetry_bundle(key, lap_ids):
+    # Returns None if the session has no bundle; laps not in the bundle have no rows
+    path = telemetry_bundle_path(key)
+    if not os.path.exists(path):
+        return None
+
+    with pa.memory_map(path) as source:
+        reader = ipc.open_file(source)
+        lap_index = json.loads(reader.schema.metadata[b"lap_index"])
+        batches = [reader.get_batch(lap_index[str(int(lap_id))]) for lap_id in lap_ids if str(int(lap_id)) in lap_index]
+        data = pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+
+    return data
+
+
+def write_snapshot(key, data_dict):
+    # Session snapshots are stored as one uncompressed Feather file per dataset
+    # Uncompressed files can be memory-mapped, so the OS page cache is shared between workers
+    os.makedirs(directory + key, exist_ok=True)
+    for dataset_name in data_dict:
+        path = snapshot_path(key, dataset_name)
+        # Write to a temporary file first so concurrent readers never see a partial file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        feather.write_feather(data_dict[dataset_name].reset_index(drop=True), temp_path, compression="uncompressed")
+        os.replace(temp_path, path)
+
+    # Cached lap telemetry may predate the new snapshot
+    if os.path.isdir(directory + key + "/telemetry"):
+        remove_entry(directory + key + "/telemetry")
+
+    # A new version file tells other workers to drop their cached entries for this snapshot
+    path = directory + key + "/version"
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as file:
+        file.write(str(time.time_ns()))
+    os.replace(temp_path, path)
+
+    memory_cache_invalidate(key)
+
+
+def read_snapshot(key, dataset_names):
+    # Reads only the requested datasets from a session snapshot, via the in-memory tier
+    # Raises FileNotFoundError if any of them has been removed from the cache
+    # Frames may be shared with other callbacks, so must not be modified in place
+    data_dict = {}
+    for dataset_name in dataset_names:
+        data = memory_cache_get((key, dataset_name))
+        if data is not None:
+            touch_snapshot(key, dataset_name)
+        else:
+            path = snapshot_path(key, dataset_name)
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            version = snapshot_version(key)
+            data = feather.read_table(path, memory_map=True).to_pandas()
+            memory_cache_put((key, dataset_name), data, int(data.memory_usage(deep=True).sum()), version)
+        data_dict[dataset_name] = data
+
+    return data_dict
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+
+# Fields indexed for crossfiltering; any other filter field falls back to scanning the frame
+indexed_fields = ["TeamName", "Driver", "Compound", "CleanLap", "StintId", "LapId"]
+
+# Fields with at most this many distinct values get a precomputed boolean mask per value
+# Higher cardinality fields (laps, stints) are resolved through their codes instead
+max_mask_values = 64
+
+# Lookup key for missing values; a None or NaN filter value selects every row with a missing value
+missing_value = None
+
+
+def build_filter_index(data):
+    # Built once per session dataset, so filters can be resolved without rescanning the frame
+    index = {
+        "length": len(data),
+        "fields": {},
+        "time": None,
+        # Used to size filtered views of the dataset without measuring each one
+        "bytes_per_row": int(data.memory_usage(deep=True).sum()) / max(len(data), 1)
+    }
+
+    for field in indexed_fields:
+        if field not in data.columns:
+            continue
+        codes, uniques = pd.factorize(data[field])
+        lookup = {value: code for code, value in enumerate(uniques)}
+        # Missing values are left out of uniques with code -1, so are given a code of their own to stay selectable
+        missing = codes == -1
+        if missing.any():
+            # Not assigned in place, as the codes of a categorical column may be shared with the column itself
+            codes = np.where(missing, len(uniques), codes)
+            lookup[missing_value] = len(uniques)
+        field_index = {
+            "codes": codes,
+            "lookup": lookup,
+            "masks": None
+        }
+        if len(lookup) <= max_mask_values:
+            field_index["masks"] = [codes == code for code in range(len(lookup))]
+        index["fields"][field] = field_index
+
+    if "SessionTime" in data.columns:
+        session_time = data["SessionTime"].to_numpy(dtype="float64")
+        order = np.argsort(session_time, kind="stable")
+        index["time"] = (order, session_time[order])
+
+    return index
+
+
+def split_track_map(track_map):
+    # Per-section polylines sorted by sample, for each way of splitting the track present in the track map
+    # Track geometry doesn't change within an event, so this only needs doing once per session load
+    track_sections = {}
+    sorted_track_map = track_map.sort_values("SampleId")
+    for section_identifier in ["SectorNumber", "ZoneNumber"]:
+        if section_identifier in sorted_track_map.columns:
+            track_sections[section_identifier] = {
+                section: track[["X", "Y"]].reset_index(drop=True)
+                for section, track in sorted_track_map.groupby(section_identifier, sort=False)
+            }
+
+    return track_sections
+
+
+def get_index_size(index):
+    # Approximate size in bytes, for the memory cache budget
+    size = 0
+    for field_index in index["fields"].values():
+        size += field_index["codes"].nbytes
+        if field_index["masks"] is not None:
+            size += sum(mask.nbytes for mask in field_index["masks"])
+    if index["time"] is not None:
+        size += index["time"][0].nbytes + index["time"][1].nbytes
+
+    return size
+
+
+def lookup_key(value):
+    return missing_value if pd.isna(value) else value
+
+
+def field_mask(field_index, values, length):
+    keys = [lookup_key(value) for value in values]
+    codes = [field_index["lookup"][key] for key in keys if key in field_index["lookup"]]
+
+    if field_index["masks"] is not None:
+        mask = np.zeros(length, dtype=bool)
+        for code in codes:
+            mask |= field_index["masks"][code]
+        return mask
+
+    selected = np.zeros(len(field_index["lookup"]), dtype=bool)
+    selected[codes] = True
+    return selected[field_index["codes"]]
+
+
+def time_mask(time_index, time_min, time_max, length):
+    # Binary search on sorted session times; NaN sorts last so is never included
+    order, sorted_times = time_index
+    start = np.searchsorted(sorted_times, time_min, side="left")
+    end = np.searchsorted(sorted_times, time_max, side="right")
+    mask = np.zeros(length, dtype=bool)
+    mask[order[start:end]] = True
+
+    return mask
+
+
+def get_filter_mask(index, data, filter_dict, ignore=[]):
+    # Same filter semantics as visuals.filter_data, resolved by intersecting masks
+    mask = np.ones(index["length"], dtype=bool)
+
+    for field in filter_dict:
+        if field in ignore:
+            continue
+        if field == "TimeFilter" and "SessionTime" in data.columns:
+            time_min, time_max = filter_dict[field]
+            mask &= time_mask(index["time"], time_min, time_max, index["length"])
+        elif field in index["fields"]:
+            mask &= field_mask(index["fields"][field], filter_dict[field], index["length"])
+        elif field in data.columns:
+            mask &= data[field].isin(filter_dict[field]).to_numpy()
+
+    return mask
@@ -0,0 +1,156 @@
+import queue
+import threading
+import atexit
+import time
+import sql_connection
+
+
+# Limits, overwritten from config on app startup
+max_queue_size = 10000
+flush_batch_size = 100
+flush_interval_in_seconds = 5.0
+
+# SQL Server accepts at most 2100 parameters per statement
+max_statement_parameters = 2000
+
+log_queue = queue.Queue()
+flush_thread = None
+flush_thread_lock = threading.Lock()
+flush_lock = threading.Lock()
+
+log_stats = {
+    "queued": 0,
+    "written": 0,
+    "dropped": 0,
+    "failed_flushes": 0
+}
+log_stats_lock = threading.Lock()
+reported_dropped = 0
+
+insert_sql = {
+    "app": (
+        "INSERT INTO dbo.Log_App(LogDateTime, HostName, ClientInfo, LogType, LogMessage) VALUES ",
+        "(DATEADD(MILLISECOND, -?, GETDATE()), ?, ?, ?, ?)"
+    ),
+    "data": (
+        "INSERT INTO dbo.Log_Data(LogDateTime, HostName, LogMessage) VALUES ",
+        "(DATEADD(MILLISECOND, -?, GETDATE()), ?, ?)"
+    )
+}
+
+
+def enqueue(log_type, values):
+    # Adds a record to the queue without touching the database; drops it if the queue is full
+    start_flush_thread()
+
+    with log_stats_lock:
+        if log_queue.qsize() >= max_queue_size:
+            log_stats["dropped"] += 1
+            return False
+        log_stats["queued"] += 1
+
+    log_queue.put((log_type, time.monotonic(), values))
+    return True
+
+
+def start_flush_thread():
+    global flush_thread
+    if flush_thread is None:
+        with flush_thread_lock:
+            if flush_thread is None:
+                flush_thread = threading.Thread(target=flush_loop, daemon=True)
+                flush_thread.start()
+
+
+def flush_loop():
+    # Collects records until the batch is full or the flush interval has passed, then writes them in bulk
+    while True:
+        batch = []
+        deadline = time.monotonic() + flush_interval_in_seconds
+        while len(batch) < flush_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(log_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        flush(batch)
+
+
+def drain():
+    # Empties the queue into a list, used on shutdown
+    batch = []
+    while True:
+        try:
+            batch.append(log_queue.get_nowait())
+        except queue.Empty:
+            return batch
+
+
+def flush(batch):
+    # Writes a batch of queued records with one multi-row insert per log table
+    global reported_dropped
+
+    with log_stats_lock:
+        dropped = log_stats["dropped"]
+    if dropped > reported_dropped:
+        batch.append(("app", time.monotonic(), ("app", "logging", f"Log queue full; {dropped - reported_dropped} records dropped")))
+        reported_dropped = dropped
+
+    if len(batch) == 0:
+        return
+
+    flush_time = time.monotonic()
+    rows = {log_type: [] for log_type in insert_sql}
+    for log_type, queued_time, values in batch:
+        age_in_ms = int((flush_time - queued_time) * 1000)
+        rows[log_type].append((age_in_ms, sql_connection.host_name) + tuple(values))
+
+    with flush_lock:
+        try:
+            pyodbc_connection = sql_connection.get_pyodbc_connection()
+        except Exception as e:
+            record_failed_flush(len(batch), e)
+            return
+
+        try:
+            cursor = pyodbc_connection["cursor"]
+            for log_type in rows:
+                if len(rows[log_type]) == 0: continue
+                insert_prefix, row_placeholder = insert_sql[log_type]
+                params_per_row = len(rows[log_type][0])
+                rows_per_statement = max_statement_parameters // params_per_row
+                for i in range(0, len(rows[log_type]), rows_per_statement):
+                    chunk = rows[log_type][i:i + rows_per_statement]
+                    sql = insert_prefix + ", ".join([row_placeholder] * len(chunk))
+                    cursor.execute(sql, [value for row in chunk for value in row])
+            cursor.commit()
+        except Exception as e:
+            record_failed_flush(len(batch), e)
+        else:
+            with log_stats_lock:
+                log_stats["written"] += len(batch)
+        finally:
+            pyodbc_connection["connection"].close()
+
+
+def record_failed_flush(record_count, error):
+    with log_stats_lock:
+        log_stats["failed_flushes"] += 1
+        log_stats["dropped"] += record_count
+    print(f"logging_queue: failed to write {record_count} log records: {error}")
+
+
+def get_logging_status():
+    with log_stats_lock:
+        status = dict(log_stats)
+    status["pending"] = log_queue.qsize()
+
+    return status
+
+
+@atexit.register
+def flush_on_exit():
+    flush(drain())
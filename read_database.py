@@ -1,58 +1,71 @@
 import pandas as pd
+import numpy as np
 import sql_connection
-import os
+import logging_queue
+import file_store
+import filter_index
 import threading
 from datetime import datetime
 
 light_version = None
 
+session_dataset_names = ["track_map", "lap_times", "sector_times", "conditions_data", "session_drivers", "car_data_norms"]
+
+# Datasets crossfiltered by the visuals, which get a filter index alongside them
+filter_indexed_dataset_names = ["lap_times", "sector_times"]
+
+# Session types (by prefix of the session name, or "All") whose whole car data is read once into a telemetry bundle
+# Other sessions read telemetry per lap from SQL as it's requested
+telemetry_bundle_session_types = []
+
+# One lock per snapshot key, so a session's bundle is only built once per worker
+telemetry_bundle_locks = {}
+telemetry_bundle_locks_lock = threading.Lock()
+
 def get_app_config():
-    sqlalchemy_engine = sql_connection.get_sqlalchemy_engine()
-    config_frame = pd.read_sql_query("SET NOCOUNT ON; EXEC dbo.Read_Config", sqlalchemy_engine)
+    with sql_connection.get_sqlalchemy_connection() as connection:
+        config_frame = pd.read_sql_query("SET NOCOUNT ON; EXEC dbo.Read_Config", connection)
     config = {}
     for i in range(len(config_frame)):
         config[config_frame["Parameter"].iloc[i]] = config_frame["Value"].iloc[i]
-    sqlalchemy_engine.dispose()
 
     return config
 
 
 def app_logging(client_info, type, message):
-    host_name = os.popen("hostname").read()
-    pyodbc_connection = sql_connection.get_pyodbc_connection()
-    cursor = pyodbc_connection["cursor"]
-    cursor.execute("EXEC dbo.Logging_App @HostName=?, @ClientInfo=?, @Type=?, @Message=?", host_name, client_info, type, message)
-    cursor.commit()
-    pyodbc_connection["connection"].close()
+    # Queued and written to dbo.Log_App in batches by a background thread
+    logging_queue.enqueue("app", (client_info, type, message))
     print("app_logging: " + type + ": " + message)
 
 
 def get_available_sessions():
-    sqlalchemy_engine = sql_connection.get_sqlalchemy_engine()
-    sessions_frame = pd.read_sql_query("SET NOCOUNT ON; EXEC dbo.Read_AvailableSessions", sqlalchemy_engine)
-    sqlalchemy_engine.dispose()
+    with sql_connection.get_sqlalchemy_connection() as connection:
+        sessions_frame = pd.read_sql_query("SET NOCOUNT ON; EXEC dbo.Read_AvailableSessions", connection)
 
     return sessions_frame
 
 
 def read_session_data(event_id, session_name):
 
+    if session_name == "Practice (all)":
+        return compose_practice_sessions(event_id)
+
     time_start = datetime.now()
 
-    def read_sp(sqlalchemy_engine, sp_suffix, event_id, session_name, data_dict_list, data_key):
+    def read_sp(sp_suffix, event_id, session_name, data_dict_list, data_key):
 
         if data_key == "track_map":
             sql = f"EXEC dbo.Read_{sp_suffix} @EventId={event_id};"
         else:
             sql = f"EXEC dbo.Read_{sp_suffix} @EventId={event_id}, @SessionName='{session_name}';"
 
-        data = pd.read_sql_query("SET NOCOUNT ON; " + sql, sqlalchemy_engine)
+        # Each thread checks out its own pooled connection
+        with sql_connection.get_sqlalchemy_connection() as connection:
+            data = pd.read_sql_query("SET NOCOUNT ON; " + sql, connection)
         data_dict = {data_key: data}
         data_dict_list.append(data_dict)
         print("appended " + data_key)
 
-    sqlalchemy_engine = sql_connection.get_sqlalchemy_engine()
-
     sp_dict = {
         "track_map": "TrackMap",
         "lap_times": "LapTimes",
@@ -72,7 +85,6 @@ def read_session_data(event_id, session_name):
             target=read_sp,
             daemon=True,
             args=(
-                sqlalchemy_engine,
                 sp_dict[key],
                 event_id,
                 session_name,
@@ -87,8 +99,6 @@ def read_session_data(event_id, session_name):
     for thread in threads:
         thread.join()
 
-    sqlalchemy_engine.dispose()
-
     # Turn list of single item dicts into a dict
     data_dict = {}
     for dict in data_dict_list:
@@ -100,19 +110,267 @@ def read_session_data(event_id, session_name):
     return data_dict
 
 
-def read_car_data(event_id, session_name, lap_ids):
-    
-    sqlalchemy_engine = sql_connection.get_sqlalchemy_engine()
+def read_session_offsets(event_id, session_name):
+    with sql_connection.get_sqlalchemy_connection() as connection:
+        offsets_frame = pd.read_sql_query(f"SET NOCOUNT ON; EXEC dbo.Read_SessionOffsets @EventId={event_id}, @SessionName='{session_name}';", connection)
+
+    return offsets_frame
+
+
+def offset_stint_numbers(data, stint_offsets):
+    # Continues each driver's stint numbering from the end of their previous session
+    data = data.merge(stint_offsets, how="left", on=["SessionOrder", "Driver"])
+    data["StintNumber"] = data["StintNumber"] + data["StintOffset"].fillna(0).astype(data["StintNumber"].dtype)
+
+    return data.drop(columns="StintOffset")
+
+
+def compose_practice_sessions(event_id):
+    # Assembles the combined practice datasets from the single session snapshots, reading from SQL only those not already cached
+    # Equivalent to the Practice (all) branches of the Read_ procedures
+
+    time_start = datetime.now()
+
+    offsets_frame = read_session_offsets(event_id, "Practice (all)")
+    dataset_names = get_session_dataset_names()
+
+    session_dicts = []
+    for i in range(len(offsets_frame)):
+        handle = prepare_session_datasets(event_id, offsets_frame["SessionName"].iloc[i])
+        session_dicts.append(get_session_datasets(handle, dataset_names))
+
+    session_orders = offsets_frame["SessionOrder"].to_numpy()
+    session_offsets = offsets_frame["SessionTimeOffset"].to_numpy()
+
+    def concat_sessions(dataset_name):
+        # Stacks a dataset across sessions, tagged with session order and with session times offset
+        frames = [session_dict[dataset_name] for session_dict in session_dicts]
+        data = pd.concat(frames, ignore_index=True)
+        data["SessionOrder"] = np.repeat(session_orders, [len(frame) for frame in frames])
+        if "SessionTime" in data.columns:
+            data["SessionTime"] = data["SessionTime"] + np.repeat(session_offsets, [len(frame) for frame in frames])
+        return data
+
+    lap_times = concat_sessions("lap_times")
+    sector_times = concat_sessions("sector_times")
+
+    # Stints are numbered consecutively within each session, so offset by the driver's stint count in earlier sessions
+    stint_counts = pd.concat([
+        lap_times[["SessionOrder", "Driver", "StintNumber"]],
+        sector_times[["SessionOrder", "Driver", "StintNumber"]]
+    ]).groupby(["Driver", "SessionOrder"])["StintNumber"].max()
+    stint_offsets = (stint_counts.groupby(level="Driver").cumsum() - stint_counts).rename("StintOffset").reset_index()
+
+    lap_times = offset_stint_numbers(lap_times, stint_offsets)
+    sector_times = offset_stint_numbers(sector_times, stint_offsets)
+
+    # Force alphabetical order when combining sessions (necessary to handle drivers under multiple teams)
+    team_driver_keys = lap_times[["TeamName", "Driver"]].drop_duplicates().sort_values(["TeamName", "Driver"])
+    team_driver_keys["TeamDriverOrder"] = np.arange(1, len(team_driver_keys) + 1)
+    lap_times = lap_times.drop(columns=["TeamOrder", "DriverOrder"]).merge(team_driver_keys, how="left", on=["TeamName", "Driver"])
+    lap_times["TeamOrder"] = lap_times["TeamDriverOrder"]
+    lap_times["DriverOrder"] = lap_times["TeamDriverOrder"]
+
+    lap_times = lap_times.sort_values(["TeamOrder", "DriverOrder", "StintNumber", "LapsInStint"], kind="stable")
+    lap_times = lap_times[session_dicts[0]["lap_times"].columns].reset_index(drop=True)
+    sector_times = sector_times.sort_values(["TeamOrder", "DriverOrder", "StintNumber", "LapsInStint"], kind="stable")
+    sector_times = sector_times[session_dicts[0]["sector_times"].columns].reset_index(drop=True)
+
+    # Track status ids restart at each session, so continue them from the previous session's last id
+    conditions_data = concat_sessions("conditions_data")
+    status_counts = conditions_data.groupby("SessionOrder")["TrackStatusId"].max().fillna(0)
+    status_offsets = status_counts.cumsum() - status_counts
+    conditions_data["TrackStatusId"] = conditions_data["TrackStatusId"] + conditions_data["SessionOrder"].map(status_offsets)
+    conditions_data = conditions_data.sort_values("SessionTime", kind="stable")
+    conditions_data = conditions_data[session_dicts[0]["conditions_data"].columns].reset_index(drop=True)
+
+    session_drivers = pd.concat([session_dict["session_drivers"] for session_dict in session_dicts], ignore_index=True)
+    session_drivers = session_drivers.drop_duplicates().sort_values(["TeamOrder", "DriverOrder"], kind="stable").reset_index(drop=True)
+
+    data_dict = {
+        "track_map": session_dicts[0]["track_map"],
+        "lap_times": lap_times,
+        "sector_times": sector_times,
+        "conditions_data": conditions_data,
+        "session_drivers": session_drivers
+    }
+
+    if "car_data_norms" in dataset_names:
+        car_data_norms = pd.concat([session_dict["car_data_norms"] for session_dict in session_dicts], ignore_index=True)
+        data_dict["car_data_norms"] = pd.DataFrame([{
+            column: car_data_norms[column].min() if column.endswith("Min") else car_data_norms[column].max()
+            for column in car_data_norms.columns
+        }], columns=car_data_norms.columns)
+
+    print("Time taken: " + str(datetime.now() - time_start))
+
+    return data_dict
+
+
+def get_session_dataset_names():
+    # Datasets held in each session snapshot; light version has no telemetry
+    if light_version:
+        return [name for name in session_dataset_names if name != "car_data_norms"]
+    return session_dataset_names
+
+
+def prepare_session_datasets(event_id, session_name, force_refresh=False):
+    # Makes sure a snapshot of the session exists in the file store, reading from SQL only if it doesn't
+    # Returns a small handle for the client-side store in place of the datasets themselves
+    key = file_store.snapshot_key(event_id, session_name)
+    if force_refresh or not file_store.snapshot_exists(key, get_session_dataset_names()):
+        data_dict = read_session_data(event_id, session_name)
+        file_store.write_snapshot(key, data_dict)
 
-    sql = f"EXEC dbo.Read_CarData @EventId={event_id}, @SessionName='{session_name}', @LapIdA={lap_ids[0]}"
+    return {
+        "EventId": event_id,
+        "SessionName": session_name,
+        "SnapshotKey": key
+    }
+
+
+def get_session_datasets(handle, dataset_names):
+    # Reads only the named datasets for a loaded session, along with filter indexes for those that have them
+    # The cache cleanup thread may have removed the snapshot since it was loaded, in which case rebuild it
+    try:
+        data_dict = file_store.read_snapshot(handle["SnapshotKey"], dataset_names)
+    except FileNotFoundError:
+        prepare_session_datasets(handle["EventId"], handle["SessionName"])
+        data_dict = file_store.read_snapshot(handle["SnapshotKey"], dataset_names)
+
+    # Identifies the session for views derived from these datasets
+    data_dict["snapshot_key"] = handle["SnapshotKey"]
+
+    data_dict["filter_indexes"] = {}
+    for dataset_name in dataset_names:
+        if dataset_name in filter_indexed_dataset_names:
+            data_dict["filter_indexes"][dataset_name] = get_filter_index(handle["SnapshotKey"], dataset_name, data_dict[dataset_name])
+
+    if "track_map" in dataset_names:
+        data_dict["track_sections"] = get_track_sections(handle["SnapshotKey"], data_dict["track_map"])
+
+    return data_dict
+
+
+def get_filter_index(key, dataset_name, data):
+    # Indexes live in the memory tier next to their datasets, so are dropped along with them when a snapshot is rewritten
+    cache_key = (key, dataset_name, "filter_index")
+    index = file_store.memory_cache_get(cache_key)
+    if index is None:
+        index = filter_index.build_filter_index(data)
+        file_store.memory_cache_put(cache_key, index, filter_index.get_index_size(index))
+
+    return index
+
+
+def get_track_sections(key, track_map):
+    # Track map split into sorted per-section polylines, held in the memory tier alongside the track map
+    cache_key = (key, "track_map", "track_sections")
+    track_sections = file_store.memory_cache_get(cache_key)
+    if track_sections is None:
+        track_sections = filter_index.split_track_map(track_map)
+        size = sum(
+            int(track.memory_usage(deep=True).sum())
+            for section_tracks in track_sections.values()
+            for track in section_tracks.values()
+        )
+        file_store.memory_cache_put(cache_key, track_sections, size)
+
+    return track_sections
+
+
+def telemetry_bundle_enabled(session_name):
+    # Practice (all) laps are already in each practice session's bundle, so it is served from the per-lap cache instead
+    if session_name == "Practice (all)":
+        return False
+    if "All" in telemetry_bundle_session_types:
+        return True
+    return any(session_name.startswith(session_type) for session_type in telemetry_bundle_session_types)
+
+
+def read_session_car_data(event_id, session_name):
+    with sql_connection.get_sqlalchemy_connection() as connection:
+        data = pd.read_sql_query(f"SET NOCOUNT ON; EXEC dbo.Read_CarDataSession @EventId={event_id}, @SessionName='{session_name}';", connection)
+
+    return data
+
+
+def get_telemetry_bundle_lock(key):
+    with telemetry_bundle_locks_lock:
+        return telemetry_bundle_locks.setdefault(key, threading.Lock())
+
+
+def prepare_telemetry_bundle(event_id, session_name, force_refresh=False):
+    # Reads the session's car data from SQL once, so laps can be served from the bundle with no further queries
+    # Concurrent first requests for a session wait for the one building its bundle, rather than each reading the whole session
+    key = file_store.snapshot_key(event_id, session_name)
+    if not force_refresh and file_store.telemetry_bundle_exists(key):
+        return key
+
+    with get_telemetry_bundle_lock(key):
+        if force_refresh or not file_store.telemetry_bundle_exists(key):
+            file_store.write_telemetry_bundle(key, read_session_car_data(event_id, session_name))
+
+    return key
+
+
+def get_lap_telemetry(event_id, session_name, lap_ids):
+    # Car data for the given laps, served from the session's telemetry bundle where enabled
+    # Otherwise from the per-lap cache, reading from SQL only when a lap is missing
+    # Laps are cached per session, as Practice (all) telemetry has the session time offset applied
+    key = file_store.snapshot_key(event_id, session_name)
+    if telemetry_bundle_enabled(session_name):
+        prepare_telemetry_bundle(event_id, session_name)
+        data = file_store.read_telemetry_bundle(key, lap_ids)
+        if data is not None:
+            return data
+
+    lap_data = {}
+    for lap_id in lap_ids:
+        data = file_store.read_lap_telemetry(key, lap_id)
+        if data is not None:
+            lap_data[lap_id] = data
+
+    # Only laps not already cached are read, in one batch
+    missing_lap_ids = [lap_id for lap_id in lap_ids if lap_id not in lap_data]
+    if len(missing_lap_ids) > 0:
+        data = read_car_data(event_id, session_name, missing_lap_ids)
+        for lap_id, lap_frame in data.groupby("LapId", sort=False):
+            lap_data[lap_id] = lap_frame.reset_index(drop=True)
+        for lap_id in missing_lap_ids:
+            if lap_id not in lap_data:
+                lap_data[lap_id] = data.iloc[0:0].reset_index(drop=True)
+            file_store.write_lap_telemetry(key, lap_id, lap_data[lap_id])
+
+    # A new frame, so callers are free to modify it
+    return pd.concat([lap_data[lap_id] for lap_id in lap_ids], ignore_index=True)
+
+
+def get_session_offsets(event_id, session_name):
+    # Session time offsets by SessionId, only non-zero when combining practice sessions
+    if session_name != "Practice (all)":
+        return None
+
+    cache_key = (file_store.snapshot_key(event_id, session_name), "session_offsets")
+    offsets = file_store.memory_cache_get(cache_key)
+    if offsets is None:
+        offsets_frame = read_session_offsets(event_id, session_name)
+        offsets = dict(zip(offsets_frame["SessionId"], offsets_frame["SessionTimeOffset"]))
+        file_store.memory_cache_put(cache_key, offsets, 1000)
+
+    return offsets
+
+
+def read_car_data(event_id, session_name, lap_ids):
+    # Car data for any number of laps in one query, with the session time offset applied here rather than in SQL
 
-    if len(lap_ids) == 2:
-        sql += f", @LapIdB={lap_ids[1]};"
-    else:
-        sql += ", @LapIdB=NULL;"
+    sql = f"EXEC dbo.Read_CarDataLaps @EventId={event_id}, @SessionName='{session_name}', @LapIds='{','.join(str(int(lap_id)) for lap_id in lap_ids)}';"
 
-    data = pd.read_sql_query("SET NOCOUNT ON; " + sql, sqlalchemy_engine)
+    with sql_connection.get_sqlalchemy_connection() as connection:
+        data = pd.read_sql_query("SET NOCOUNT ON; " + sql, connection)
 
-    sqlalchemy_engine.dispose()
+    offsets = get_session_offsets(event_id, session_name)
+    if offsets is not None:
+        data["SessionTime"] = data["SessionTime"] + data["SessionId"].map(offsets).fillna(0)
 
-    return data
\ No newline at end of file
+    return data.drop(columns="SessionId")
\ No newline at end of file
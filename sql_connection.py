@@ -1,20 +1,73 @@
-import pyodbc
 import sqlalchemy
+import threading
+import socket
+import time
 import os
 
 
+# Host and connection details are resolved once per worker at import, rather than forking a shell on every call
+host_name = socket.gethostname()
+
+if "DESKTOP" in host_name:
+    server = "DESKTOP-O203E5C\SAMPLESERVER"
+    database = "F1DashStreamline"
+    sqlalchemy_url = "mssql+pyodbc://"+server+"/"+database+"?driver=ODBC+Driver+13+for+SQL+Server&trusted_connection=yes&mars_connection=yes"
+else:
+    # Azure connection string, required so a missing setting fails at startup rather than on the first query
+    sqlalchemy_url = os.environ["CUSTOMCONNSTR_F1DashSqlAlchemy"]
+
+# Pool sizing per worker; read_session_data alone runs six reads in parallel
+pool_size = 6
+max_overflow = 10
+
+engine = None
+engine_lock = threading.Lock()
+
+pool_stats = {
+    "checkouts": 0,
+    "checkout_seconds_total": 0.0,
+    "checkout_seconds_max": 0.0,
+    "overflow_peak": 0
+}
+pool_stats_lock = threading.Lock()
+
+
+def get_sqlalchemy_engine():
+    # Returns the long-lived engine for this worker, creating it on first use
+    # Callers share the engine's connection pool so must not dispose of it
+    global engine
+    if engine is None:
+        with engine_lock:
+            if engine is None:
+                engine = sqlalchemy.create_engine(
+                    sqlalchemy_url,
+                    fast_executemany=True, pool_pre_ping=True, pool_recycle=3600,
+                    pool_size=pool_size, max_overflow=max_overflow
+                )
+
+    return engine
+
+
+def timed_checkout(connect):
+    # Checks out a pooled connection and records how long the pool took to provide it
+    time_start = time.perf_counter()
+    connection = connect()
+    checkout_seconds = time.perf_counter() - time_start
+
+    overflow = get_sqlalchemy_engine().pool.overflow()
+    with pool_stats_lock:
+        pool_stats["checkouts"] += 1
+        pool_stats["checkout_seconds_total"] += checkout_seconds
+        pool_stats["checkout_seconds_max"] = max(pool_stats["checkout_seconds_max"], checkout_seconds)
+        pool_stats["overflow_peak"] = max(pool_stats["overflow_peak"], overflow)
+
+    return connection
+
+
 def get_pyodbc_connection():
-    host_name = os.popen("hostname").read()
-    if "DESKTOP" in host_name:
-        server = "DESKTOP-O203E5C\SAMPLESERVER"
-        database = "F1DashStreamline"
-        connection = pyodbc.connect("DRIVER={ODBC Driver 13 for SQL Server};SERVER="+server+";DATABASE="+database+";TRUSTED_CONNECTION=yes;MARS_Connection=yes")
-        cursor = connection.cursor()
-    else:
-        # Azure connection string
-        connection_string = os.environ["SQLAZURECONNSTR_F1Dash"]
-        connection = pyodbc.connect(connection_string)
-        cursor = connection.cursor()
+    # Raw pyodbc connection drawn from the engine's pool; closing it returns it to the pool
+    connection = timed_checkout(get_sqlalchemy_engine().raw_connection)
+    cursor = connection.cursor()
 
     return {
         "connection": connection,
@@ -22,19 +75,27 @@ def get_pyodbc_connection():
     }
 
 
-def get_sqlalchemy_engine():
-    host_name = os.popen("hostname").read()
-    if "DESKTOP" in host_name:
-        server = "DESKTOP-O203E5C\SAMPLESERVER"
-        database = "F1DashStreamline"
-        engine = sqlalchemy.create_engine(
-            "mssql+pyodbc://"+server+"/"+database+"?driver=ODBC+Driver+13+for+SQL+Server&trusted_connection=yes&mars_connection=yes",
-            fast_executemany=True, pool_pre_ping=True, pool_recycle=3600
-        )
-    else:
-        # Azure connection string
-        connection_string = os.environ["CUSTOMCONNSTR_F1DashSqlAlchemy"]
-        engine = sqlalchemy.create_engine(connection_string, fast_executemany=True, pool_pre_ping=True, pool_recycle=3600)
+def get_sqlalchemy_connection():
+    # SQLAlchemy connection drawn from the engine's pool, intended for use as a context manager
+    return timed_checkout(get_sqlalchemy_engine().connect)
 
-    return engine
 
+def get_pool_status():
+    # Current pool occupancy alongside checkout latency since startup
+    pool = get_sqlalchemy_engine().pool
+    with pool_stats_lock:
+        checkouts = pool_stats["checkouts"]
+        mean_checkout_ms = pool_stats["checkout_seconds_total"] / checkouts * 1000 if checkouts > 0 else 0
+        max_checkout_ms = pool_stats["checkout_seconds_max"] * 1000
+        overflow_peak = pool_stats["overflow_peak"]
+
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "overflow_peak": max(overflow_peak, 0),
+        "checkouts": checkouts,
+        "mean_checkout_ms": round(mean_checkout_ms, 2),
+        "max_checkout_ms": round(max_checkout_ms, 2)
+    }
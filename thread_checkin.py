@@ -2,10 +2,11 @@ import sql_connection
 import random
 import time
 import string
-import os
 import read_database
 import update_database
 import file_store
+import api_archive
+import logging_queue
 
 characters = string.ascii_lowercase + string.digits
 
@@ -14,7 +15,7 @@ def thread_initiate(max_wakeup_delay):
 
     wait_time = random.random() * max_wakeup_delay
     time.sleep(wait_time)
-    host_name = os.popen("hostname").read()
+    host_name = sql_connection.host_name
     thread_id = ''.join(random.choice(characters) for i in range(24))
 
     return host_name, thread_id
@@ -49,6 +50,13 @@ def thread_loop(type, max_wakeup_delay, thread_sleep_in_hours, delete_delay_in_h
                 files_deleted = file_store.cleanup(delete_delay_in_hours)
                 if files_deleted > 0:
                     read_database.app_logging("app", "cache_cleanup_thread", f"Cache cleanup thread deleted {files_deleted} files")
+                if api_archive.enabled:
+                    archives_deleted = api_archive.cleanup()
+                    if archives_deleted > 0:
+                        read_database.app_logging("app", "cache_cleanup_thread", f"Cache cleanup thread deleted {archives_deleted} API archive sessions")
+                read_database.app_logging("app", "connection_pool", str(sql_connection.get_pool_status()))
+                read_database.app_logging("app", "logging_queue", str(logging_queue.get_logging_status()))
+                read_database.app_logging("app", "memory_cache", str(file_store.get_memory_cache_status()))
                 quick_loop = False
             
             if quick_loop:
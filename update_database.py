@@ -1,54 +1,129 @@
 import fastf1 as ff
 import pandas as pd
+import numpy as np
+import pyodbc
 from sqlalchemy.exc import OperationalError
 import datetime
-import os
 import time
+import os
+import hashlib
+import requests
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import resource
+except ImportError:
+    resource = None
 import sql_connection
+import logging_queue
+import read_database
+import api_archive
+import upload_controller
+import car_data_merge
 
 
 pd.options.mode.chained_assignment = None
 
-
-def data_logging(pyodbc_connection, message):
-    host_name = os.popen("hostname").read()
-    cursor = pyodbc_connection["cursor"]
-    cursor.execute("EXEC dbo.Logging_Data @HostName=?, @Message=?", host_name, message)
-    cursor.commit()
+prewarm_caches = False
+
+# Raw files behind the FastF1 API calls, whose headers are checked before downloading a session again
+upstream_files = [
+    "TimingData.jsonStream",
+    "TimingAppData.jsonStream",
+    "CarData.z.jsonStream",
+    "Position.z.jsonStream",
+    "TrackStatus.jsonStream",
+    "SessionStatus.jsonStream",
+    "DriverList.jsonStream",
+    "WeatherData.jsonStream"
+]
+
+# Past seasons' schedules are kept here once fetched, as they don't change
+schedule_cache_directory = "./schedule_cache/"
+first_season = 2018
+
+# Number of downloaded sessions held in memory waiting for upload while loading
+load_pipeline_queue_size = 1
+
+# Whether car and position data are reshaped and uploaded one driver at a time rather than as whole-session frames
+streaming_ingestion = False
+
+# "to_sql" or "tvp"; tvp passes each chunk to a Load_ procedure as a table-valued parameter
+upload_backend = "to_sql"
+
+# Columns of the table types in CreateLoadStoredProcedures.sql, in order, with how values are converted
+bulk_upload_columns = {
+    "Lap": [("id", "int"), ("SessionId", "int"), ("Driver", "int"), ("Time", "float"), ("LapTime", "float"), ("NumberOfLaps", "int"), ("NumberOfPitStops", "int"), ("PitOutTime", "float"), ("PitInTime", "float"), ("IsPersonalBest", "bit")],
+    "Sector": [("SessionId", "int"), ("Driver", "int"), ("LapId", "int"), ("SectorNumber", "int"), ("SectorTime", "float"), ("SectorSessionTime", "float")],
+    "TimingData": [("SessionId", "int"), ("LapNumber", "int"), ("Driver", "int"), ("LapTime", "float"), ("Stint", "int"), ("TotalLaps", "int"), ("Compound", "str"), ("New", "bit"), ("TyresNotChanged", "bit"), ("Time", "float"), ("LapFlags", "float"), ("LapCountTime", "float"), ("StartLaps", "float"), ("OutLap", "float")],
+    "CarData": [("SessionId", "int"), ("Driver", "int"), ("Time", "float"), ("Date", "datetime"), ("RPM", "int"), ("Speed", "int"), ("Gear", "int"), ("Throttle", "int"), ("Brake", "bit"), ("DRS", "int"), ("Source", "str")],
+    "PositionData": [("SessionId", "int"), ("Driver", "int"), ("Time", "float"), ("Date", "datetime"), ("Status", "str"), ("X", "int"), ("Y", "int"), ("Z", "int"), ("Source", "str")],
+    "TrackStatus": [("SessionId", "int"), ("Time", "float"), ("Status", "int"), ("Message", "str")],
+    "SessionStatus": [("SessionId", "int"), ("Time", "float"), ("Status", "str")],
+    "DriverInfo": [("SessionId", "int"), ("RacingNumber", "int"), ("BroadcastName", "str"), ("FullName", "str"), ("Tla", "str"), ("Line", "int"), ("TeamName", "str"), ("TeamColour", "str"), ("FirstName", "str"), ("LastName", "str"), ("Reference", "str"), ("HeadshotUrl", "str"), ("CountryCode", "str"), ("NameFormat", "str"), ("DriverOrder", "int"), ("TeamOrder", "int")],
+    "WeatherData": [("SessionId", "int"), ("Time", "float"), ("AirTemp", "float"), ("Humidity", "float"), ("Pressure", "float"), ("Rainfall", "bit"), ("TrackTemp", "float"), ("WindDirection", "int"), ("WindSpeed", "float")],
+    "MergedCarDataStaging": [("SessionId", "int"), ("Driver", "int"), ("LapId", "int"), ("SectorNumber", "int"), ("Time", "float"), ("RPM", "int"), ("Speed", "int"), ("Gear", "int"), ("Throttle", "int"), ("Brake", "bit"), ("DRS", "int")]
+}
+kind_types = {"int": "int64", "float": "float64"}
+
+# Dtypes applied to each table's frames as they are ingested, to cut their memory before upload
+# Integer columns with missing values use the nullable equivalent, and columns with values out of range are left as they are
+ingest_dtypes = {
+    "Lap": {"id": "int32", "SessionId": "int32", "Driver": "category", "NumberOfLaps": "int16", "NumberOfPitStops": "int8", "IsPersonalBest": "bool"},
+    "Sector": {"LapId": "int32", "Driver": "category", "SectorNumber": "int8", "SessionId": "int32"},
+    "TimingData": {"LapNumber": "int16", "Driver": "category", "Stint": "int8", "TotalLaps": "int16", "Compound": "category", "New": "bool", "TyresNotChanged": "bool", "SessionId": "int32"},
+    "CarData": {"RPM": "int16", "Speed": "int16", "Gear": "int8", "Throttle": "int16", "Brake": "bool", "DRS": "int8", "Source": "category", "Driver": "category", "SessionId": "int32"},
+    "PositionData": {"Status": "category", "X": "int32", "Y": "int32", "Z": "int32", "Source": "category", "Driver": "category", "SessionId": "int32"},
+    "TrackStatus": {"SessionId": "int32"},
+    "SessionStatus": {"Status": "category", "SessionId": "int32"},
+    "WeatherData": {"WindDirection": "int16", "Rainfall": "bool", "SessionId": "int32"}
+}
+
+# Maximum number of FastF1 API calls made at once while downloading a session
+api_download_workers = 8
+
+# FastF1 API calls for a session: name, call, message if unavailable, and whether unavailability aborts the load
+api_endpoints = [
+    ("lap_data", lambda api_string: ff.api.timing_data(api_string)[0], "Lap data unavailable", True),
+    ("timing_data", ff.api.timing_app_data, "Timing data unavailable", True),
+    ("car_data", ff.api.car_data, "Car data unavailable", True),
+    ("position_data", ff.api.position_data, "Position data unavailable", True),
+    ("track_status", ff.api.track_status_data, "Track status data unavailable", True),
+    ("session_status", ff.api.session_status_data, "Session status data unavailable", True),
+    ("driver_info", ff.api.driver_info, "Session driver info unavailable", True),
+    # Missing weather data does not cause abort; seems to be missing from preseason data
+    ("weather_data", ff.api.weather_data, "Session weather data unavailable", False)
+]
+
+
+def data_logging(message):
+    # Queued and written to dbo.Log_Data in batches by a background thread
+    logging_queue.enqueue("data", (message,))
     print("data_logging: " + message)
 
 
-def refresh_schedule(pyodbc_connection, sqlalchemy_engine, reload_history=False):
-    # Refreshes future event data only - rounds with existing data are not touched
-    data_logging(pyodbc_connection, "Starting schedule refresh")
-    current_year = datetime.datetime.now().year
-    years = list(range(2018, current_year + 1))
-
-    schedules_to_concat = []
-    for year in years:
-        schedules_to_concat.append(ff.get_event_schedule(year))
-
-    schedule = pd.concat(schedules_to_concat)
-    
-    cursor = pyodbc_connection["cursor"]
-    cursor.execute("EXEC dbo.Truncate_Schedule @ClearAll=?", 1 if reload_history else 0)
-    cursor.commit()
+def get_season_schedule(year, current_year):
+    # Returns the season's schedule, and whether it was fetched from the API
+    # Past seasons never change, so are fetched once and kept locally
+    path = schedule_cache_directory + str(year) + ".pkl"
+    if year < current_year and os.path.exists(path):
+        return pd.read_pickle(path), False
 
-    last_event_date_with_data = cursor.execute("SET NOCOUNT ON; EXEC dbo.Get_LastEventDateWithData").fetchval()
-    schedule = schedule[(schedule["EventDate"] > last_event_date_with_data)].reset_index(drop=True)
-    schedule["id"] = 0
+    schedule = pd.DataFrame(ff.get_event_schedule(year))
+    if year < current_year:
+        os.makedirs(schedule_cache_directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        schedule.to_pickle(temp_path)
+        os.replace(temp_path, path)
 
-    new_event_id = cursor.execute("SET NOCOUNT ON; EXEC dbo.Get_MaxId @TableName=?", "dbo.Event").fetchval() + 1
-    new_session_id = cursor.execute("SET NOCOUNT ON; EXEC dbo.Get_MaxId @TableName=?", "dbo.Session").fetchval() + 1
+    return schedule, True
 
-    # Assign event keys
-    for i in range(0, len(schedule)):
-        schedule["id"].iloc[i] = new_event_id
-        new_event_id += 1
 
+def unpivot_schedule(schedule):
+    # Event and session rows from the schedule, with sessions linked to their event by the schedule's id column
     events = schedule[["id", "RoundNumber", "Country", "Location", "OfficialEventName", "EventDate", "EventName", "EventFormat", "F1ApiSupport"]]
 
-    # Unpivot session data
     session_frames = []
     for i in range(1, 6):
         session_frame = schedule[["id", "Session" + str(i), "Session" + str(i) + "Date"]][(~schedule["Session" + str(i)].isnull())  & (~schedule["Session" + str(i) + "Date"].isnull())]
@@ -57,31 +132,776 @@ def refresh_schedule(pyodbc_connection, sqlalchemy_engine, reload_history=False)
         session_frame["SessionOrder"] = i
         session_frames.append(session_frame)
 
+    if len(session_frames) == 0:
+        return events, pd.DataFrame(columns=["EventId", "SessionName", "SessionDate", "SessionOrder"])
+
+    return events, pd.concat(session_frames)
+
+
+def schedule_value(value):
+    # Comparable form of a schedule value, whether read from SQL or the API
+    if pd.isna(value):
+        return None
+    if isinstance(value, (datetime.datetime, np.datetime64)):
+        return str(pd.Timestamp(value))
+    if isinstance(value, (bool, np.bool_, int, float, np.integer, np.floating)):
+        return float(value)
+
+    return str(value)
+
+
+def event_signatures(events, sessions):
+    # One value per event id, covering the event's fields and its sessions, for finding events whose schedule has changed
+    session_signatures = {}
+    for session in sessions.sort_values(["EventId", "SessionOrder"]).itertuples(index=False):
+        session_signatures.setdefault(session.EventId, []).append(
+            (schedule_value(session.SessionOrder), schedule_value(session.SessionName), schedule_value(session.SessionDate))
+        )
+
+    signatures = {}
+    for event in events.itertuples(index=False):
+        fields = tuple(schedule_value(getattr(event, column)) for column in events.columns if column != "id")
+        signatures[event.id] = (fields, tuple(session_signatures.get(event.id, [])))
+
+    return signatures
+
+
+def insert_schedule(cursor, sqlalchemy_engine, events, sessions):
+    new_event_id = cursor.execute("SET NOCOUNT ON; EXEC dbo.Get_MaxId @TableName=?", "dbo.Event").fetchval() + 1
+    new_session_id = cursor.execute("SET NOCOUNT ON; EXEC dbo.Get_MaxId @TableName=?", "dbo.Session").fetchval() + 1
+
+    # Assign event keys
+    event_ids = {event_id: new_event_id + i for i, event_id in enumerate(events["id"])}
+    events = events.copy()
+    events["id"] = events["id"].map(event_ids)
+
+    sessions = sessions[sessions["EventId"].isin(event_ids)].copy()
+    sessions["EventId"] = sessions["EventId"].map(event_ids)
+
     # If there are any sessions to load, load them, otherwise return from function
-    if len(session_frames) > 0:
-        sessions = pd.concat(session_frames)
-        sessions["id"] = 0
+    if len(sessions) > 0:
         sessions.sort_values("SessionDate", inplace=True)
 
         # Assign session id
-        for i in range(0, len(sessions)):
-            sessions["id"].iloc[i] = new_session_id
-            new_session_id += 1
+        sessions["id"] = range(new_session_id, new_session_id + len(sessions))
 
         # Load to SQL
-        data_logging(pyodbc_connection, f"Loading {len(events)} records to Event")
+        data_logging(f"Loading {len(events)} records to Event")
         events.to_sql("Event", sqlalchemy_engine, if_exists="append", index=False)
-        data_logging(pyodbc_connection, f"Loading {len(sessions)} records to Session")
+        data_logging(f"Loading {len(sessions)} records to Session")
         sessions.to_sql("Session", sqlalchemy_engine, if_exists="append", index=False)
 
 
-def load_session_data(pyodbc_connection, sqlalchemy_engine, force_eventId=None, force_sessionId=None, force_reload=False):
+def refresh_schedule(pyodbc_connection, sqlalchemy_engine, reload_history=False):
+    # Refreshes future event data only - rounds with existing data are not touched
+    # Only the current and next seasons are fetched from the API; earlier seasons are read from the local cache,
+    # and only when they could still hold events without data
+    data_logging("Starting schedule refresh")
+    time_start = time.time()
+    cursor = pyodbc_connection["cursor"]
+    last_event_date_with_data = cursor.execute("SET NOCOUNT ON; EXEC dbo.Get_LastEventDateWithData").fetchval()
+
+    current_year = datetime.datetime.now().year
+    first_year = first_season if reload_history else max(first_season, min(pd.Timestamp(last_event_date_with_data).year, current_year))
+
+    schedules_to_concat = []
+    fetched_years = []
+    for year in range(first_year, current_year + 2):
+        try:
+            schedule, fetched = get_season_schedule(year, current_year)
+        except Exception as e:
+            # The next season's schedule is often not published yet
+            if year <= current_year:
+                raise
+            data_logging(f"No schedule available for {year}: {e}")
+            continue
+        schedules_to_concat.append(schedule)
+        if fetched:
+            fetched_years.append(year)
+
+    network_seconds = time.time() - time_start
+
+    schedule = pd.concat(schedules_to_concat)
+    # Reloading history clears every event, so all of them are inserted again
+    if not reload_history:
+        schedule = schedule[(schedule["EventDate"] > last_event_date_with_data)]
+    schedule = schedule.reset_index(drop=True)
+    schedule["id"] = range(0, len(schedule))
+    events, sessions = unpivot_schedule(schedule)
+
+    db_start = time.time()
+    if reload_history:
+        cursor.execute("EXEC dbo.Truncate_Schedule @ClearAll=?", 1)
+        cursor.commit()
+        changed_event_ids = []
+        new_events = events
+    else:
+        # Events without data are compared with the new schedule, so only changed events are rewritten
+        existing_schedule = pd.read_sql_query("SET NOCOUNT ON; EXEC dbo.Read_UnloadedSchedule", sqlalchemy_engine)
+        existing_events = existing_schedule[events.columns].drop_duplicates("id")
+        existing_sessions = existing_schedule[["EventId", "SessionName", "SessionDate", "SessionOrder"]]
+        existing_signatures = event_signatures(existing_events, existing_sessions)
+        new_signatures = event_signatures(events, sessions)
+
+        unchanged_signatures = set(existing_signatures.values()) & set(new_signatures.values())
+        changed_event_ids = [int(event_id) for event_id, signature in existing_signatures.items() if signature not in unchanged_signatures]
+        new_events = events[[new_signatures[event_id] not in unchanged_signatures for event_id in events["id"]]]
+
+        if len(changed_event_ids) > 0:
+            cursor.execute("EXEC dbo.Delete_ScheduleEvents @EventIds=?", ",".join(str(event_id) for event_id in changed_event_ids))
+            cursor.commit()
+
+    insert_schedule(cursor, sqlalchemy_engine, new_events, sessions)
+
+    data_logging(
+        f"Schedule refresh: fetched {fetched_years} in {round(network_seconds, 1)}s, "
+        f"{len(events) - len(new_events)} events unchanged, {len(changed_event_ids)} removed, {len(new_events)} added, "
+        f"database {round(time.time() - db_start, 1)}s"
+    )
+
+
+def compact_series(series, dtype):
+    # Returns the series as dtype, or unchanged if its values don't fit
+    if dtype == "category":
+        return series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype("category")
+
+    if dtype == "bool":
+        if series.dtype.kind == "b":
+            return series
+        values = series.dropna()
+        if not values.map(lambda value: isinstance(value, (bool, np.bool_))).all():
+            return series
+        return series.astype("boolean" if len(values) < len(series) else "bool")
+
+    values = pd.to_numeric(series.astype(object) if isinstance(series.dtype, pd.CategoricalDtype) else series, errors="coerce")
+    if (values.isna() & series.notna()).any():
+        return series
+    present = values.dropna()
+    if len(present) > 0 and ((present % 1 != 0).any() or present.min() < np.iinfo(dtype).min or present.max() > np.iinfo(dtype).max):
+        return series
+    if len(present) < len(values):
+        return values.astype(dtype.capitalize())
+
+    return values.astype(dtype)
+
+
+def compact_dtypes(data, table_name, memory_report=None):
+    # Applies the table's ingest dtypes; with memory_report, adds the frame's size before and after, in bytes, to the table's entry
+    if memory_report is not None:
+        size_before = int(data.memory_usage(deep=True).sum())
+    for column, dtype in ingest_dtypes.get(table_name, {}).items():
+        if column in data.columns and data[column].dtype != dtype:
+            data[column] = compact_series(data[column], dtype)
+    if memory_report is not None:
+        sizes = memory_report.setdefault(table_name, [0, 0])
+        sizes[0] += size_before
+        sizes[1] += int(data.memory_usage(deep=True).sum())
+
+    return data
+
+
+def log_memory_report(memory_report, session):
+    for table_name, (size_before, size_after) in memory_report.items():
+        data_logging(f"{table_name} for SessionId {session['SessionId']} compacted from {round(size_before / 1000000, 1)}MB to {round(size_after / 1000000, 1)}MB")
+
+
+def call_api_endpoint(endpoint_name, api_call, api_string, replay=False):
+    # Returns None in place of the result if the session isn't available, along with the time taken
+    # In replay mode the response is read from the local archive instead, with no network access
+    time_start = time.time()
+    if replay:
+        result = api_archive.read_response(api_string, endpoint_name)
+        return result, time.time() - time_start
+
+    try:
+        result = api_call(api_string)
+    except ff.api.SessionNotAvailableError:
+        result = None
+
+    if api_archive.enabled:
+        api_archive.write_response(api_string, endpoint_name, result)
+
+    return result, time.time() - time_start
+
+
+def download_session_data(api_string, replay=False):
+    # The API calls are independent and I/O bound, so are made concurrently
+    # Results and unavailability are handled in the same order as before once every call has finished
+    time_start = time.time()
+    with ThreadPoolExecutor(max_workers=api_download_workers) as executor:
+        futures = [executor.submit(call_api_endpoint, endpoint[0], endpoint[1], api_string, replay) for endpoint in api_endpoints]
+        results = [future.result() for future in futures]
+
+    session_data = {}
+    abort = False
+    for (name, api_call, unavailable_message, required), (result, duration) in zip(api_endpoints, results):
+        session_data[name] = result
+        if result is None:
+            data_logging(f"{unavailable_message}: {api_string}")
+            abort = abort or required
+
+    timings = ", ".join(f"{endpoint[0]} {round(result[1], 1)}s" for endpoint, result in zip(api_endpoints, results))
+    data_logging(f"{'Archive' if replay else 'API'} timings for {api_string}: {timings}; total {round(time.time() - time_start, 1)}s")
+
+    return session_data, abort
+
+
+def prepare_session_frames(session, replay=False):
+    # Download and reshape stage of the load pipeline; makes no SQL calls, so it can run ahead of the uploads
+    # Cheap HEAD requests are made first, and the download skipped if nothing has changed since the last load
+    upstream_stamp = None if replay else get_upstream_stamp(session["api_string"])
+    previous_upstream = session["manifest"].get("Upstream")
+    if upstream_stamp is not None and previous_upstream is not None and upstream_stamp == previous_upstream["ContentHash"]:
+        data_logging(f"Upstream unchanged since last load: {session['api_string']}")
+        return {"session": session, "abort": False, "upstream_unchanged": True}
+
+    data_logging(f"{'Reading archive' if replay else 'Calling API'}: {session['api_string']}")
+    session_data, abort = download_session_data(session["api_string"], replay)
+    lap_data = session_data["lap_data"]
+    timing_data = session_data["timing_data"]
+    car_data = session_data["car_data"]
+    position_data = session_data["position_data"]
+    track_status = session_data["track_status"]
+    session_status = session_data["session_status"]
+    driver_info = session_data["driver_info"]
+    weather_data = session_data["weather_data"]
+
+    # Check for any zero-length data returned from API (e.g. Hungary 2023 P1 drivers)
+    if not abort:
+        for dataset in [
+            (lap_data, "lap data"),
+            (timing_data, "timing data"),
+            (car_data, "car data"),
+            (position_data, "position data"),
+            (track_status, "track status"),
+            (session_status, "session status"),
+            (driver_info, "driver info")
+        ]:
+            if len(dataset[0]) == 0:
+                data_logging(f"Zero-length result for {dataset[1]}: {session['api_string']}")
+                abort = True
+
+    if abort:
+        return {"session": session, "abort": True}
+
+    data_logging(f"Peak memory after download: {get_peak_memory_in_MB()}MB")
+
+    # Sizes before and after each dataset's dtypes are compacted
+    memory_report = {}
+
+    # Lap ids are numbered from zero here and offset when the session is uploaded, as other sessions may be uploaded first
+    lap_data["SessionId"] = session["SessionId"]
+    lap_data["id"] = range(0, len(lap_data))
+
+    # Lap
+    laps = lap_data[["id", "SessionId", "Time", "Driver", "LapTime", "NumberOfLaps", "NumberOfPitStops", "PitOutTime", "PitInTime", "IsPersonalBest"]][(lap_data["Driver"] != "")]
+
+    # Sector
+    sector_frames = []
+    for i in range(1, 4):
+        sector_frame = lap_data[["id", "Driver", "Sector" + str(i) + "Time", "Sector" + str(i) + "SessionTime"]][(~lap_data["Sector" + str(i) + "Time"].isnull()) & (lap_data["Driver"] != "")]
+        if len(sector_frame) == 0: continue
+        sector_frame.rename(columns={"id": "LapId", "Sector" + str(i) + "Time": "SectorTime", "Sector" + str(i) + "SessionTime": "SectorSessionTime"}, inplace=True)
+        sector_frame["SectorNumber"] = i
+        sector_frames.append(sector_frame)
+
+    sectors = pd.concat(sector_frames)
+    sectors["SessionId"] = session["SessionId"]
+    sectors.sort_values("LapId", inplace=True)
+    laps = compact_dtypes(laps, "Lap", memory_report)
+    sectors = compact_dtypes(sectors, "Sector", memory_report)
+
+    # Timing data
+    timing_data["SessionId"] = session["SessionId"]
+    timing_data = compact_dtypes(timing_data, "TimingData", memory_report)
+
+    # Car data and position data
+    # In streaming mode these stay as the API's per-driver frames, and are reshaped and compacted one driver at a time as they are uploaded
+    if not streaming_ingestion:
+        # Categories differ between drivers, so are applied again to the whole session
+        car_data = compact_dtypes(pd.concat(list(telemetry_frames(car_data, session["SessionId"], "CarData", True, memory_report))), "CarData")
+        position_data = compact_dtypes(pd.concat(list(telemetry_frames(position_data, session["SessionId"], "PositionData", True, memory_report))), "PositionData")
+
+    # Track status
+    track_status = pd.DataFrame(track_status)
+    track_status["SessionId"] = session["SessionId"]
+    track_status = compact_dtypes(track_status, "TrackStatus", memory_report)
+
+    # Session status
+    session_status = pd.DataFrame(session_status)
+    session_status["SessionId"] = session["SessionId"]
+    session_status = compact_dtypes(session_status, "SessionStatus", memory_report)
+
+    # Driver info
+    driver_frames = []
+    i = 0
+    for driver in driver_info:
+        driver_frame = pd.DataFrame(driver_info[driver], index=[i])
+        driver_frames.append(driver_frame)
+        i += 1
+
+    driver_info = pd.concat(driver_frames)
+    driver_info["SessionId"] = session["SessionId"]
+
+    # Weather data
+    if weather_data is not None:
+        weather_data = pd.DataFrame(weather_data)
+        weather_data["SessionId"] = session["SessionId"]
+        weather_data = compact_dtypes(weather_data, "WeatherData", memory_report)
+    else:
+        weather_data = pd.DataFrame()
+
+    log_memory_report(memory_report, session)
+    data_logging(f"Peak memory after reshape: {get_peak_memory_in_MB()}MB")
+
+    return {
+        "session": session,
+        "abort": False,
+        "upstream_stamp": upstream_stamp,
+        "laps": laps,
+        "sectors": sectors,
+        "timing_data": timing_data,
+        "car_data": car_data,
+        "position_data": position_data,
+        "track_status": track_status,
+        "session_status": session_status,
+        "driver_info": driver_info,
+        "weather_data": weather_data
+    }
+
+
+def upload_chunk_to_sql(cursor, sqlalchemy_engine, chunk, table_name):
+    chunk.to_sql(table_name, sqlalchemy_engine, if_exists="append", index=False)
+
+
+def bulk_upload_rows(data, columns):
+    # Rows for a table-valued parameter, in the column order of its table type
+    # Values are converted as to_sql would convert them; columns missing from the frame are loaded as NULL
+    frame_columns = {column.lower(): column for column in data.columns}
+    column_values = []
+    for column, kind in columns:
+        if column.lower() not in frame_columns:
+            column_values.append(np.full(len(data), None, dtype=object))
+            continue
+
+        series = data[frame_columns[column.lower()]]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        mask = series.isna().to_numpy()
+        if kind == "datetime":
+            values = np.array(series.dt.round("ms").dt.to_pydatetime(), dtype=object)
+        elif series.dtype.kind == "m":
+            # Timedeltas are stored as nanoseconds, as to_sql does
+            values = series.to_numpy().view("int64").astype(kind_types[kind]).astype(object)
+        elif kind == "str":
+            values = series.astype(str).to_numpy(dtype=object)
+        elif kind == "bit":
+            values = series.fillna(False).astype(bool).to_numpy(dtype=object)
+        else:
+            values = pd.to_numeric(series, errors="coerce").fillna(0).astype(kind_types[kind]).to_numpy().astype(object)
+            mask = mask | pd.to_numeric(series, errors="coerce").isna().to_numpy()
+        values[mask] = None
+        column_values.append(values)
+
+    return list(zip(*column_values))
+
+
+def upload_chunk_bulk(cursor, sqlalchemy_engine, chunk, table_name):
+    # The chunk is passed to a Load_ procedure as a table-valued parameter and inserted with TABLOCK in one statement
+    cursor.execute(f"{{CALL dbo.Load_{table_name} (?)}}", (bulk_upload_rows(chunk, bulk_upload_columns[table_name]),))
+    cursor.commit()
+
+
+def upload_dataset(cursor, sqlalchemy_engine, data, table_name):
+    # Chunk size, the pause between chunks and retry backoff are set by upload_controller from every upload's latency and errors
+    # Returns False if a chunk still fails after upload_controller.max_retries attempts
+    if upload_backend == "tvp" and table_name in bulk_upload_columns:
+        upload_chunk = upload_chunk_bulk
+    else:
+        upload_chunk = upload_chunk_to_sql
+
+    data_logging(f"Loading {len(data)} records to {table_name}")
+    time_start = time.time()
+    position = 0
+    error_count = 0
+    while position < len(data):
+        chunk = data.iloc[position:position + upload_controller.get_chunk_size()]
+        if len(chunk) < len(data):
+            data_logging(f"Loading chunk {str(position)}:{str(position + len(chunk))} to {table_name}")
+        chunk_start = time.time()
+        try:
+            upload_chunk(cursor, sqlalchemy_engine, chunk, table_name)
+        except (OperationalError, pyodbc.OperationalError):
+            cursor.rollback()
+            error_count += 1
+            backoff_in_seconds, decision = upload_controller.record_error()
+            data_logging(f"Operational error loading chunk to {table_name}; attempt {str(error_count)}; {decision}")
+            if error_count >= upload_controller.max_retries:
+                return False
+            time.sleep(backoff_in_seconds)
+        else:
+            error_count = 0
+            position += len(chunk)
+            pause_in_seconds, decision = upload_controller.record_success(len(chunk), time.time() - chunk_start)
+            if decision is not None:
+                data_logging(f"Upload controller: {decision}")
+            if position < len(data):
+                time.sleep(pause_in_seconds)
+
+    duration = time.time() - time_start
+    data_logging(f"Loaded {len(data)} records to {table_name} in {round(duration, 1)}s ({int(len(data) / max(duration, 0.001))} rows/s, {upload_backend})")
+
+    return True
+
+
+def upload_dataset_task(sqlalchemy_engine, frames, table_name, abort_event, append_after_time=None):
+    # Uploads one table on its own pooled connection, once the controller allows another concurrent upload
+    # Tables are uploaded concurrently rather than chunks, as the bulk procedures lock the whole table
+    # Frames are uploaded in turn, and each is released before the next is reshaped; for appends only rows after append_after_time are uploaded
+    upload_controller.acquire_upload_slot()
+    try:
+        if abort_event.is_set():
+            return False
+        pyodbc_connection = sql_connection.get_pyodbc_connection()
+        try:
+            success = True
+            for data in frames:
+                if append_after_time is not None:
+                    data = data[~(time_values(data) <= append_after_time)]
+                if len(data) == 0:
+                    continue
+                success = upload_dataset(pyodbc_connection["cursor"], sqlalchemy_engine, data, table_name)
+                if not success or abort_event.is_set():
+                    break
+        finally:
+            pyodbc_connection["connection"].close()
+    finally:
+        upload_controller.release_upload_slot()
+
+    if not success:
+        abort_event.set()
+
+    return success
+
+
+def get_upstream_stamp(api_string):
+    # Hash of the headers of the session's raw files on the live timing server, from HEAD requests only
+    # Returns None if any request fails or has no validator, in which case the session is downloaded as normal
+    def head(file_name):
+        try:
+            response = requests.head(ff.api.base_url + api_string + file_name, timeout=10)
+        except requests.RequestException:
+            return None
+        validator = response.headers.get("ETag", response.headers.get("Last-Modified"))
+        if response.status_code != 200 or validator is None:
+            return None
+        return f"{file_name}:{validator}:{response.headers.get('Content-Length')}"
+
+    with ThreadPoolExecutor(max_workers=api_download_workers) as executor:
+        stamps = list(executor.map(head, upstream_files))
+
+    if any(stamp is None for stamp in stamps):
+        return None
+
+    return hashlib.md5("|".join(stamps).encode()).hexdigest()
+
+
+def manifest_frame(data, table_name):
+    # Lap ids are assigned at upload, so are left out of the manifest
+    if table_name == "Lap":
+        return data.drop(columns="id")
+    if table_name == "Sector":
+        return data.drop(columns="LapId")
+
+    return data
+
+
+def time_values(data):
+    # Time column as nanoseconds, NaN where missing
+    if data["Time"].dtype.kind == "m":
+        times = data["Time"].to_numpy().view("int64").astype("float64")
+        times[data["Time"].isna().to_numpy()] = np.nan
+        return times
+
+    return pd.to_numeric(data["Time"], errors="coerce").to_numpy(dtype="float64")
+
+
+def new_manifest(loaded_max_time=None):
+    return {"RowCount": 0, "ContentHash": np.uint64(0), "MaxTime": loaded_max_time}
+
+
+def add_to_manifest(manifest, data, table_name, loaded_manifest=None):
+    # Adds one frame's row count, latest Time and row hashes to a manifest being built
+    # Row hashes are summed, wrapping at 64 bits, so rows can be compared as a set whatever order the API returns them in
+    # With loaded_manifest, also adds the rows up to its MaxTime to it, to check whether an append is possible
+    data = manifest_frame(data, table_name)
+    row_hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+    with np.errstate(over="ignore"):
+        manifest["RowCount"] += len(data)
+        manifest["ContentHash"] += row_hashes.sum(dtype=np.uint64)
+        if "Time" not in data.columns or len(data) == 0:
+            return
+        times = time_values(data)
+        if not np.isnan(times).all():
+            max_time = float(np.nanmax(times))
+            manifest["MaxTime"] = max_time if manifest["MaxTime"] is None else max(manifest["MaxTime"], max_time)
+        if loaded_manifest is not None:
+            loaded = times <= loaded_manifest["MaxTime"]
+            loaded_manifest["RowCount"] += int(loaded.sum())
+            loaded_manifest["ContentHash"] += row_hashes[loaded].sum(dtype=np.uint64)
+
+
+def finish_manifest(manifest):
+    manifest["ContentHash"] = format(int(manifest["ContentHash"]), "016x")
+    return manifest
+
+
+def dataset_manifest(frames, table_name, loaded_max_time=None):
+    # Row count, latest Time and a content hash that doesn't depend on row order, built up one frame at a time
+    # With loaded_max_time, also returns the same for only the rows up to that time
+    manifest = new_manifest()
+    loaded_manifest = new_manifest(loaded_max_time)
+    for data in frames:
+        add_to_manifest(manifest, data, table_name, loaded_manifest if loaded_max_time is not None else None)
+
+    return finish_manifest(manifest), finish_manifest(loaded_manifest)
+
+
+def manifest_frames(frames, table_name, manifest):
+    # Passes frames through unchanged, adding each to manifest, so a full reload's manifest is built as it uploads
+    for data in frames:
+        add_to_manifest(manifest, data, table_name)
+        yield data
+
+
+def plan_dataset_load(manifest, loaded_manifest, previous_manifest):
+    # Returns "unchanged", "append" to upload only the rows newer than the last load, or "reload"
+    # Appends require every row up to the last load's latest Time to be exactly the rows loaded then
+    if manifest["RowCount"] == previous_manifest["RowCount"] and manifest["ContentHash"] == previous_manifest["ContentHash"]:
+        return "unchanged"
+
+    if loaded_manifest["MaxTime"] is not None and loaded_manifest["RowCount"] == previous_manifest["RowCount"] and loaded_manifest["ContentHash"] == previous_manifest["ContentHash"]:
+        return "append"
+
+    return "reload"
+
+
+def telemetry_frames(driver_data, session_id, table_name, release=False, memory_report=None):
+    # Reshapes and compacts the API's per-driver car or position data one driver at a time
+    # The API's frames are left as they are, and with release set each is dropped from driver_data as it is used,
+    # so only the driver being uploaded is held in reshaped form
+    for driver in list(driver_data):
+        data = (driver_data.pop(driver) if release else driver_data[driver]).copy(deep=False)
+        data.drop(["index"], axis=1, errors="ignore", inplace=True)
+        data["Driver"] = driver
+        data["SessionId"] = session_id
+        data.rename(columns={"nGear": "Gear"}, inplace=True)
+        data = compact_dtypes(data, table_name, memory_report)
+        yield data
+
+
+def dataset_frames(data, session_id, table_name, release=False, memory_report=None):
+    # Frames making up a dataset: the dataset itself, or one per driver for telemetry held back for streaming
+    if isinstance(data, dict):
+        return telemetry_frames(data, session_id, table_name, release, memory_report)
+
+    return [data]
+
+
+def get_peak_memory_in_MB():
+    # Peak resident memory of the process so far, or None where the resource module isn't available (Windows)
+    if resource is None:
+        return None
+
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000)
+
+
+def read_load_manifests(sqlalchemy_engine, session_ids):
+    # Manifest of each session's last completed upload, by SessionId then dataset
+    manifest_frame = pd.read_sql_query(
+        f"SET NOCOUNT ON; EXEC dbo.Read_LoadManifest @SessionIds='{','.join(str(int(session_id)) for session_id in session_ids)}';",
+        sqlalchemy_engine
+    )
+    manifests = {int(session_id): {} for session_id in session_ids}
+    for row in manifest_frame.itertuples(index=False):
+        manifests[int(row.SessionId)][row.DatasetName] = {
+            "RowCount": None if pd.isna(row.RowCount) else int(row.RowCount),
+            "ContentHash": row.ContentHash,
+            "MaxTime": None if pd.isna(row.MaxTime) else float(row.MaxTime)
+        }
+
+    return manifests
+
+
+def write_load_manifest(cursor, sqlalchemy_engine, session_id, manifest):
+    cursor.execute("EXEC dbo.Delete_LoadManifest @SessionId=?", int(session_id))
+    cursor.commit()
+    manifest_frame = pd.DataFrame([{"SessionId": int(session_id), "DatasetName": dataset_name, **manifest[dataset_name]} for dataset_name in manifest])
+    manifest_frame.to_sql("LoadManifest", sqlalchemy_engine, if_exists="append", index=False)
+
+
+def upload_session_frames(cursor, sqlalchemy_engine, session_frames, force_reload=False):
+    # Upload stage of the load pipeline, run on the calling thread as it uses the connection
+    session = session_frames["session"]
+    if session_frames["abort"]:
+        # Update aborted load count and add to log
+        cursor.execute("EXEC dbo.Update_IncrementAbortedLoadCount @SessionId=?", int(session["SessionId"]))
+        cursor.commit()
+        data_logging(f"Data load aborted: {session['api_string']}")
+        return
+
+    if session_frames.get("upstream_unchanged"):
+        # Nothing has changed upstream since the last load, which is as complete as it will get
+        cursor.execute("EXEC dbo.Update_SessionLoadStatus @SessionId=?, @Status=?", int(session["SessionId"]), 1)
+        cursor.commit()
+        data_logging(f"Confirmed data load complete for SessionId {session['SessionId']}, upstream unchanged")
+        return
+
+    session_id = session["SessionId"]
+    upstream_stamp = session_frames["upstream_stamp"]
+    laps = session_frames["laps"]
+    sectors = session_frames["sectors"]
+    datasets = {
+        "Lap": laps,
+        "Sector": sectors,
+        "TimingData": session_frames["timing_data"],
+        "CarData": session_frames["car_data"],
+        "PositionData": session_frames["position_data"],
+        "TrackStatus": session_frames["track_status"],
+        "SessionStatus": session_frames["session_status"],
+        "DriverInfo": session_frames["driver_info"],
+        "WeatherData": session_frames["weather_data"]
+    }
+    # Only the upload stage holds on to the frames from here
+    session_frames.clear()
+
+    # Compare each dataset with the manifest of the last load
+    # A full reload's manifest is built as the datasets upload instead, so streamed telemetry is only reshaped once
+    previous_manifest = session["manifest"]
+    full_reload = force_reload or any(table_name not in previous_manifest for table_name in datasets)
+    manifest = {}
+    plans = {}
+    for table_name in datasets:
+        if full_reload:
+            manifest[table_name] = new_manifest()
+            plans[table_name] = "reload"
+            continue
+        loaded_max_time = None
+        if previous_manifest[table_name]["MaxTime"] is not None and not pd.isna(previous_manifest[table_name]["MaxTime"]):
+            loaded_max_time = previous_manifest[table_name]["MaxTime"]
+        manifest[table_name], loaded_manifest = dataset_manifest(dataset_frames(datasets[table_name], session_id, table_name), table_name, loaded_max_time)
+        plans[table_name] = plan_dataset_load(manifest[table_name], loaded_manifest, previous_manifest[table_name])
+    # Sectors refer to lap ids, which are only assigned when laps are uploaded, so the two are reloaded together
+    if plans["Lap"] != "unchanged" or plans["Sector"] != "unchanged":
+        plans["Lap"] = "reload"
+        plans["Sector"] = "reload"
+
+    manifest["Upstream"] = {"RowCount": None, "ContentHash": upstream_stamp, "MaxTime": None}
+    data_logging(f"Load plan for SessionId {session['SessionId']}: " + ", ".join(
+        f"{table_name} {plan}" + (f" {manifest[table_name]['RowCount'] - previous_manifest[table_name]['RowCount']} rows" if plan == "append" else "") for table_name, plan in plans.items()
+    ) if not full_reload else "full reload")
+
+    if all(plan == "unchanged" for plan in plans.values()):
+        # Data already fully loaded, update flag
+        write_load_manifest(cursor, sqlalchemy_engine, session["SessionId"], manifest)
+        cursor.execute("EXEC dbo.Update_SessionLoadStatus @SessionId=?, @Status=?", int(session["SessionId"]), 1)
+        cursor.commit()
+        data_logging(f"Confirmed data load complete for SessionId {session['SessionId']}")
+        return
+
+    # Lap
+    # Ids are taken before the session's laps are deleted, so a reload never reuses ids still held by clients and caches
+    if plans["Lap"] == "reload":
+        new_lapId = cursor.execute("SET NOCOUNT ON; EXEC dbo.Get_MaxId @TableName=?", "dbo.Lap").fetchval() + 1
+        laps["id"] += new_lapId
+        sectors["LapId"] += new_lapId
+
+    # Load /reload data
+    if full_reload:
+        cursor.execute("EXEC dbo.Delete_Telemetry @SessionId=?", int(session["SessionId"]))
+    else:
+        for table_name, plan in plans.items():
+            if plan == "reload":
+                cursor.execute("EXEC dbo.Delete_TelemetryDataset @SessionId=?, @TableName=?", int(session["SessionId"]), table_name)
+    # A manifest is only kept for a completed upload, so a failed upload is followed by a full reload
+    cursor.execute("EXEC dbo.Delete_LoadManifest @SessionId=?", int(session["SessionId"]))
+    cursor.commit()
+
+    memory_report = {}
+    uploads = []
+    for table_name, plan in plans.items():
+        if plan == "unchanged":
+            continue
+        frames = dataset_frames(datasets[table_name], session_id, table_name, True, memory_report)
+        if full_reload:
+            frames = manifest_frames(frames, table_name, manifest[table_name])
+        uploads.append((frames, table_name, previous_manifest[table_name]["MaxTime"] if plan == "append" else None))
+    del datasets, laps, sectors, frames
+
+    # Once one table fails, tables not yet started are skipped
+    abort_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=upload_controller.max_concurrency) as executor:
+        futures = [executor.submit(upload_dataset_task, sqlalchemy_engine, upload[0], upload[1], abort_event, upload[2]) for upload in uploads]
+        abort = not all([future.result() for future in futures])
+    del uploads, futures
+    # Streamed telemetry is compacted as it uploads
+    log_memory_report(memory_report, session)
+    data_logging(f"Upload controller status: {upload_controller.get_status()}")
+    data_logging(f"Peak memory after upload for SessionId {session['SessionId']}: {get_peak_memory_in_MB()}MB")
+
+    if abort:
+        cursor.execute("EXEC dbo.Update_IncrementAbortedLoadCount @SessionId=?", int(session["SessionId"]))
+        cursor.commit()
+        data_logging(f"Data load aborted: {session['api_string']}")
+
+    if not abort:
+        if full_reload:
+            for table_name in plans:
+                finish_manifest(manifest[table_name])
+        write_load_manifest(cursor, sqlalchemy_engine, session["SessionId"], manifest)
+        cursor.execute("EXEC dbo.Update_SetNullTimes @SessionId=?", int(session["SessionId"]))
+        cursor.execute("EXEC dbo.Update_SetDriverTeamOrders @SessionId=?", int(session["SessionId"]))
+        cursor.execute("EXEC dbo.Insert_MissingSectors @SessionId=?", int(session["SessionId"]))
+
+        cursor.execute("EXEC dbo.Update_SessionLoadStatus @SessionId=?, @Status=?", int(session["SessionId"]), 0)
+        cursor.commit()
+        data_logging(f"Data load at least partially complete for SessionId {session['SessionId']}")
+
+
+def put_until_stopped(session_queue, item, stop_event):
+    # Blocks while the queue is full, giving up if the consumer has stopped
+    while not stop_event.is_set():
+        try:
+            session_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def download_sessions(sessions_data, session_queue, stop_event, replay=False):
+    # Producer for the load pipeline; errors are passed on to be raised by the consumer
+    try:
+        for session in sessions_data:
+            if not put_until_stopped(session_queue, prepare_session_frames(session, replay), stop_event):
+                return
+    except Exception as e:
+        put_until_stopped(session_queue, e, stop_event)
+        return
+
+    put_until_stopped(session_queue, None, stop_event)
+
+
+def load_session_data(pyodbc_connection, sqlalchemy_engine, force_eventId=None, force_sessionId=None, force_reload=False, replay=False):
+    # In replay mode API responses are read from the local archive, which must hold every endpoint for each session loaded
 
     cursor = pyodbc_connection["cursor"]
 
     # Clean up any old raw telemetry data
     cursor.execute("SET NOCOUNT ON; EXEC dbo.Cleanup_RawTelemetry")
-    data_logging(pyodbc_connection, f"Ran Cleanup_RawTelemetry")
+    cursor.commit()
+    data_logging(f"Ran Cleanup_RawTelemetry")
      
     # Get API strings
     if force_eventId is not None:
@@ -92,7 +912,7 @@ def load_session_data(pyodbc_connection, sqlalchemy_engine, force_eventId=None,
     sessions_frame = pd.read_sql_query("SET NOCOUNT ON; " + sql, sqlalchemy_engine)
 
     if len(sessions_frame) == 0:
-        data_logging(pyodbc_connection, "No sessions to update")
+        data_logging("No sessions to update")
         return False
 
     
@@ -113,238 +933,52 @@ def load_session_data(pyodbc_connection, sqlalchemy_engine, force_eventId=None,
             "api_string": api_string
         })
 
-    # Get data from API, check row counts/update load status, clear down and load as required
+    # Manifests of the last completed uploads, read here as the download stage makes no SQL calls
+    manifests = read_load_manifests(sqlalchemy_engine, [session["SessionId"] for session in sessions_data])
     for session in sessions_data:
-        data_logging(pyodbc_connection, f"Calling API: {session['api_string']}")
-        abort = False
-        try:
-            lap_data = ff.api.timing_data(session["api_string"])[0]
-        except ff.api.SessionNotAvailableError:
-            data_logging(pyodbc_connection, f"Lap data unavailable: {session['api_string']}")
-            abort = True
-
-        try:
-            timing_data = ff.api.timing_app_data(session["api_string"])
-        except ff.api.SessionNotAvailableError:
-            data_logging(pyodbc_connection, f"Timing data unavailable: {session['api_string']}")
-            abort = True
-
-        try:
-            car_data = ff.api.car_data(session["api_string"])
-        except ff.api.SessionNotAvailableError:
-            data_logging(pyodbc_connection, f"Car data unavailable: {session['api_string']}")
-            abort = True
+        session["manifest"] = {} if force_reload else manifests[int(session["SessionId"])]
+
+    # Sessions are downloaded and reshaped on a separate thread while the previous session uploads
+    # The queue is bounded so that at most load_pipeline_queue_size sessions wait in memory for upload
+    session_queue = queue.Queue(maxsize=load_pipeline_queue_size)
+    stop_event = threading.Event()
+    download_thread = threading.Thread(target=download_sessions, args=(sessions_data, session_queue, stop_event, replay), daemon=True)
+    download_thread.start()
+
+    try:
+        while True:
+            session_frames = session_queue.get()
+            if session_frames is None:
+                break
+            if isinstance(session_frames, Exception):
+                raise session_frames
+            upload_session_frames(cursor, sqlalchemy_engine, session_frames, force_reload)
+    finally:
+        stop_event.set()
 
-        try:
-            position_data = ff.api.position_data(session["api_string"])
-        except ff.api.SessionNotAvailableError:
-            data_logging(pyodbc_connection, f"Position data unavailable: {session['api_string']}")
-            abort = True
-
-        try:
-            track_status = ff.api.track_status_data(session["api_string"])
-        except ff.api.SessionNotAvailableError:
-            data_logging(pyodbc_connection, f"Track status data unavailable: {session['api_string']}")
-            abort = True
-
-        try:
-            session_status = ff.api.session_status_data(session["api_string"])
-        except ff.api.SessionNotAvailableError:
-            data_logging(pyodbc_connection, f"Session status data unavailable: {session['api_string']}")
-            abort = True
-
-        try:
-            driver_info = ff.api.driver_info(session["api_string"])
-        except ff.api.SessionNotAvailableError:
-            data_logging(pyodbc_connection, f"Session driver info unavailable: {session['api_string']}")
-            abort = True
-
-        try:
-            weather_data = ff.api.weather_data(session["api_string"])
-        except ff.api.SessionNotAvailableError:
-            data_logging(pyodbc_connection, f"Session weather data unavailable: {session['api_string']}")
-            # Missing weather data does not cause abort; seems to be missing from preseason data
-
-        # Check for any zero-length data returned from API (e.g. Hungary 2023 P1 drivers)
-        if not abort:
-            for dataset in [
-                (lap_data, "lap data"),
-                (timing_data, "timing data"),
-                (car_data, "car data"),
-                (position_data, "position data"),
-                (track_status, "track status"),
-                (session_status, "session status"),
-                (driver_info, "driver info")
-            ]:
-                if len(dataset[0]) == 0:
-                    data_logging(pyodbc_connection, f"Zero-length result for {dataset[1]}: {session['api_string']}")
-                    abort = True
-
-        if abort:
-            # Update aborted load count and add to log, continue to next loop iteration
-            cursor.execute("EXEC dbo.Update_IncrementAbortedLoadCount @SessionId=?", int(session["SessionId"]))
-            cursor.commit()
-            data_logging(pyodbc_connection, f"Data load aborted: {session['api_string']}")
-            continue
+    return True
 
-        
-        new_lapId = cursor.execute("SET NOCOUNT ON; EXEC dbo.Get_MaxId @TableName=?", "dbo.Lap").fetchval() + 1
 
-        lap_data["SessionId"] = session["SessionId"]
-        lap_data["id"] = 0
-
-        # Lap
-        for i in range(0, len(lap_data)):
-            lap_data["id"].iloc[i] = new_lapId
-
-            new_lapId += 1
-
-        laps = lap_data[["id", "SessionId", "Time", "Driver", "LapTime", "NumberOfLaps", "NumberOfPitStops", "PitOutTime", "PitInTime", "IsPersonalBest"]][(lap_data["Driver"] != "")]
-
-        # Sector
-        sector_frames = []
-        for i in range(1, 4):
-            sector_frame = lap_data[["id", "Driver", "Sector" + str(i) + "Time", "Sector" + str(i) + "SessionTime"]][(~lap_data["Sector" + str(i) + "Time"].isnull()) & (lap_data["Driver"] != "")]
-            if len(sector_frame) == 0: continue
-            sector_frame.rename(columns={"id": "LapId", "Sector" + str(i) + "Time": "SectorTime", "Sector" + str(i) + "SessionTime": "SectorSessionTime"}, inplace=True)
-            sector_frame["SectorNumber"] = i
-            sector_frames.append(sector_frame)
-
-        sectors = pd.concat(sector_frames)
-        sectors["SessionId"] = session["SessionId"]
-        sectors.sort_values("LapId", inplace=True)
-
-        # Timing data
-        timing_data["SessionId"] = session["SessionId"]
-
-        # Car data
-        car_frames = []
-        for driver in car_data:
-            car_frame = car_data[driver]
-            car_frame["Driver"] = driver
-            car_frames.append(car_frame)
-
-        car_data = pd.concat(car_frames)
-        car_data["SessionId"] = session["SessionId"]
-        car_data.rename(columns={"nGear": "Gear"}, inplace=True)
-
-        # Position data
-        position_frames = []
-        for driver in position_data:
-            position_frame = position_data[driver]
-            position_frame.drop(["index"], axis=1, errors="ignore", inplace=True)
-            position_frame["Driver"] = driver
-            position_frames.append(position_frame)
-
-        position_data = pd.concat(position_frames)
-        position_data["SessionId"] = session["SessionId"]
-
-        # Track status
-        track_status = pd.DataFrame(track_status)
-        track_status["SessionId"] = session["SessionId"]
-
-        # Session status
-        session_status = pd.DataFrame(session_status)
-        session_status["SessionId"] = session["SessionId"]
-
-        # Driver info
-        driver_frames = []
-        i = 0
-        for driver in driver_info:
-            driver_frame = pd.DataFrame(driver_info[driver], index=[i])
-            driver_frames.append(driver_frame)
-            i += 1
-
-        driver_info = pd.concat(driver_frames)
-        driver_info["SessionId"] = session["SessionId"]
-
-        # Weather data
-        try:
-            weather_data = pd.DataFrame(weather_data)
-            weather_data["SessionId"] = session["SessionId"]
-        except NameError:
-            weather_data = pd.DataFrame()
-
-
-        # Compare row counts to SQL
-        existing_counts = pd.read_sql_query(f"SET NOCOUNT ON; EXEC dbo.Get_TelemetryRowCounts @SessionId = {session['SessionId']}", sqlalchemy_engine)
-        existing_total =  existing_counts["Laps"][0] + existing_counts["Sectors"][0] \
-            + existing_counts["TimingData"][0] + existing_counts["CarData"][0] + existing_counts["PositionData"][0] \
-            + existing_counts["TrackStatus"][0] + existing_counts["SessionStatus"][0] + existing_counts["DriverInfo"][0] \
-            + existing_counts["WeatherData"][0]
-        new_total = len(laps) + len(sectors) + len(timing_data) + len(car_data) + len(position_data) \
-            + len(track_status) + len(session_status) + len(driver_info) + len(weather_data)
-
-        if new_total <= existing_total and force_reload == False:
-            # Data already fully loaded, update flag
-            cursor.execute("EXEC dbo.Update_SessionLoadStatus @SessionId=?, @Status=?", int(session["SessionId"]), 1)
-            cursor.commit()
-            data_logging(pyodbc_connection, f"Confirmed data load complete for SessionId {session['SessionId']}")
-        else:
-            # Load /reload data
-            cursor.execute("EXEC dbo.Delete_Telemetry @SessionId=?", int(session["SessionId"]))
-            cursor.commit()
+def merge_car_data_python(cursor, sqlalchemy_engine, session_id):
+    # Python engine for dbo.Merge_CarData; car data is read and merged one driver at a time, and uploaded to a staging table
+    # The staged session is swapped into MergedCarData in one transaction, so readers never see it part written
+    # Returns False if an upload fails, leaving MergedCarData as it was
+    lap_boundaries = pd.read_sql_query(f"SET NOCOUNT ON; EXEC dbo.Read_LapBoundaries @SessionId={int(session_id)};", sqlalchemy_engine)
+    sector_boundaries = pd.read_sql_query(f"SET NOCOUNT ON; EXEC dbo.Read_SectorBoundaries @SessionId={int(session_id)};", sqlalchemy_engine)
 
-            # Break up large datasets into 100k row chunks - Azure SQL returns intermittent errors when maxed out
-            # Retry max three times on any load before giving up
-            for dataset in [
-                (laps, "Lap"),
-                (sectors, "Sector"),
-                (timing_data, "TimingData"),
-                (car_data, "CarData"),
-                (position_data, "PositionData"),
-                (track_status, "TrackStatus"),
-                (session_status, "SessionStatus"),
-                (driver_info, "DriverInfo"),
-                (weather_data, "WeatherData")
-            ]:
-                if len(dataset[0]) == 0: continue
-                
-                data_logging(pyodbc_connection, f"Loading {len(dataset[0])} records to {dataset[1]}")
-                chunk_ranges = []
-                chunk_size = 100000
-                abort = False
-                for i in range(0, int(len(dataset[0]) / chunk_size) + 1):
-                    chunk_ranges.append(
-                        (
-                            i * chunk_size,
-                            min((i + 1) * chunk_size, len(dataset[0]))
-                        )
-                    )
-
-                for chunk_range in chunk_ranges:
-                    success = False
-                    error_count = 0
-                    if len(chunk_ranges) > 1:
-                        data_logging(pyodbc_connection, f"Loading chunk {str(chunk_range[0])}:{str(chunk_range[1])} to {dataset[1]}")
-                    while not success and error_count < 3:
-                        try:
-                            dataset[0].iloc[chunk_range[0]:chunk_range[1]].to_sql(dataset[1], sqlalchemy_engine, if_exists="append", index=False)
-                        except OperationalError:
-                            error_count += 1
-                            data_logging(pyodbc_connection, f"Operational error loading chunk; attempt {str(error_count)}")
-                            time.sleep(5)
-                        else:
-                            success = True
-                            time.sleep(5)
-
-                    if not success:
-                        abort = True
-
-                if abort:
-                    cursor.execute("EXEC dbo.Update_IncrementAbortedLoadCount @SessionId=?", int(session["SessionId"]))
-                    cursor.commit()
-                    data_logging(pyodbc_connection, f"Data load aborted: {session['api_string']}")
-                    break
+    cursor.execute("EXEC dbo.Delete_MergedCarDataStaging @SessionId=?", int(session_id))
+    cursor.commit()
 
-            if not abort:
-                cursor.execute("EXEC dbo.Update_SetNullTimes @SessionId=?", int(session["SessionId"]))
-                cursor.execute("EXEC dbo.Update_SetDriverTeamOrders @SessionId=?", int(session["SessionId"]))
-                cursor.execute("EXEC dbo.Insert_MissingSectors @SessionId=?", int(session["SessionId"]))
+    # Drivers without laps have no merged car data
+    for driver in lap_boundaries["Driver"].dropna().unique():
+        car_data = pd.read_sql_query(f"SET NOCOUNT ON; EXEC dbo.Read_CarDataToMerge @SessionId={int(session_id)}, @Driver={int(driver)};", sqlalchemy_engine)
+        merged_car_data = car_data_merge.merge_car_data(car_data, lap_boundaries, sector_boundaries)
+        del car_data
+        if len(merged_car_data) > 0 and not upload_dataset(cursor, sqlalchemy_engine, merged_car_data, "MergedCarDataStaging"):
+            return False
 
-                cursor.execute("EXEC dbo.Update_SessionLoadStatus @SessionId=?, @Status=?", int(session["SessionId"]), 0)
-                cursor.commit()
-                data_logging(pyodbc_connection, f"Data load at least partially complete for SessionId {session['SessionId']}")
+    cursor.execute("EXEC dbo.Swap_MergedCarData @SessionId=?", int(session_id))
+    cursor.commit()
 
     return True
 
@@ -363,60 +997,103 @@ def run_transforms(pyodbc_connection, sqlalchemy_engine, force_eventId=None, for
             else:
                 sql = "EXEC dbo.Get_SessionsToTransform"
 
-            sessions_frame = pd.read_sql_query("SET NOCOUNT ON; " + sql, sqlalchemy_engine)[["SessionId", "EventId"]]
+            sessions_frame = pd.read_sql_query("SET NOCOUNT ON; " + sql, sqlalchemy_engine)[["SessionId", "EventId", "SessionName"]]
             session_dicts = []
             for i in range(0, len(sessions_frame)):
                 session_dicts.append({
                     "SessionId": sessions_frame["SessionId"].iloc[i],
-                    "EventId": sessions_frame["EventId"].iloc[i]
+                    "EventId": sessions_frame["EventId"].iloc[i],
+                    "SessionName": sessions_frame["SessionName"].iloc[i]
                 })
 
             if len(session_dicts) > 0:
-                data_logging(pyodbc_connection, f"Running transforms for {len(session_dicts)} sessions...")
+                data_logging(f"Running transforms for {len(session_dicts)} sessions...")
 
             for iSession, session_dict in enumerate(session_dicts):
                 sessionId = session_dict["SessionId"]
                 eventId = session_dict["EventId"]
-                data_logging(pyodbc_connection, f"Running transforms for sessionId {sessionId}")
+                sessionName = session_dict["SessionName"]
+                data_logging(f"Running transforms for sessionId {sessionId}")
 
+                # Each step is committed as it completes; log writes are queued separately and no longer commit this connection
                 cursor.execute("SET NOCOUNT ON; EXEC dbo.Update_SessionTransformStatus @SessionId=?, @Status=?", int(sessionId), 0)
+                cursor.commit()
 
                 cursor.execute("SET NOCOUNT ON; EXEC dbo.Merge_UpdateTelemetryTimes @SessionId=?", int(sessionId))
-                data_logging(pyodbc_connection, f"Ran Merge_UpdateTelemetryTimes for sessionId {sessionId}")
+                cursor.commit()
+                data_logging(f"Ran Merge_UpdateTelemetryTimes for sessionId {sessionId}")
 
                 cursor.execute("SET NOCOUNT ON; EXEC dbo.Merge_LapData @SessionId=?", int(sessionId))
-                data_logging(pyodbc_connection, f"Ran Merge_LapData for sessionId {sessionId}")
-
-                cursor.execute("SET NOCOUNT ON; EXEC dbo.Merge_CarData @SessionId=?", int(sessionId))
-                data_logging(pyodbc_connection, f"Ran Merge_CarData for sessionId {sessionId}")
+                cursor.commit()
+                data_logging(f"Ran Merge_LapData for sessionId {sessionId}")
+
+                # Car data is merged in Python for the session types configured, and by the stored procedure otherwise or if that fails
+                time_start = time.time()
+                if car_data_merge.enabled(sessionName) and merge_car_data_python(cursor, sqlalchemy_engine, sessionId):
+                    data_logging(f"Ran Python car data merge for sessionId {sessionId} in {round(time.time() - time_start, 1)}s")
+                else:
+                    if car_data_merge.enabled(sessionName):
+                        data_logging(f"Python car data merge failed for sessionId {sessionId}, running Merge_CarData")
+                    cursor.execute("SET NOCOUNT ON; EXEC dbo.Merge_CarData @SessionId=?", int(sessionId))
+                    cursor.commit()
+                    data_logging(f"Ran Merge_CarData for sessionId {sessionId} in {round(time.time() - time_start, 1)}s")
 
                 cursor.execute("SET NOCOUNT ON; EXEC dbo.Merge_TrackMap @EventId=?", int(eventId))
-                data_logging(pyodbc_connection, f"Ran Merge_TrackMap for SessionId {sessionId}")
+                cursor.commit()
+                data_logging(f"Ran Merge_TrackMap for SessionId {sessionId}")
 
                 cursor.execute("SET NOCOUNT ON; EXEC dbo.Merge_CarDataNorms @SessionId=?", int(sessionId))
-                data_logging(pyodbc_connection, f"Ran Merge_CarDataNorms for SessionId {sessionId}")
+                cursor.commit()
+                data_logging(f"Ran Merge_CarDataNorms for SessionId {sessionId}")
 
                 cursor.execute("SET NOCOUNT ON; EXEC dbo.Update_SessionTransformStatus @SessionId=?, @Status=?", int(sessionId), 1)
-                data_logging(pyodbc_connection, f"Completed transforms for SessionId {sessionId} ({iSession+1} of {len(session_dicts)})")
-
                 cursor.commit()
+                data_logging(f"Completed transforms for SessionId {sessionId} ({iSession+1} of {len(session_dicts)})")
+
+                if prewarm_caches:
+                    prewarm_session_caches(int(eventId), sessionName)
 
         except OperationalError:
             error_count += 1
-            data_logging(pyodbc_connection, f"Operational error during transforms; attempt {str(error_count)}")
+            data_logging(f"Operational error during transforms; attempt {str(error_count)}")
             time.sleep(5)
         else:
             success = True
 
 
-def wrapper(force_eventId=None, force_sessionId=None, force_reload=False):
+def prewarm_session_caches(event_id, session_name):
+    # Builds snapshots for a newly transformed session so that its first user gets a warm cache
+    # Also rebuilds the event's combined practice snapshot once every practice session is available
+    sessions_to_prewarm = [session_name]
+    if session_name.startswith("Practice"):
+        available_sessions = read_database.get_available_sessions()
+        if len(available_sessions[(available_sessions["EventId"] == event_id) & (available_sessions["SessionName"] == "Practice (all)")]) > 0:
+            sessions_to_prewarm.append("Practice (all)")
+
+    for prewarm_session_name in sessions_to_prewarm:
+        # A failure here only means the first user reads from SQL as before, so don't let it fail the transforms
+        time_start = time.time()
+        try:
+            read_database.prepare_session_datasets(event_id, prewarm_session_name, force_refresh=True)
+            if read_database.telemetry_bundle_enabled(prewarm_session_name) and not read_database.light_version:
+                read_database.prepare_telemetry_bundle(event_id, prewarm_session_name, force_refresh=True)
+        except Exception as e:
+            data_logging(f"Failed to pre-warm cache for EventId {event_id}, {prewarm_session_name}: {e}")
+        else:
+            data_logging(f"Pre-warmed cache for EventId {event_id}, {prewarm_session_name} in {round(time.time() - time_start, 1)}s")
+
+
+def wrapper(force_eventId=None, force_sessionId=None, force_reload=False, replay=False):
     # Wraps together the refresh/load/transform functions
+    # Both connections come from the worker's shared pool, so are returned rather than disposed of
+    # Replay loads from the local API archive, skipping the schedule refresh so that no network access is needed
     pyodbc_connection = sql_connection.get_pyodbc_connection()
     sqlalchemy_engine = sql_connection.get_sqlalchemy_engine()
-    refresh_schedule(pyodbc_connection, sqlalchemy_engine)
-    quick_loop = load_session_data(pyodbc_connection, sqlalchemy_engine, force_eventId, force_sessionId, force_reload)
+    if not replay:
+        refresh_schedule(pyodbc_connection, sqlalchemy_engine)
+    quick_loop = load_session_data(pyodbc_connection, sqlalchemy_engine, force_eventId, force_sessionId, force_reload, replay)
     run_transforms(pyodbc_connection, sqlalchemy_engine, force_eventId, force_sessionId)
+    data_logging(f"Connection pool status: {sql_connection.get_pool_status()}")
     pyodbc_connection["connection"].close()
-    sqlalchemy_engine.dispose()
 
     return quick_loop
@@ -0,0 +1,121 @@
+import random
+import threading
+
+
+# Adaptive pacing for uploads to Azure SQL, shared by every upload on this worker
+# Chunk size and concurrency grow while chunks are fast and error free, and are cut back under throttling
+# Failed chunks are retried after an exponential backoff with jitter, so concurrent uploads don't retry in step
+
+# Limits, overwritten from config on app startup
+min_chunk_size = 10000
+max_chunk_size = 1000000
+max_concurrency = 4
+max_retries = 6
+
+# Chunks slower than this shrink the chunk size, chunks faster than half of it grow it
+target_chunk_seconds = 10.0
+
+base_backoff_in_seconds = 2.0
+max_backoff_in_seconds = 120.0
+
+# Pause after each successful chunk, started at the old fixed five seconds and reduced while the database is healthy
+initial_pause_in_seconds = 5.0
+
+# Successful chunks in a row needed before adding another concurrent upload
+successes_to_add_concurrency = 5
+
+state = {
+    "chunk_size": 100000,
+    "concurrency": 1,
+    "pause_in_seconds": initial_pause_in_seconds,
+    "consecutive_successes": 0,
+    "consecutive_errors": 0,
+    "active_uploads": 0
+}
+stats = {
+    "chunks": 0,
+    "rows": 0,
+    "upload_seconds": 0.0,
+    "errors": 0
+}
+state_lock = threading.Condition()
+
+
+def get_chunk_size():
+    with state_lock:
+        return state["chunk_size"]
+
+
+def acquire_upload_slot():
+    # Blocks until fewer uploads are running than the current concurrency allows
+    with state_lock:
+        while state["active_uploads"] >= state["concurrency"]:
+            state_lock.wait()
+        state["active_uploads"] += 1
+
+
+def release_upload_slot():
+    with state_lock:
+        state["active_uploads"] -= 1
+        state_lock.notify_all()
+
+
+def record_success(rows, seconds):
+    # Returns the pause before the next chunk, and a description of any change made, or None
+    decisions = []
+    with state_lock:
+        stats["chunks"] += 1
+        stats["rows"] += rows
+        stats["upload_seconds"] += seconds
+        state["consecutive_errors"] = 0
+        state["consecutive_successes"] += 1
+
+        if seconds > target_chunk_seconds and state["chunk_size"] > min_chunk_size:
+            state["chunk_size"] = max(int(state["chunk_size"] * 0.7), min_chunk_size)
+            decisions.append(f"chunk size down to {state['chunk_size']} after a {round(seconds, 1)}s chunk")
+        elif seconds < target_chunk_seconds / 2 and rows >= state["chunk_size"] and state["chunk_size"] < max_chunk_size:
+            # Only full chunks are evidence that a larger chunk would be handled as quickly
+            state["chunk_size"] = min(int(state["chunk_size"] * 1.5), max_chunk_size)
+            decisions.append(f"chunk size up to {state['chunk_size']}")
+
+        if state["consecutive_successes"] >= successes_to_add_concurrency and state["concurrency"] < max_concurrency:
+            state["concurrency"] += 1
+            state["consecutive_successes"] = 0
+            state_lock.notify_all()
+            decisions.append(f"concurrency up to {state['concurrency']}")
+
+        if state["pause_in_seconds"] > 0:
+            state["pause_in_seconds"] = state["pause_in_seconds"] / 2 if state["pause_in_seconds"] > 0.1 else 0
+        pause_in_seconds = state["pause_in_seconds"]
+
+    return pause_in_seconds, "; ".join(decisions) if len(decisions) > 0 else None
+
+
+def record_error():
+    # Returns the backoff before retrying, and a description of the change made
+    # Multiplicative decrease: halve the chunk size, drop to a single upload and restore the pause between chunks
+    with state_lock:
+        stats["errors"] += 1
+        state["consecutive_successes"] = 0
+        state["consecutive_errors"] += 1
+        state["chunk_size"] = max(state["chunk_size"] // 2, min_chunk_size)
+        state["concurrency"] = 1
+        state["pause_in_seconds"] = max(state["pause_in_seconds"], initial_pause_in_seconds)
+        backoff_in_seconds = min(base_backoff_in_seconds * 2 ** (state["consecutive_errors"] - 1), max_backoff_in_seconds)
+        # Equal jitter: at least half of the backoff, plus a random share of the rest
+        backoff_in_seconds = backoff_in_seconds / 2 + random.uniform(0, backoff_in_seconds / 2)
+        decision = f"chunk size down to {state['chunk_size']}, concurrency down to 1, retrying in {round(backoff_in_seconds, 1)}s"
+
+    return backoff_in_seconds, decision
+
+
+def get_status():
+    with state_lock:
+        status = dict(stats)
+        status["chunk_size"] = state["chunk_size"]
+        status["concurrency"] = state["concurrency"]
+        status["pause_in_seconds"] = round(state["pause_in_seconds"], 2)
+    status["rows_per_second"] = int(status["rows"] / status["upload_seconds"]) if status["upload_seconds"] > 0 else 0
+    status["upload_seconds"] = round(status["upload_seconds"], 1)
+
+    return status
@@ -1,10 +1,31 @@
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
 from dash import html
+import json
+import hashlib
+import filter_index
+import figures
+import file_store
+
+
+# Base layouts per (visual, isMobile), built and validated once through go.Figure then reused as plain dicts
+figure_skeletons = {}
+
+# Layout common to a visual whatever the data, applied on top of the shared base layout
+visual_layouts = {
+    "conditions_plot": {
+        "bargap": 0,
+        "showlegend": False,
+        "selectdirection": "h",
+        "clickmode": "event",
+        "selectionrevision": False,
+        "font_color": "#FFFFFF"
+    }
+}
 
 
-def get_figure(client_info):
-    # Returns a consistent starting point for each visual
+def build_figure_skeleton(visual, is_mobile):
     fig = go.Figure()
     fig.update_layout(
         {
@@ -34,7 +55,7 @@ def get_figure(client_info):
         fixedrange=True
     )
 
-    if client_info["isMobile"]:
+    if is_mobile:
         # Disable more functionality
         fig.update_layout(
             dragmode=False,
@@ -44,15 +65,27 @@ def get_figure(client_info):
             }
         )
 
+    if visual in visual_layouts:
+        fig.update_layout(visual_layouts[visual])
+
+    return figures.from_figure(fig)
+
+
+def get_figure(client_info, visual):
+    # Returns a consistent starting point for each visual
+    skeleton_key = (visual, bool(client_info["isMobile"]))
+    if skeleton_key not in figure_skeletons:
+        figure_skeletons[skeleton_key] = build_figure_skeleton(visual, client_info["isMobile"])
+
     client_height = client_info["height"]
     # Dynamically size figure heights for screen sizes
 
-    return fig
+    return figures.new_figure(figure_skeletons[skeleton_key])
 
 
 def empty_figure(fig, text="No data"):
     # Returns placeholder figure when no data is available (on initiate or when conflicting filters have been applied)
-    fig.add_annotation(
+    figures.add_annotation(fig,
             text=text,
             xref="paper",
             yref="paper",
@@ -60,20 +93,32 @@ def empty_figure(fig, text="No data"):
             y=0.5,
             showarrow=False
         )
-    fig.update_layout(
+    figures.update_layout(fig,
         font_color = "rgb(175, 175, 175)"
     )
-    fig.update_xaxes(
+    figures.update_xaxes(fig,
         visible=False
     )
-    fig.update_yaxes(
+    figures.update_yaxes(fig,
         visible=False
     )
 
     return fig
 
 
-def filter_data(data, filter_dict, ignore=[]):
+def get_filter_index(data_dict, dataset_name):
+
+    # Filter index built for a session dataset on load, if there is one
+    if "filter_indexes" in data_dict and dataset_name in data_dict["filter_indexes"]:
+        return data_dict["filter_indexes"][dataset_name]
+    return None
+
+
+def filter_data(data, filter_dict, ignore=[], index=None):
+
+    # Resolve through the dataset's filter index where given; it is only valid for the unfiltered dataset
+    if index is not None and index["length"] == len(data):
+        return data[filter_index.get_filter_mask(index, data, filter_dict, ignore)]
 
     # Loop through filters and filter dataframe by each
     for field in filter_dict:
@@ -88,6 +133,47 @@ def filter_data(data, filter_dict, ignore=[]):
     return data
 
 
+def get_effective_filters(data, filter_dict, ignore=[]):
+
+    # The filters filter_data would actually apply to a dataset, with values in a canonical order
+    effective_filters = {}
+    for field in filter_dict:
+        if field in ignore:
+            continue
+        if field == "TimeFilter":
+            if "SessionTime" in data.columns:
+                effective_filters[field] = list(filter_dict[field])
+        elif field in data.columns:
+            effective_filters[field] = sorted(set(filter_dict[field]), key=lambda value: (str(type(value)), value))
+
+    return effective_filters
+
+
+def get_filtered_data(data_dict, dataset_name, filter_dict, ignore=[]):
+
+    # Filtered view of a session dataset, shared by every visual callback asking for the same effective filters
+    # Views are held in the memory tier keyed by snapshot, dataset and a hash of the filters, so must not be modified in place
+    data = data_dict[dataset_name]
+    effective_filters = get_effective_filters(data, filter_dict, ignore)
+    index = get_filter_index(data_dict, dataset_name)
+
+    if "snapshot_key" not in data_dict:
+        return filter_data(data, effective_filters, [], index)
+
+    filters_hash = hashlib.md5(json.dumps(effective_filters, sort_keys=True, default=str).encode()).hexdigest()
+    cache_key = (data_dict["snapshot_key"], dataset_name, "filtered_view", filters_hash)
+    view = file_store.memory_cache_get(cache_key)
+    if view is None:
+        view = filter_data(data, effective_filters, [], index)
+        if index is not None:
+            view_size = int(len(view) * index["bytes_per_row"])
+        else:
+            view_size = int(view.memory_usage(deep=True).sum())
+        file_store.memory_cache_put(cache_key, view, view_size)
+
+    return view
+
+
 def filter_exists(filter_dict, filter):
 
     # Determine whether a filter exists for a given field. Used to work out e.g. whether to use sector- or zone-level dataset.
@@ -152,6 +238,26 @@ def ns_to_delta_string(ns, is_benchmark=False):
     return string
 
 
+def ns_to_delta_strings(ns):
+
+    # Vectorised ns_to_delta_string for a series of non-negative deltas, giving the same strings
+
+    ms = ns.to_numpy(dtype="float64") / 1000000
+    s = ms / 1000
+    m = np.trunc(s / 60)
+    rem_s = np.trunc(s - (m * 60))
+    rem_ms = np.trunc(ms - (m * 60 + rem_s) * 1000)
+
+    m_string = pd.Series(m.astype("int64"), index=ns.index).astype(str).str.zfill(2)
+    rem_s_string = pd.Series(rem_s.astype("int64"), index=ns.index).astype(str).str.zfill(2)
+    rem_ms_string = pd.Series(rem_ms.astype("int64"), index=ns.index).astype(str).str.zfill(3)
+
+    seconds_string = "+" + rem_s_string + "." + rem_ms_string
+    minutes_string = "+" + m_string + ":" + rem_s_string + "." + rem_ms_string
+
+    return minutes_string.where(m > 0, seconds_string)
+
+
 def get_time_axis_ticks(time_min, time_max):
 
     # Returns a dynamic number of axis values/labels for time Y axis
@@ -207,24 +313,24 @@ def build_lap_plot(data_dict, filters, client_info):
     # Plot of lap times, banded by team -> driver -> stint
     # Not filtered by laps or stints
 
-    fig = get_figure(client_info)
+    fig = get_figure(client_info, "lap_plot")
 
     if data_dict is None:
         fig = empty_figure(fig)
-        return fig
+        return figures.finish(fig)
 
     if filter_exists(filters, "SectorNumber"):
-        data = data_dict["sector_times"].copy()
+        dataset_name = "sector_times"
         time_field = "SectorTime"
         title_measure = "Sector"
         title_values = filter_values(filters, "SectorNumber")
     elif filter_exists(filters, "ZoneNumber"):
-        data = data_dict["zone_times"].copy()
+        dataset_name = "zone_times"
         time_field = "ZoneTime"
         title_measure = "Zone"
         title_values = filter_values(filters, "ZoneNumber")
     else:
-        data = data_dict["lap_times"].copy()
+        dataset_name = "lap_times"
         time_field = "LapTime"
         title_measure = "Lap"
         title_values = []
@@ -245,14 +351,14 @@ def build_lap_plot(data_dict, filters, client_info):
         subtitle = "<br><sup>Select points to cross filter by lap</sup>"
 
     title = f"<b>{title_measure} Times </b>{title_values_string}{subtitle}"
-    fig.update_layout(
+    figures.update_layout(fig,
         title_text = title
     )
 
-    data = filter_data(data, filters, ignore=["LapId", "StintId"])
+    data = get_filtered_data(data_dict, dataset_name, filters, ["LapId", "StintId"])
     if len(data) == 0:
         fig = empty_figure(fig)
-        return fig
+        return figures.finish(fig)
 
     data = data.groupby(["TeamOrder", "DriverOrder", "StintId", "StintNumber", 
                          "LapsInStint", "LapId", "Compound", "Driver", 
@@ -263,10 +369,9 @@ def build_lap_plot(data_dict, filters, client_info):
 
     min_lap_time = data[time_field].min()
     max_lap_time = data[time_field].max()
-    data["text"] = data[time_field].apply(lambda x: ns_to_delta_string(
-        x if x == min_lap_time else x - min_lap_time, 
-        True if x == min_lap_time else False)
-        )
+    is_min_lap_time = data[time_field] == min_lap_time
+    data["text"] = ns_to_delta_strings(data[time_field] - min_lap_time)
+    data.loc[is_min_lap_time, "text"] = ns_to_delta_string(min_lap_time, True)
     
     compound_colour = {
         "Soft": "rgba(255, 30, 0, 1)",
@@ -277,24 +382,19 @@ def build_lap_plot(data_dict, filters, client_info):
         "Wet": "rgba(41, 114, 237, 1)"
     }
 
-    def colour_opacity(compound, lap_id):
-        if compound not in compound_colour:
-            compound = "Unknown"
-        colour = compound_colour[compound]
-        if filter_exists(filters, "LapId") and lap_id not in filter_values(filters, "LapId"):
-            colour = colour.replace("1)", "0.25)")
-        return colour
+    data["colour"] = data["Compound"].map(compound_colour).fillna(compound_colour["Unknown"])
 
-    data["colour"] = data.apply(lambda x: colour_opacity(x["Compound"], x["LapId"]), axis=1)
-    
     if filter_exists(filters, "LapId"):
-        data["line_colour"] = data["LapId"].apply(lambda x: "rgba(0, 0, 0, 1)" if x in filter_values(filters, "LapId") else "rgba(0, 0, 0, 0.25)")
+        # Fade laps outside the lap selection
+        is_selected_lap = data["LapId"].isin(filter_values(filters, "LapId"))
+        data.loc[~is_selected_lap, "colour"] = data.loc[~is_selected_lap, "colour"].str.replace("1)", "0.25)", regex=False)
+        data["line_colour"] = np.where(is_selected_lap, "rgba(0, 0, 0, 1)", "rgba(0, 0, 0, 0.25)")
     else:
         data["line_colour"] = "rgba(0, 0, 0, 1)"
  
     # Plot times
-    fig.add_trace(
-        go.Scatter(
+    figures.add_trace(fig,
+        figures.scatter(
             x=data.index,
             y=data[time_field],
             mode="markers",
@@ -308,31 +408,41 @@ def build_lap_plot(data_dict, filters, client_info):
     )
 
     # Band by team colours and add X axis labels
-    tick_values = []
-    tick_labels = []
-    previous_driver_index_end = -0.5
-
-    data["DriverTeam"] = data.apply(lambda x: str(x["Driver"]) + x["TeamColour"], axis=1)
+    # One pass over the drivers in plot order; each band ends at its driver's last point
+    data["DriverTeam"] = data["Driver"].astype(str) + data["TeamColour"]
+    driver_bands = data.reset_index().groupby("DriverTeam", sort=False).agg(
+        IndexMax=("index", "max"),
+        Tla=("Tla", "first"),
+        TeamColour=("TeamColour", "first")
+    )
+    x_maxes = driver_bands["IndexMax"].to_numpy() + 0.5
+    x_mins = np.concatenate([[-0.5], x_maxes[:-1]])
+    tick_values = [int(x_min + (x_max - x_min) / 2) for x_min, x_max in zip(x_mins, x_maxes)]
+    tick_labels = list(driver_bands["Tla"])
+
+    figures.add_shapes(fig,
+        [
+            {
+                "type": "rect",
+                "xref": "x",
+                "yref": "y domain",
+                "x0": x_min,
+                "x1": x_max,
+                "y0": 0,
+                "y1": 1,
+                "fillcolor": "#" + team_colour,
+                "layer": "below",
+                "opacity": 1,
+                "line": {
+                    "width": 0.5,
+                    "color": "#FFFFFF"
+                }
+            }
+            for x_min, x_max, team_colour in zip(x_mins, x_maxes, driver_bands["TeamColour"])
+        ]
+    )
 
-    for driver_team in list(data["DriverTeam"].unique()):
-        x_min = previous_driver_index_end
-        x_max = data.index[(data["DriverTeam"] == driver_team)].max() + 0.5
-        x_mid = int(x_min + (x_max - x_min) / 2)
-        previous_driver_index_end = x_max
-        tick_values.append(x_mid)
-        tick_labels.append(data[(data["DriverTeam"] == driver_team)]["Tla"].iloc[0])
-        
-        fig.add_vrect(
-            x0=x_min,
-            x1=x_max,
-            fillcolor="#" + data[(data["DriverTeam"] == driver_team)]["TeamColour"].iloc[0],
-            layer="below",
-            opacity=1,
-            line_width=0.5,
-            line_color="#FFFFFF"
-        )
-        
-    fig.update_xaxes(
+    figures.update_xaxes(fig,
         tickvals=tick_values,
         ticktext=tick_labels,
         range=[-2, len(data) + 2],
@@ -345,7 +455,7 @@ def build_lap_plot(data_dict, filters, client_info):
     # Update Y axis
     tick_values, tick_labels = get_time_axis_ticks(min_lap_time, max_lap_time)
     range_extend = (tick_values[-1] - tick_values[0]) * 0.1
-    fig.update_yaxes(
+    figures.update_yaxes(fig,
         tickvals=tick_values,
         ticktext=tick_labels,
         range=[tick_values[-1] + range_extend, tick_values[0] - range_extend],
@@ -355,11 +465,11 @@ def build_lap_plot(data_dict, filters, client_info):
         linecolor="#B8B8BB"
     )
 
-    fig.update_layout(
+    figures.update_layout(fig,
         showlegend=False
     )
 
-    return fig
+    return figures.finish(fig)
 
 
 def build_track_map(data_dict, filters, client_info):
@@ -367,11 +477,11 @@ def build_track_map(data_dict, filters, client_info):
     # Fastest driver per sector or zone, or time vs session/personal best per sector or zone
     # Not filtered by sector or zone
 
-    fig = get_figure(client_info)
+    fig = get_figure(client_info, "track_map")
 
     if data_dict is None:
         fig = empty_figure(fig)
-        return fig, ""
+        return figures.finish(fig), ""
 
     
     track_map = data_dict["track_map"]
@@ -383,12 +493,12 @@ def build_track_map(data_dict, filters, client_info):
 
 
     if filter_values(filters, "track_split")[0] == "zones":
-        section_times = data_dict["zone_times"]
+        section_dataset_name = "zone_times"
         section_identifier = "ZoneNumber"
         time_identifier = "ZoneTime"
         title_section = "Zone"
     else:
-        section_times = data_dict["sector_times"]
+        section_dataset_name = "sector_times"
         section_identifier = "SectorNumber"
         time_identifier = "SectorTime"
         title_section = "Sector"
@@ -399,9 +509,7 @@ def build_track_map(data_dict, filters, client_info):
     else:
         ignore = ["SectorNumber", "ZoneNumber"]
 
-    section_times = filter_data(section_times, filters, ignore)
-    
-    section_times.reset_index(drop=True, inplace=True)
+    section_times = get_filtered_data(data_dict, section_dataset_name, filters, ignore).reset_index(drop=True)
     sections = list(section_times[section_identifier].unique())
 
     colours = {
@@ -412,10 +520,13 @@ def build_track_map(data_dict, filters, client_info):
 
     # Readout data
     if any(field in ["SectorNumber", "ZoneNumber"] for field in filters):
-        readout_data = filter_data(section_times, filters, ["LapId"])
+        # Filtering the filtered section times again is the same as filtering the dataset ignoring only what both ignore
+        readout_dataset_name = section_dataset_name
+        readout_data = get_filtered_data(data_dict, section_dataset_name, filters, [field for field in ignore if field == "LapId"])
         readout_time_identifier = time_identifier
     else:
-        readout_data = filter_data(data_dict["lap_times"].copy(), filters, ignore)
+        readout_dataset_name = "lap_times"
+        readout_data = get_filtered_data(data_dict, "lap_times", filters, ignore)
         readout_time_identifier = "LapTime"
     
     if len(lap_id_filter) == 1:
@@ -450,7 +561,7 @@ def build_track_map(data_dict, filters, client_info):
         readout = html.Table(readout, style={"color": "#FFFFFF", "background-color": "#555", "margin-top": "50px", "margin-left": "10px", "width": "150px", "font-size": "0.7rem"})
         
     else:
-        readout_frame = filter_data(readout_data, filters).groupby(["Tla", "LapId", "TeamColour"])[readout_time_identifier].sum().reset_index()
+        readout_frame = get_filtered_data(data_dict, readout_dataset_name, filters).groupby(["Tla", "LapId", "TeamColour"])[readout_time_identifier].sum().reset_index()
         readout_driver_bests = readout_frame.groupby(["Tla", "TeamColour"])[readout_time_identifier].min().reset_index()
         readout_driver_bests.sort_values(readout_time_identifier, inplace=True)
         readout_dict_list = readout_driver_bests.to_dict("records")
@@ -473,14 +584,28 @@ def build_track_map(data_dict, filters, client_info):
         readout = html.Table(readout, style={"background-color": "#15151E", "margin-top": "1.5vh", "margin-left": "10px"})
 
     # Draw map
-    for section in sections:
-        track = track_map[(track_map[section_identifier]) == section].copy()
-        track.sort_values("SampleId", inplace=True)
-        track.reset_index(drop=True, inplace=True)
+    # Geometry is pre-split on load; driver, personal and session bests for every section come from one aggregation
+    if "track_sections" in data_dict:
+        section_tracks = data_dict["track_sections"][section_identifier]
+    else:
+        section_tracks = filter_index.split_track_map(track_map)[section_identifier]
+    empty_track = pd.DataFrame({"X": [], "Y": []})
+
+    all_driver_bests = section_times.groupby([section_identifier, "Tla", "TeamColour", "DriverOrder"])[time_identifier].min().reset_index()
+    all_driver_bests.sort_values([section_identifier, time_identifier], kind="stable", inplace=True)
+    section_driver_bests = {
+        section: driver_bests.reset_index(drop=True)
+        for section, driver_bests in all_driver_bests.groupby(section_identifier, sort=False)
+    }
 
-        driver_bests = section_times[(section_times[section_identifier] == section)].groupby(["Tla", "TeamColour", "DriverOrder"])[time_identifier].min().reset_index()
-        driver_bests.sort_values(time_identifier, inplace=True)
-        driver_bests.reset_index(drop=True, inplace=True)
+    if len(lap_id_filter) == 1:
+        lap_section_times = section_times[(section_times["LapId"] == lap_id_filter[0])]
+        lap_sections = {section: lap_section for section, lap_section in lap_section_times.groupby(section_identifier, sort=False)}
+
+    traces = []
+    for section in sections:
+        track = section_tracks.get(section, empty_track)
+        driver_bests = section_driver_bests[section]
 
         if filter_exists(filters, section_identifier) and section not in filter_values(filters, section_identifier):
             opacity = 0.5
@@ -492,10 +617,10 @@ def build_track_map(data_dict, filters, client_info):
 
             lap_id = lap_id_filter[0]
 
-            if len(section_times[(section_times["LapId"] == lap_id) & (section_times[section_identifier] == section)]) == 0:
+            if section not in lap_sections:
                 # Handle missing/erroneous data
-                fig.add_trace(
-                    go.Scatter(
+                traces.append(
+                    figures.scatter(
                         x=track["X"],
                         y=track["Y"],
                         mode="lines+markers",
@@ -510,10 +635,10 @@ def build_track_map(data_dict, filters, client_info):
                     )
                 )
             else:
-                tla = section_times[(section_times["LapId"] == lap_id) & (section_times[section_identifier] == section)]["Tla"].iloc[0]
-                section_time = section_times[(section_times["LapId"] == lap_id) & (section_times[section_identifier] == section)][time_identifier].iloc[0]
+                tla = lap_sections[section]["Tla"].iloc[0]
+                section_time = lap_sections[section][time_identifier].iloc[0]
                 personal_best = driver_bests[(driver_bests["Tla"] == tla)][time_identifier].iloc[0]
-                session_best = driver_bests[time_identifier].min()
+                session_best = driver_bests[time_identifier].iloc[0]
 
                 if section_time == session_best:
                     colour = colours["session_best"]
@@ -525,8 +650,8 @@ def build_track_map(data_dict, filters, client_info):
                     colour = colours["no_improvement"]
                     hover_text = f"No improvement, {ns_to_delta_string(section_time - personal_best)} to personal best,<br>{ns_to_delta_string(section_time - session_best)} to session best"
 
-                fig.add_trace(
-                    go.Scatter(
+                traces.append(
+                    figures.scatter(
                         x=track["X"],
                         y=track["Y"],
                         mode="lines+markers",
@@ -556,8 +681,8 @@ def build_track_map(data_dict, filters, client_info):
                 line =  f"{tla}: {delta}<br>"
                 hover_text += line
 
-            fig.add_trace(
-                go.Scatter(
+            traces.append(
+                figures.scatter(
                     x=track["X"],
                     y=track["Y"],
                     mode="lines+markers",
@@ -574,8 +699,8 @@ def build_track_map(data_dict, filters, client_info):
 
             # If number 2 driver, overlay narrow yellow line
             if driver_bests["DriverOrder"].iloc[0] == 2:
-                fig.add_trace(
-                    go.Scatter(
+                traces.append(
+                    figures.scatter(
                         x=track["X"],
                         y=track["Y"],
                         mode="lines",
@@ -594,7 +719,7 @@ def build_track_map(data_dict, filters, client_info):
                 mid_x = track["X"].iloc[mid_index]
                 mid_y = track["Y"].iloc[mid_index]
  
-                fig.add_annotation(
+                figures.add_annotation(fig,
                     x=mid_x,
                     y=mid_y,
                     text=driver_bests["Tla"].iloc[0],
@@ -606,6 +731,7 @@ def build_track_map(data_dict, filters, client_info):
                     height=10
                 )
 
+    figures.add_traces(fig, traces)
 
     if len(filter_values(filters, "LapId")) == 1:
         lap_number = section_times[(section_times["LapId"] == lap_id)]["NumberOfLaps"].iloc[0]
@@ -622,7 +748,7 @@ def build_track_map(data_dict, filters, client_info):
     else:
         subtitle = f"<br><sup>Select sections to cross filter by {title_section.lower()}</sup>"
     
-    fig.update_layout(
+    figures.update_layout(fig,
         title_text=title_main + subtitle
     )
 
@@ -632,22 +758,22 @@ def build_track_map(data_dict, filters, client_info):
     axis_length = max(x_max - x_min, y_max - y_min)
     axis_length = axis_length * 1.05
     
-    fig.update_xaxes(
+    figures.update_xaxes(fig,
         range=[x_centre - axis_length / 2, x_centre + axis_length / 2],
         visible=False
     )
     
-    fig.update_yaxes(
+    figures.update_yaxes(fig,
         range=[y_centre - axis_length / 2, y_centre + axis_length / 2],
         visible=False
     )
 
-    fig.update_layout(
+    figures.update_layout(fig,
         showlegend=False
     )
 
     return (
-        fig,
+        figures.finish(fig),
         readout
     )
 
@@ -657,24 +783,24 @@ def build_stint_graph(data_dict, filters, client_info):
     # Not filtered by laps
     # Doesn't drive any crossfiltering
 
-    fig = get_figure(client_info)
+    fig = get_figure(client_info, "stint_graph")
 
     if data_dict is None:
         fig = empty_figure(fig)
-        return fig
+        return figures.finish(fig)
 
     if filter_exists(filters, "SectorNumber"):
-        data = data_dict["sector_times"].copy()
+        dataset_name = "sector_times"
         time_field = "SectorTime"
         title_section = "Sector"
         title_values = filter_values(filters, "SectorNumber")
     elif filter_exists(filters, "ZoneNumber"):
-        data = data_dict["zone_times"].copy()
+        dataset_name = "zone_times"
         time_field = "ZoneTime"
         title_section = "Zone"
         title_values = filter_values(filters, "ZoneNumber")
     else:
-        data = data_dict["lap_times"].copy()
+        dataset_name = "lap_times"
         time_field = "LapTime"
         title_section = "Lap"
         title_values = []
@@ -686,10 +812,10 @@ def build_stint_graph(data_dict, filters, client_info):
         ignore = ["LapId"]
         title_over = "Session"
     
-    data = filter_data(data, filters, ignore)
+    data = get_filtered_data(data_dict, dataset_name, filters, ignore)
     if len(data) == 0:
         fig = empty_figure(fig)
-        return fig
+        return figures.finish(fig)
 
     title_values_string = ""
     if title_values != []:
@@ -701,7 +827,7 @@ def build_stint_graph(data_dict, filters, client_info):
             if len(title_values) > i + 1: title_values_string += ", "    
 
     title = f"<b>{title_section} Times over {title_over}</b> {title_values_string}"
-    fig.update_layout(
+    figures.update_layout(fig,
         title_text=title
     )
 
@@ -748,8 +874,8 @@ def build_stint_graph(data_dict, filters, client_info):
             
         trace_name = tla + " stint " + str(trace_data["StintNumber"].iloc[0]) if trace_identifier == "StintId" else tla
         
-        fig.add_trace(
-            go.Scatter(
+        figures.add_trace(fig,
+            figures.scatter(
                 x=trace_data[x_field],
                 y=trace_data[time_field],
                 mode="lines+markers",
@@ -769,8 +895,8 @@ def build_stint_graph(data_dict, filters, client_info):
             if lap_id in list(data["LapId"]):
                 trace_data = data[(data["LapId"]) == lap_id]
                 colour = "#" + trace_data["TeamColour"].iloc[0]
-                fig.add_trace(
-                    go.Scatter(
+                figures.add_trace(fig,
+                    figures.scatter(
                         x=trace_data[x_field],
                         y=trace_data[time_field],
                         mode="markers",
@@ -787,23 +913,23 @@ def build_stint_graph(data_dict, filters, client_info):
     # Update axes
     tick_values, tick_labels = get_time_axis_ticks(min_lap_time, max_lap_time)
     range_extend = (tick_values[-1] - tick_values[0]) * 0.1
-    fig.update_yaxes(
+    figures.update_yaxes(fig,
         tickvals=tick_values,
         ticktext=tick_labels,
         range=[tick_values[-1] + range_extend, tick_values[0] - range_extend],
         zeroline=False,
         gridwidth=0.2
     )
-    fig.update_xaxes(
+    figures.update_xaxes(fig,
         title = x_title
     )
 
-    fig.update_layout(
+    figures.update_layout(fig,
         dragmode=False,
         clickmode="none"
     )
 
-    return fig
+    return figures.finish(fig)
 
 
 def build_inputs_graph(data_dict, filters, client_info, data):
@@ -811,26 +937,26 @@ def build_inputs_graph(data_dict, filters, client_info, data):
     # Car inputs over time for a maximum of two laps
     # Returns an extra boolean to indicate whether any data is being displayed
 
-    fig = get_figure(client_info)
+    fig = get_figure(client_info, "inputs_graph")
 
     if data is None:
         fig = empty_figure(fig)
-        return fig, False
+        return figures.finish(fig), False
 
     if filters["input_trace"] == []:
         fig = empty_figure(fig)
-        return fig, True
+        return figures.finish(fig), True
 
     filtered_lap_ids = filter_values(filters, "LapId")
     if not 2 >= len(filtered_lap_ids) > 0:
         fig = empty_figure(fig, "Filter to one/two laps to view driver input telemetry")
-        return fig, False
+        return figures.finish(fig), False
 
     norms_data = data_dict["car_data_norms"]
     norms = {
-        "RPM": (norms_data["RPMMin"], norms_data["RPMMax"]),
-        "Speed": (norms_data["SpeedMin"], norms_data["SpeedMax"]),
-        "Throttle": (norms_data["ThrottleMin"], norms_data["ThrottleMax"]),
+        "RPM": (norms_data["RPMMin"].iloc[0], norms_data["RPMMax"].iloc[0]),
+        "Speed": (norms_data["SpeedMin"].iloc[0], norms_data["SpeedMax"].iloc[0]),
+        "Throttle": (norms_data["ThrottleMin"].iloc[0], norms_data["ThrottleMax"].iloc[0]),
         "Gear": (0, 8)
     }
 
@@ -847,31 +973,36 @@ def build_inputs_graph(data_dict, filters, client_info, data):
         "Throttle": "#2972ed"
     }
 
+    # Whole-column arithmetic and string concatenation, rather than per sample calls
     for trace in filters["input_trace"]:
         if trace == "Brake":
-            data[trace] = data[trace].apply(lambda x: 1 if x == True else 0)
-            data["text_" + trace] = data[trace].apply(lambda x: "Brake applied" if x == True else "Brake off")
+            is_braking = (data[trace] == True).to_numpy()
+            data[trace] = is_braking.astype("int64")
+            data["text_" + trace] = np.where(is_braking, "Brake applied", "Brake off")
         else:
             trace_min, trace_max = norms[trace]
             trace_range = trace_max - trace_min
-            data["norm_" + trace] = data[trace].apply(lambda x: (x - trace_min) / trace_range)
+            data["norm_" + trace] = (data[trace].to_numpy(dtype="float64") - trace_min) / trace_range
             if trace == "Speed":
-                data["text_" + trace] = data[trace].apply(lambda x: str(x) + " km/h")
+                data["text_" + trace] = data[trace].astype(str) + " km/h"
             elif trace == "RPM":
-                data["text_" + trace] = data[trace].apply(lambda x: str(x) + " RPM")
+                data["text_" + trace] = data[trace].astype(str) + " RPM"
             elif trace == "Gear":
-                data["text_" + trace] = data[trace].apply(lambda x: "Gear " + str(x))
+                data["text_" + trace] = "Gear " + data[trace].astype(str)
             elif trace == "Throttle":
-                data["text_" + trace] = data[trace].apply(lambda x: "Throttle: " + str(x))
-            
+                data["text_" + trace] = "Throttle: " + data[trace].astype(str)
+
+    # Split into laps with one sort and one grouping
+    data = data.sort_values("SessionTime", kind="stable")
+    laps_data = {lap_id: lap_data for lap_id, lap_data in data.groupby("LapId", sort=False)}
+
     first_lap_start_time = 0
     max_lap_end_time = 0
     title_drivers = []
     title_laps = []
     for i, lap_id in enumerate(filtered_lap_ids):
         
-        lap_data = data[(data["LapId"] == lap_id)].copy()
-        lap_data.sort_values("SessionTime", inplace=True)
+        lap_data = laps_data[lap_id]
         
         legend_group = str(i)
         tla = lap_data["Tla"].iloc[0]
@@ -892,8 +1023,8 @@ def build_inputs_graph(data_dict, filters, client_info, data):
             dash_style = "dot"
             
         for trace in filters["input_trace"]:
-            fig.add_trace(
-                go.Scatter(
+            figures.add_trace(fig,
+                figures.scatter(
                     x=lap_data["SessionTime"] - time_offset,
                     y=lap_data["Brake"] if trace == "Brake" else lap_data["norm_" + trace],
                     mode="lines+markers",
@@ -909,7 +1040,7 @@ def build_inputs_graph(data_dict, filters, client_info, data):
             )
 
     # Hide axes
-    fig.update_xaxes(
+    figures.update_xaxes(fig,
         showticklabels=False,
         showgrid=False,
         showline=True,
@@ -918,7 +1049,7 @@ def build_inputs_graph(data_dict, filters, client_info, data):
         title_text="Time",
         range=[first_lap_start_time, max_lap_end_time]
     )
-    fig.update_yaxes(
+    figures.update_yaxes(fig,
         showticklabels=False,
         showgrid=False,
         showline=True,
@@ -952,17 +1083,17 @@ def build_inputs_graph(data_dict, filters, client_info, data):
         title += f"{title_drivers[i]} Lap {str(lap)}"
     title += title_values_string
 
-    fig.update_layout(
+    figures.update_layout(fig,
         title_text=title,
         showlegend=True
     )
 
-    fig.update_layout(
+    figures.update_layout(fig,
         dragmode=False,
         clickmode="none"
     )
 
-    return fig, True
+    return figures.finish(fig), True
 
 
 def build_conditions_plot(data_dict, client_info):
@@ -970,25 +1101,17 @@ def build_conditions_plot(data_dict, client_info):
     # Weather, track status, and track activity over total session time
     # Not crossfiltered by anything
 
-    fig = get_figure(client_info)
-    fig.update_layout(
-        bargap=0,
-        showlegend=False,
-        selectdirection="h",
-        clickmode="event",
-        selectionrevision=False,
-        font_color="#FFFFFF"
-    )
+    fig = get_figure(client_info, "conditions_plot")
 
     if data_dict is None:
         fig = empty_figure(fig)
-        return fig
+        return figures.finish(fig)
 
     data = data_dict["conditions_data"].copy()
 
     if len(data) == 0:
         fig = empty_figure(fig)
-        return fig
+        return figures.finish(fig)
     
     max_laps = float(data["Laps"].max())
     data["Laps"] = data["Laps"].apply(lambda x: x / max_laps)
@@ -1072,8 +1195,8 @@ def build_conditions_plot(data_dict, client_info):
         y_labels.append(metric_dict["axis_label"])
         
         if metric_dict["trace_type"] == "scatter":
-            fig.add_trace(
-                go.Scatter(
+            figures.add_trace(fig,
+                figures.scatter(
                     x=data["SessionTime"],
                     y=data[metric] + y,
                     hoverinfo="text" if metric_dict["hoverable"] == True else "none",
@@ -1084,7 +1207,7 @@ def build_conditions_plot(data_dict, client_info):
             )
         elif metric_dict["trace_type"] == "annotation":
             for i in range(0, len(x_sampled_data)):
-                fig.add_annotation(
+                figures.add_annotation(fig,
                     x=x_sampled_data["SessionTime"].iloc[i],
                     y=y + 0.5,
                     text=data["text_" + metric].iloc[i],
@@ -1105,8 +1228,8 @@ def build_conditions_plot(data_dict, client_info):
             status_colour = status_colours[status]
         else:
             status_colour = "#5B5B61"
-        fig.add_trace(
-            go.Scatter(
+        figures.add_trace(fig,
+            figures.scatter(
                 x=trace_data["SessionTime"],
                 y=[line_y] * len(trace_data),
                 mode="lines+markers",
@@ -1120,14 +1243,14 @@ def build_conditions_plot(data_dict, client_info):
         )
     
     # Update axes
-    fig.update_yaxes(
+    figures.update_yaxes(fig,
         tickvals = y_values,
         ticktext = y_labels,
         zeroline=False,
         showgrid=False,
         range = [0, len(y_values)]
     )
-    fig.update_xaxes(
+    figures.update_xaxes(fig,
         visible=True,
         title_text="Time",
         range=[data["SessionTime"].min(), data["SessionTime"].max()],
@@ -1136,12 +1259,12 @@ def build_conditions_plot(data_dict, client_info):
         showline=True
     )
 
-    fig.update_layout(
+    figures.update_layout(fig,
         margin={"l":100, "r":100, "t":0, "b":0},
         dragmode="select"
     )
 
-    return fig
+    return figures.finish(fig)
 
 
 def shade_conditions_plot(figure_state, filters):
@@ -1149,12 +1272,14 @@ def shade_conditions_plot(figure_state, filters):
     # Takes session time tuple from selectedData xaxis.range output and draws vrects either side
 
     # Build fig from existing dict, clear any existing shapes
-    fig = go.Figure(figure_state)
-    fig.layout.shapes = []
+    fig = {
+        "data": figure_state["data"],
+        "layout": dict(figure_state["layout"], shapes=[])
+    }
 
     # Get time filter values
     if len(filters) == 0:
-        return fig
+        return figures.finish(fig)
 
     filter_min, filter_max = filters["TimeFilter"]
 
@@ -1164,7 +1289,7 @@ def shade_conditions_plot(figure_state, filters):
 
     # Draw shapes
     for x_values in [(x_min, filter_min), (filter_max, x_max)]:
-        fig.add_vrect(
+        figures.add_vrect(fig,
             x0=x_values[0],
             x1=x_values[1],
             fillcolor="rgb(175, 175, 175)",
@@ -1173,7 +1298,7 @@ def shade_conditions_plot(figure_state, filters):
             line_width=0
         )
 
-    return fig
+    return figures.finish(fig)
     
 
 def add_line_to_inputs_graph(figure_state, session_time):
@@ -1181,21 +1306,23 @@ def add_line_to_inputs_graph(figure_state, session_time):
     # Too slow to render in app. Maybe implement as part of a JS clientside callback?
 
     # Build fig from existing dict, clear any existing shapes
-    fig = go.Figure(figure_state)
-    fig.layout.shapes = []
+    fig = {
+        "data": figure_state["data"],
+        "layout": dict(figure_state["layout"], shapes=[])
+    }
 
     if session_time is None:
-        return fig
+        return figures.finish(fig)
 
     x_values = figure_state["data"][0]["x"]
     x_min, x_max = (x_values[0], x_values[-1])
 
     if not x_min <= session_time <= x_max:
-        return fig
+        return figures.finish(fig)
 
-    fig.add_vline(
+    figures.add_vline(fig,
         x=session_time,
         line_color="rgba(255, 0, 255, 0.5)"
     )
 
-    return fig
\ No newline at end of file
+    return figures.finish(fig)